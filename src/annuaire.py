@@ -0,0 +1,123 @@
+from bisect import bisect_left, insort
+from typing import Iterable, Optional
+
+
+def cle_nom(username: str) -> str:
+    """Case-folded form used to compare usernames ("Élodie" == "élodie")."""
+    return str(username).strip().casefold()
+
+
+class AnnuaireUsers(list):
+    """The loaded users, indexed by username.
+
+    Still a list (storage, stats and checkpoints iterate it, synchronisation
+    appends to it), but every change goes through the index: `get` is an
+    exact dict lookup, `trouver` falls back to the case-folded name and
+    `rechercher` lists the users whose name starts with a prefix, from a
+    sorted key list built on first use and then kept up to date.
+    """
+
+    def __init__(self, users: Iterable = ()):
+        super().__init__(users)
+        self._par_nom: dict[str, object] = {}
+        # case-folded name -> users (distinct names may fold the same)
+        self._par_cle: dict[str, list] = {}
+        self._cles_triees: Optional[list[str]] = None
+        for u in self:
+            self._indexer(u)
+
+    def _indexer(self, user) -> None:
+        self._par_nom[user.username] = user
+        cle = cle_nom(user.username)
+        homonymes = self._par_cle.setdefault(cle, [])
+        homonymes.append(user)
+        if self._cles_triees is not None and len(homonymes) == 1:
+            insort(self._cles_triees, cle)
+
+    def _desindexer(self, user) -> None:
+        if self._par_nom.get(user.username) is user:
+            del self._par_nom[user.username]
+        cle = cle_nom(user.username)
+        homonymes = self._par_cle.get(cle, [])
+        if user in homonymes:
+            homonymes.remove(user)
+        if not homonymes:
+            self._par_cle.pop(cle, None)
+            if self._cles_triees is not None:
+                i = bisect_left(self._cles_triees, cle)
+                if i < len(self._cles_triees) and self._cles_triees[i] == cle:
+                    del self._cles_triees[i]
+
+    def append(self, user) -> None:
+        super().append(user)
+        self._indexer(user)
+
+    def extend(self, users: Iterable) -> None:
+        for user in users:
+            self.append(user)
+
+    def insert(self, i: int, user) -> None:
+        super().insert(i, user)
+        self._indexer(user)
+
+    def remove(self, user) -> None:
+        super().remove(user)
+        self._desindexer(user)
+
+    def pop(self, i: int = -1):
+        user = super().pop(i)
+        self._desindexer(user)
+        return user
+
+    def clear(self) -> None:
+        super().clear()
+        self._par_nom.clear()
+        self._par_cle.clear()
+        self._cles_triees = None
+
+    def __setitem__(self, i, valeur) -> None:
+        anciens = self[i] if isinstance(i, slice) else [self[i]]
+        super().__setitem__(i, valeur)
+        for user in anciens:
+            self._desindexer(user)
+        for user in (self[i] if isinstance(i, slice) else [self[i]]):
+            self._indexer(user)
+
+    def __delitem__(self, i) -> None:
+        anciens = self[i] if isinstance(i, slice) else [self[i]]
+        super().__delitem__(i)
+        for user in anciens:
+            self._desindexer(user)
+
+    def __iadd__(self, users):
+        self.extend(users)
+        return self
+
+    def get(self, username: str, defaut=None):
+        return self._par_nom.get(username, defaut)
+
+    def trouver(self, username: str):
+        """The user named `username`, ignoring case when that is unambiguous."""
+        if not username:
+            return None
+        user = self._par_nom.get(username)
+        if user is not None:
+            return user
+        homonymes = self._par_cle.get(cle_nom(username), ())
+        return homonymes[0] if len(homonymes) == 1 else None
+
+    def existe(self, username: str) -> bool:
+        """True if a user has this name, whatever its case (registration check)."""
+        return cle_nom(username) in self._par_cle
+
+    def rechercher(self, prefixe: str, limite: int = 20) -> list:
+        """Users whose case-folded name starts with `prefixe`, sorted by name."""
+        if self._cles_triees is None:
+            self._cles_triees = sorted(self._par_cle)
+        cles, prefixe = self._cles_triees, cle_nom(prefixe)
+        trouves = []
+        i = bisect_left(cles, prefixe)
+        while i < len(cles) and cles[i].startswith(prefixe) and len(trouves) < limite:
+            trouves.extend(self._par_cle[cles[i]])
+            i += 1
+        return trouves[:limite]
@@ -0,0 +1,227 @@
+import gzip
+import json
+import os
+import tempfile
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Iterator, Optional
+
+from .exceptions import ErreurFichier
+from .popularite import FENETRES
+
+# age of the borrow records moved out of the snapshots by default
+ARCHIVE_APRES_JOURS = 2 * 365
+
+
+def _mois(valeur) -> Optional[str]:
+    texte = str(valeur or "")[:10]
+    try:
+        date.fromisoformat(texte)
+    except ValueError:
+        return None
+    return texte[:7]
+
+
+def _texte(data: dict) -> str:
+    # encoded like `FragmentJSON.fragment_json`
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+@dataclass
+class Archivage:
+    """Records picked by `ArchiveHistorique.preparer`, not moved yet.
+
+    Nothing is changed in memory until `ArchiveHistorique.installer`, once
+    the archive files and the trimmed snapshots are committed together.
+    """
+    avant: date
+    # month -> JSON lines to add to its file
+    lignes: dict[str, list[str]] = field(default_factory=dict)
+    # (position in the catalogue / users list, object, records moved)
+    livres: list[tuple[int, object, list]] = field(default_factory=list)
+    users: list[tuple[int, object, list]] = field(default_factory=list)
+    # the index once the records are moved
+    index: dict = field(default_factory=dict)
+
+    @property
+    def nb(self) -> int:
+        return sum(len(lignes) for lignes in self.lignes.values())
+
+    def livre_dict(self, livre, entrees: list) -> dict:
+        ids = {id(e) for e in entrees}
+        return dict(livre.to_dict(), history=[h for h in livre.history if id(h) not in ids])
+
+    def user_dict(self, user, prets: list) -> dict:
+        return dict(user.to_dict(), loans=user.loans.dicts(sauf=prets))
+
+    def retailler(self, bib_data: dict, users_data: list) -> None:
+        """Drop the moved records from snapshot data built by `donnees_snapshot`."""
+        for i, livre, entrees in self.livres:
+            bib_data["livres"][i] = _texte(self.livre_dict(livre, entrees))
+        for i, user, prets in self.users:
+            users_data[i] = _texte(self.user_dict(user, prets))
+
+
+class ArchiveHistorique:
+    """Borrow records moved out of the hot data, one gzip file per month.
+
+    `<bib>.archives/AAAA-MM.jsonl.gz` holds one JSON line per record:
+    `{"ISBN", "entree"}` for an `AggregatedLivre.history` entry and
+    `{"username", "pret"}` for a returned loan, filed under the month it was
+    borrowed. `index.json` counts the records per ISBN and per user and
+    month: it is all that is loaded at start (archived borrows still count
+    in the popularity totals), and showing one title's or user's past only
+    opens the months that hold it.
+    """
+
+    def __init__(self, dossier: str | Path):
+        self.dossier = Path(dossier)
+        self._index: Optional[dict] = None
+
+    @staticmethod
+    def chemin_pour(bib_filepath: str | Path) -> Path:
+        return Path(str(bib_filepath) + ".archives")
+
+    @property
+    def chemin_index(self) -> Path:
+        return self.dossier / "index.json"
+
+    def chemin_mois(self, mois: str) -> Path:
+        return self.dossier / f"{mois}.jsonl.gz"
+
+    @property
+    def index(self) -> dict:
+        if self._index is None:
+            try:
+                with self.chemin_index.open("r", encoding="utf-8") as f:
+                    self._index = json.load(f)
+            except FileNotFoundError:
+                self._index = {}
+            except (OSError, ValueError) as e:
+                raise ErreurFichier(f"Index d'archives illisible '{self.chemin_index}': {e}")
+            self._index.setdefault("livres", {})
+            self._index.setdefault("users", {})
+        return self._index
+
+    def compte_livre(self, isbn: str) -> int:
+        return sum(self.index["livres"].get(isbn, {}).values())
+
+    def comptes_livres(self) -> dict[str, int]:
+        return {isbn: sum(mois.values()) for isbn, mois in self.index["livres"].items()}
+
+    def compte_user(self, username: str) -> int:
+        return sum(self.index["users"].get(username, {}).values())
+
+    def _lire_mois(self, mois: str) -> Iterator[dict]:
+        p = self.chemin_mois(mois)
+        try:
+            with gzip.open(p, "rt", encoding="utf-8") as f:
+                for ligne in f:
+                    if ligne.strip():
+                        yield json.loads(ligne)
+        except FileNotFoundError:
+            return
+        except (OSError, EOFError, ValueError) as e:
+            raise ErreurFichier(f"Archive illisible '{p}': {e}")
+
+    def historique_livre(self, isbn: str) -> Iterator[dict]:
+        """Archived `history` entries of `isbn`, oldest month first."""
+        for mois in sorted(self.index["livres"].get(isbn, {})):
+            for r in self._lire_mois(mois):
+                if r.get("ISBN") == isbn and "entree" in r:
+                    yield r["entree"]
+
+    def prets_user(self, username: str) -> Iterator[dict]:
+        """Archived loans of `username` (as `Loan.to_dict`), oldest month first."""
+        for mois in sorted(self.index["users"].get(username, {})):
+            for r in self._lire_mois(mois):
+                if r.get("username") == username and "pret" in r:
+                    yield r["pret"]
+
+    def preparer(self, biblio, users: list, avant: date) -> Archivage:
+        """Pick the records borrowed before `avant` (Tk thread, read only).
+
+        `avant` must leave the popularity windows whole, so rankings over
+        the last days never need the archive.
+        """
+        limite = date.today() - timedelta(days=max(FENETRES))
+        if avant > limite:
+            raise ValueError(f"Date d'archivage trop récente: {avant} (au plus tard {limite})")
+        borne = avant.isoformat()
+        archivage = Archivage(avant)
+        comptes = {"livres": defaultdict(lambda: defaultdict(int)), "users": defaultdict(lambda: defaultdict(int))}
+        for i, livre in enumerate(biblio.livres):
+            entrees = []
+            for h in getattr(livre, "history", []):
+                mois = _mois(h.get("date_emprunt")) if isinstance(h, dict) else None
+                if mois is None or str(h["date_emprunt"])[:10] >= borne:
+                    continue
+                entrees.append(h)
+                archivage.lignes.setdefault(mois, []).append(json.dumps({"ISBN": livre.ISBN, "entree": h}, ensure_ascii=False))
+                comptes["livres"][livre.ISBN][mois] += 1
+            if entrees:
+                archivage.livres.append((i, livre, entrees))
+        for i, user in enumerate(users):
+            archive = getattr(getattr(user, "loans", None), "archive", None)
+            if archive is None:
+                continue
+            prets = archive.anciens(avant)
+            for p in prets:
+                d = p if isinstance(p, dict) else p.to_dict()
+                mois = _mois(d.get("date_emprunt"))
+                archivage.lignes.setdefault(mois, []).append(json.dumps({"username": user.username, "pret": d}, ensure_ascii=False))
+                comptes["users"][user.username][mois] += 1
+            if prets:
+                archivage.users.append((i, user, prets))
+        index = {cle: {k: dict(v) for k, v in self.index[cle].items()} for cle in ("livres", "users")}
+        for cle, par_nom in comptes.items():
+            for nom, par_mois in par_nom.items():
+                cible = index[cle].setdefault(nom, {})
+                for mois, n in par_mois.items():
+                    cible[mois] = cible.get(mois, 0) + n
+        archivage.index = index
+        return archivage
+
+    def ecrire(self, archivage: Archivage) -> list[tuple[str, str]]:
+        """Write the new month files and index as durable temp files (any
+        thread); returns the `(temp, final)` renames for the commit record."""
+        renommages = []
+        try:
+            self.dossier.mkdir(parents=True, exist_ok=True)
+            for mois, lignes in sorted(archivage.lignes.items()):
+                final = self.chemin_mois(mois)
+                anciennes = []
+                if final.exists():
+                    with gzip.open(final, "rt", encoding="utf-8") as f:
+                        anciennes = [l.rstrip("\n") for l in f if l.strip()]
+                with tempfile.NamedTemporaryFile("wb", dir=str(self.dossier), delete=False) as tf:
+                    renommages.append((tf.name, str(final)))
+                    with gzip.GzipFile(fileobj=tf, mode="wb", mtime=0) as gz:
+                        gz.write("".join(l + "\n" for l in anciennes + lignes).encode("utf-8"))
+                    tf.flush()
+                    os.fsync(tf.fileno())
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=str(self.dossier), delete=False) as tf:
+                renommages.append((tf.name, str(self.chemin_index)))
+                json.dump(archivage.index, tf, ensure_ascii=False)
+                tf.flush()
+                os.fsync(tf.fileno())
+        except Exception as e:
+            for tmp, _ in renommages:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+            raise ErreurFichier(f"Impossible d'écrire les archives '{self.dossier}': {e}")
+        return renommages
+
+    def installer(self, archivage: Archivage) -> None:
+        """After the commit (Tk thread): drop the moved records from memory."""
+        for _, livre, entrees in archivage.livres:
+            ids = {id(e) for e in entrees}
+            livre.history = [h for h in livre.history if id(h) not in ids]
+        for _, user, prets in archivage.users:
+            user.loans.archive.retirer(prets)
+            user.marquer_modifie()
+        self._index = archivage.index
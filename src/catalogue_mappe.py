@@ -0,0 +1,134 @@
+import mmap
+from bisect import bisect_left
+from pathlib import Path
+from typing import Iterator, Optional
+
+from .exceptions import ErreurFichier
+from .snapshot_binaire import _Decodeur
+
+
+class CatalogueMappe:
+    """Read-only catalogue served straight from a binary snapshot (`bib.bin`).
+
+    The file is mapped, not read: opening parses the header and the state
+    table only, and each lookup binary-searches the ISBN index and decodes
+    the records it returns (strings included). Memory use and open time
+    do not depend on the catalogue size. Books are detached copies;
+    nothing is written back. Meant for kiosk-style consultation; the
+    application keeps using `Bibliotheque`.
+    """
+
+    def __init__(self, filepath: str | Path):
+        self.filepath = str(filepath)
+        try:
+            self._fichier = open(self.filepath, "rb")
+        except FileNotFoundError:
+            raise ErreurFichier(f"Fichier '{filepath}' inexistant")
+        except OSError as e:
+            raise ErreurFichier(f"Impossible de lire '{filepath}': {e}")
+        try:
+            self._mmap = mmap.mmap(self._fichier.fileno(), 0, access=mmap.ACCESS_READ)
+            self._vue = memoryview(self._mmap)
+            self._dec = _Decodeur(self._vue, en_place=True)
+        except ErreurFichier:
+            self.fermer()
+            raise
+        except (OSError, ValueError) as e:
+            self.fermer()
+            raise ErreurFichier(f"Impossible de projeter '{filepath}': {e}")
+        self._reservations: Optional[dict] = None
+
+    def __enter__(self) -> "CatalogueMappe":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.fermer()
+
+    def fermer(self) -> None:
+        # views into the mapping must go before it can be closed
+        dec = getattr(self, "_dec", None)
+        if dec is not None:
+            dec.data = None
+            dec.chaines = None
+            self._dec = None
+        vue = getattr(self, "_vue", None)
+        if vue is not None:
+            vue.release()
+            self._vue = None
+        m = getattr(self, "_mmap", None)
+        if m is not None:
+            m.close()
+            self._mmap = None
+        f = getattr(self, "_fichier", None)
+        if f is not None:
+            f.close()
+            self._fichier = None
+
+    def __len__(self) -> int:
+        return self._dec.nb_livres
+
+    def _isbn(self, i: int) -> str:
+        return self._dec.chaines[self._dec.entree_index(i)[0]]
+
+    def _premier(self, isbn: str) -> int:
+        # first index entry whose ISBN is >= `isbn`
+        return bisect_left(_VueIndex(self), isbn)
+
+    def _entrees(self, debut: int, garder) -> Iterator[int]:
+        for i in range(debut, len(self)):
+            if not garder(self._isbn(i)):
+                return
+            yield self._dec.entree_index(i)[1]
+
+    def trouver_exemplaires(self, ISBN: str) -> list:
+        isbn = str(ISBN).strip()
+        return [self._dec.livre(off)[0] for off in self._entrees(self._premier(isbn), isbn.__eq__)]
+
+    def trouver_livre(self, ISBN: str):
+        livres = self.trouver_exemplaires(ISBN)
+        return livres[0] if livres else None
+
+    def rechercher_isbn(self, prefixe: str, limit: int = 50) -> list:
+        """Books whose ISBN starts with `prefixe`, in ISBN order."""
+        prefixe = str(prefixe).strip()
+        livres = []
+        for off in self._entrees(self._premier(prefixe), lambda isbn: isbn.startswith(prefixe)):
+            if len(livres) >= limit:
+                break
+            livres.append(self._dec.livre(off)[0])
+        return livres
+
+    def get_exemplar_statuses(self, ISBN: str) -> dict:
+        # same result as Bibliotheque.get_exemplar_statuses
+        livre = self.trouver_livre(ISBN)
+        if livre is None:
+            return {'disponible': 0, 'emprunte': 0, 'total': 0}
+        stock = livre.exemplaires_stock
+        if stock:
+            c = stock.statuts()
+            c['total'] = len(stock)
+            return c
+        empruntes = max(0, int(livre.nb_exemplaire) - int(livre.disponibles))
+        return {'disponible': int(livre.disponibles), 'emprunte': int(empruntes), 'total': int(livre.nb_exemplaire)}
+
+    def get_reservations(self, ISBN: str) -> list:
+        if self._reservations is None:
+            self._reservations = self._dec.annexes()[0]
+        return list(self._reservations.get(ISBN, []))
+
+    def __iter__(self) -> Iterator:
+        """Every book in catalogue order, decoded one at a time."""
+        return self._dec.iter_livres()
+
+
+class _VueIndex:
+    # the index entries' ISBNs as a sequence, for bisect
+    def __init__(self, catalogue: CatalogueMappe):
+        self._catalogue = catalogue
+
+    def __len__(self) -> int:
+        return len(self._catalogue)
+
+    def __getitem__(self, i: int) -> str:
+        return self._catalogue._isbn(i)
+
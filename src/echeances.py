@@ -0,0 +1,81 @@
+from bisect import bisect_left, insort
+from datetime import date
+from typing import Iterable, Optional
+
+from .prets import prets_en_cours
+
+
+class IndexPrets:
+    """Open loans ordered by `date_retour_prevue`, plus per-user counters.
+
+    Users attached with `suivre` report their borrows and returns
+    (`User.borrow` / `User.return_loan`), so the number of overdue loans is a
+    bisection and the "next N due" list a slice, instead of a walk over
+    every user's loans.
+    """
+
+    def __init__(self):
+        self._echeances: list[tuple[int, int]] = []   # (due ordinal, seq), sorted
+        self._prets: dict[int, tuple[str, object]] = {}  # seq -> (username, loan)
+        self._cles: dict[int, tuple[int, int]] = {}   # id(loan) -> key in _echeances
+        self._actifs: dict[str, int] = {}
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self._prets)
+
+    def suivre(self, users: Iterable) -> None:
+        """Attach users (once each) and index their open loans."""
+        for u in users:
+            if getattr(u, "index_prets", None) is self:
+                continue
+            u.index_prets = self
+            for loan in prets_en_cours(u):
+                self.ajouter(u.username, loan)
+
+    def ajouter(self, username: str, loan) -> None:
+        if id(loan) in self._cles:
+            return
+        self._seq += 1
+        cle = (loan.date_retour_prevue.toordinal(), self._seq)
+        insort(self._echeances, cle)
+        self._prets[self._seq] = (username, loan)
+        self._cles[id(loan)] = cle
+        self._actifs[username] = self._actifs.get(username, 0) + 1
+
+    def retirer(self, username: str, loan) -> None:
+        cle = self._cles.pop(id(loan), None)
+        if cle is None:
+            return
+        i = bisect_left(self._echeances, cle)
+        del self._echeances[i]
+        self._prets.pop(cle[1], None)
+        n = self._actifs.get(username, 0) - 1
+        if n > 0:
+            self._actifs[username] = n
+        else:
+            self._actifs.pop(username, None)
+
+    def nb_en_retard(self, aujourdhui: Optional[date] = None) -> int:
+        aujourdhui = aujourdhui or date.today()
+        return bisect_left(self._echeances, (aujourdhui.toordinal(),))
+
+    def en_retard(self, aujourdhui: Optional[date] = None, n: Optional[int] = None) -> list[tuple[str, object]]:
+        """(username, loan) pairs past their due date, most overdue first;
+        only the first `n` when given."""
+        nb = self.nb_en_retard(aujourdhui)
+        if n is not None:
+            nb = min(n, nb)
+        return [self._prets[seq] for _, seq in self._echeances[:nb]]
+
+    def prochaines_echeances(self, n: int, aujourdhui: Optional[date] = None) -> list[tuple[str, object]]:
+        """The next `n` loans coming due (today included), soonest first."""
+        debut = self.nb_en_retard(aujourdhui)
+        return [self._prets[seq] for _, seq in self._echeances[debut:debut + n]]
+
+    def prets_actifs(self, username: str) -> int:
+        return self._actifs.get(username, 0)
+
+    @property
+    def nb_users_actifs(self) -> int:
+        return len(self._actifs)
@@ -0,0 +1,117 @@
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Callable, Optional
+
+# every operation written on its own / merged over a window or up to a
+# number of operations / merged and written at most once per period
+POLITIQUES = ("immediate", "groupee", "periodique")
+DELAI_MS = 50
+MAX_OPERATIONS = 100
+
+
+@dataclass
+class MesuresEcriture:
+    lots: int = 0
+    operations: int = 0
+    plus_grand_lot: int = 0
+    # seconds from the first operation of a batch to its durable write
+    latence_totale: float = 0.0
+    latence_max: float = 0.0
+    derniere_latence: float = 0.0
+    # seconds spent in the write itself (journal append and fsync)
+    duree_ecriture: float = 0.0
+
+    @property
+    def taille_moyenne(self) -> float:
+        return self.operations / self.lots if self.lots else 0.0
+
+    @property
+    def latence_moyenne(self) -> float:
+        return self.latence_totale / self.lots if self.lots else 0.0
+
+
+class PlanificateurEcritures:
+    """Group commit of the writes prepared by a `Stockage`.
+
+    `ajouter` takes what `Stockage.preparer` returned; operations are merged
+    with `Stockage.fusionner` and handed to the worker as one write, so a
+    burst of returns costs one journal append and one fsync. `politique`
+    picks when a batch is written (see POLITIQUES); `vider` writes the
+    pending batch now. `mesures` counts batches, their size and the latency
+    from the first operation of a batch to its durable write.
+    """
+
+    def __init__(self, stockage, taches, planifier: Callable[[int, Callable], object],
+                 politique: str = "groupee", delai_ms: int = DELAI_MS, max_operations: int = MAX_OPERATIONS,
+                 quand_fini: Optional[Callable] = None, en_erreur: Optional[Callable] = None):
+        if politique not in POLITIQUES:
+            raise ValueError(f"Politique d'ecriture inconnue: {politique!r} (politiques: {', '.join(POLITIQUES)})")
+        self.stockage = stockage
+        self.taches = taches
+        self._planifier = planifier
+        self.politique = politique
+        self.delai_ms = delai_ms
+        self.max_operations = max_operations
+        self._quand_fini = quand_fini
+        self._en_erreur = en_erreur
+        self.mesures = MesuresEcriture()
+        self._lot: Optional[dict] = None
+        self._nb = 0
+        self._debut = 0.0
+        self._minuterie = False
+        self._dernier_vidage = 0.0
+
+    @property
+    def en_attente(self) -> int:
+        """Operations merged but not handed to the worker yet."""
+        return self._nb
+
+    def ajouter(self, ecriture: dict) -> None:
+        if self._lot is None:
+            self._lot, self._nb, self._debut = ecriture, 1, perf_counter()
+        else:
+            self.stockage.fusionner(self._lot, ecriture)
+            self._nb += 1
+        if self.politique == "immediate" or (self.politique == "groupee" and self._nb >= self.max_operations):
+            self.vider()
+        elif not self._minuterie:
+            delai = self.delai_ms
+            if self.politique == "periodique":
+                # at most one write per period, counted from the previous one
+                ecoule = (perf_counter() - self._dernier_vidage) * 1000
+                delai = max(0, int(self.delai_ms - ecoule))
+            self._minuterie = True
+            self._planifier(delai, self._echeance)
+
+    def _echeance(self) -> None:
+        self._minuterie = False
+        self.vider()
+
+    def vider(self) -> None:
+        lot, nb, debut = self._lot, self._nb, self._debut
+        if lot is None:
+            return
+        self._lot, self._nb = None, 0
+        self._dernier_vidage = perf_counter()
+        self.taches.soumettre(self._ecrire, lot, nb, debut,
+                              quand_fini=self._ecrit, en_erreur=self._en_erreur)
+
+    def _ecrire(self, lot: dict, nb: int, debut: float):
+        # worker thread: only the write and its timing
+        t = perf_counter()
+        resultat = self.stockage.ecrire(lot)
+        fin = perf_counter()
+        return resultat, nb, fin - debut, fin - t
+
+    def _ecrit(self, retour) -> None:
+        resultat, nb, latence, duree = retour
+        m = self.mesures
+        m.lots += 1
+        m.operations += nb
+        m.plus_grand_lot = max(m.plus_grand_lot, nb)
+        m.latence_totale += latence
+        m.latence_max = max(m.latence_max, latence)
+        m.derniere_latence = latence
+        m.duree_ecriture += duree
+        if self._quand_fini is not None:
+            self._quand_fini(resultat)
@@ -0,0 +1,129 @@
+import sys
+from typing import Iterable, Iterator, Optional
+
+
+# State table shared by every book: copies store a one-byte code.
+ETATS: list[str] = ["disponible", "emprunte", "endommage", "perdu", "reserve"]
+_CODES: dict[str, int] = {e: i for i, e in enumerate(ETATS)}
+DISPONIBLE = 0
+
+
+def code_etat(etat) -> int:
+    etat = str(etat if etat is not None else "disponible").strip().lower()
+    code = _CODES.get(etat)
+    if code is None:
+        if len(ETATS) >= 256:
+            raise ValueError(f"Trop d'etats d'exemplaire distincts: {etat!r}")
+        code = len(ETATS)
+        ETATS.append(sys.intern(etat))
+        _CODES[ETATS[code]] = code
+    return code
+
+
+class ExemplairesCompacts:
+    """Per-book copy store: ids in one list, states as byte codes.
+
+    Replaces the former list of `{'exemplaire_id', 'etat'}` dicts. Slots are
+    stable (copies are only removed from the end), so a slot number can be
+    kept in an index. Per-state counters make `disponibles` and the status
+    breakdown O(1). `version` changes with every mutation.
+    """
+
+    __slots__ = ("_ids", "_etats", "_compteurs", "version")
+
+    def __init__(self):
+        self._ids: list[str] = []
+        self._etats = bytearray()
+        self._compteurs: list[int] = [0] * len(ETATS)
+        self.version = 0
+
+    @classmethod
+    def depuis_dicts(cls, details: Iterable[dict]) -> "ExemplairesCompacts":
+        store = cls()
+        for d in details or []:
+            store.ajouter(d.get("exemplaire_id"), d.get("etat", "disponible"))
+        return store
+
+    @classmethod
+    def depuis_colonnes(cls, ids: list, codes: bytes) -> "ExemplairesCompacts":
+        # ids and state codes as stored column-wise (binary snapshot)
+        store = cls.__new__(cls)
+        store._ids = ids
+        store._etats = etats = bytearray(codes)
+        store._compteurs = [etats.count(code) for code in range(max(len(ETATS), max(etats, default=0) + 1))]
+        store.version = 0
+        return store
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> Iterator[tuple[str, str]]:
+        for exid, code in zip(self._ids, self._etats):
+            yield exid, ETATS[code]
+
+    def _compter(self, code: int, delta: int) -> None:
+        if code >= len(self._compteurs):
+            self._compteurs.extend([0] * (code + 1 - len(self._compteurs)))
+        self._compteurs[code] += delta
+
+    def ajouter(self, exemplaire_id: str, etat: str = "disponible") -> int:
+        code = code_etat(etat)
+        self._ids.append(exemplaire_id)
+        self._etats.append(code)
+        self._compter(code, 1)
+        self.version += 1
+        return len(self._ids) - 1
+
+    def retirer_dernier(self) -> str:
+        code = self._etats.pop()
+        self._compter(code, -1)
+        self.version += 1
+        return self._ids.pop()
+
+    def tronquer(self, taille: int) -> list[str]:
+        """Keep the first `taille` copies and return the removed ids."""
+        removed = []
+        while len(self._ids) > max(0, taille):
+            removed.append(self.retirer_dernier())
+        return removed
+
+    def ids(self) -> list[str]:
+        # the store's own list, in slot order: do not modify
+        return self._ids
+
+    def id(self, slot: int) -> str:
+        return self._ids[slot]
+
+    def etat(self, slot: int) -> str:
+        return ETATS[self._etats[slot]]
+
+    def changer_etat(self, slot: int, etat: str) -> str:
+        old = self._etats[slot]
+        new = code_etat(etat)
+        if new != old:
+            self._etats[slot] = new
+            self._compter(old, -1)
+            self._compter(new, 1)
+            self.version += 1
+        return ETATS[old]
+
+    def premier(self, etat: str = "disponible") -> Optional[int]:
+        slot = self._etats.find(code_etat(etat))
+        return None if slot < 0 else slot
+
+    def compter(self, etat: str) -> int:
+        code = code_etat(etat)
+        return self._compteurs[code] if code < len(self._compteurs) else 0
+
+    @property
+    def disponibles(self) -> int:
+        return self._compteurs[DISPONIBLE]
+
+    def statuts(self) -> dict:
+        return {ETATS[code]: n for code, n in enumerate(self._compteurs) if n}
+
+    def detail(self, slot: int) -> dict:
+        return {"exemplaire_id": self._ids[slot], "etat": ETATS[self._etats[slot]]}
+
+    def en_dicts(self) -> list[dict]:
+        return [{"exemplaire_id": exid, "etat": ETATS[code]} for exid, code in zip(self._ids, self._etats)]
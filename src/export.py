@@ -0,0 +1,215 @@
+import csv
+import gzip
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+from .exceptions import ErreurFichier
+
+
+def _date(d) -> Optional[str]:
+    return d.isoformat() if d is not None and hasattr(d, "isoformat") else d
+
+
+# mode -> column -> value getter. Each mode also names the objects it walks
+# (see `_sources`) and its default columns.
+_TITRES: dict[str, Callable] = {
+    "type": lambda l: l.type,
+    "titre": lambda l: l.titre,
+    "auteur": lambda l: l.auteur,
+    "ISBN": lambda l: l.ISBN,
+    "taille_fichier": lambda l: getattr(l, "taille_fichier", None),
+    "genre": lambda l: l.genre,
+    "nb_exemplaires": lambda l: l.nb_exemplaire,
+    "disponibles": lambda l: l.disponibles,
+    "nb_avis": lambda l: len(l.reviews),
+    "nb_emprunts": lambda l: len(l.history),
+}
+# (livre, exemplaire_id, etat)
+_EXEMPLAIRES: dict[str, Callable] = {
+    "ISBN": lambda r: r[0].ISBN,
+    "titre": lambda r: r[0].titre,
+    "auteur": lambda r: r[0].auteur,
+    "exemplaire_id": lambda r: r[1],
+    "etat": lambda r: r[2],
+}
+# (username, loan)
+_PRETS: dict[str, Callable] = {
+    "username": lambda r: r[0],
+    "ISBN": lambda r: r[1].isbn,
+    "exemplaire_id": lambda r: r[1].exemplaire_id,
+    "date_emprunt": lambda r: _date(r[1].date_emprunt),
+    "date_retour_prevue": lambda r: _date(r[1].date_retour_prevue),
+    "date_retour_effective": lambda r: _date(r[1].date_retour_effective),
+    "penalite_acquise": lambda r: r[1].penalite_acquise,
+}
+# (livre, review dict)
+_AVIS: dict[str, Callable] = {
+    "ISBN": lambda r: r[0].ISBN,
+    "titre": lambda r: r[0].titre,
+    "username": lambda r: r[1].get("username"),
+    "rating": lambda r: r[1].get("rating"),
+    "comment": lambda r: r[1].get("comment"),
+}
+
+MODES: dict[str, dict[str, Callable]] = {
+    "titres": _TITRES,
+    "exemplaires": _EXEMPLAIRES,
+    "prets": _PRETS,
+    "avis": _AVIS,
+}
+COLONNES_DEFAUT: dict[str, list[str]] = {
+    # same columns as the historical export_csv
+    "titres": ["type", "titre", "auteur", "ISBN", "taille_fichier"],
+    "exemplaires": ["ISBN", "titre", "exemplaire_id", "etat"],
+    "prets": ["username", "ISBN", "exemplaire_id", "date_emprunt", "date_retour_prevue", "date_retour_effective",
+              "penalite_acquise"],
+    "avis": ["ISBN", "username", "rating", "comment"],
+}
+
+
+class _Emprunt:
+    # a `history` entry seen as a Loan (exports without the users)
+    __slots__ = ("isbn", "exemplaire_id", "date_emprunt", "date_retour_prevue", "date_retour_effective",
+                 "penalite_acquise")
+
+    def __init__(self, h: dict):
+        for cle in self.__slots__:
+            setattr(self, cle, h.get(cle))
+
+
+def _sources(biblio, mode: str, users: Optional[Iterable]) -> Iterator:
+    if mode == "titres":
+        yield from biblio.livres
+    elif mode == "exemplaires":
+        for livre in biblio.livres:
+            for exid, etat in livre.exemplaires_stock:
+                yield livre, exid, etat
+    elif mode == "prets":
+        if users is not None:
+            for u in users:
+                for loan in u.loans:
+                    yield u.username, loan
+        else:
+            # without the users, the books' history (one entry per borrow)
+            for livre in biblio.livres:
+                for h in livre.history:
+                    if isinstance(h, dict):
+                        yield h.get("username"), _Emprunt(h)
+    elif mode == "avis":
+        for livre in biblio.livres:
+            for r in livre.reviews:
+                if isinstance(r, dict):
+                    yield livre, r
+
+
+def lignes(biblio, mode: str = "titres", colonnes: Optional[list[str]] = None,
+           users: Optional[Iterable] = None) -> Iterator[tuple]:
+    """Rows of `mode` as tuples of the chosen columns, generated one at a time."""
+    champs = MODES.get(mode)
+    if champs is None:
+        raise ValueError(f"Mode d'export inconnu: {mode!r} (modes: {', '.join(MODES)})")
+    colonnes = list(colonnes or COLONNES_DEFAUT[mode])
+    inconnues = [c for c in colonnes if c not in champs]
+    if inconnues:
+        raise ValueError(f"Colonnes inconnues pour '{mode}': {', '.join(inconnues)}")
+    getters = [champs[c] for c in colonnes]
+    # checked above, before the first row is asked for
+    return (tuple(g(obj) for g in getters) for obj in _sources(biblio, mode, users))
+
+
+def _ecrire_csv(f, colonnes: list[str], rows: Iterable[tuple]) -> int:
+    writer = csv.writer(f)
+    writer.writerow(colonnes)
+    n = 0
+    for row in rows:
+        writer.writerow(row)
+        n += 1
+    return n
+
+
+def _ecrire_jsonl(f, colonnes: list[str], rows: Iterable[tuple]) -> int:
+    # keys are encoded once; each line is assembled from the row tuple
+    cles = [json.dumps(c, ensure_ascii=False) + ":" for c in colonnes]
+    n = 0
+    for row in rows:
+        f.write("{" + ",".join(k + json.dumps(v, ensure_ascii=False) for k, v in zip(cles, row)) + "}\n")
+        n += 1
+    return n
+
+
+def exporter(biblio, filepath: str | Path, mode: str = "titres", colonnes: Optional[list[str]] = None,
+             format: Optional[str] = None, compresser: Optional[bool] = None,
+             users: Optional[Iterable] = None) -> int:
+    """Stream `mode` rows (titres, exemplaires, prets, avis) to `filepath`.
+
+    `format` is "csv" or "jsonl" and `compresser` gzip; both default from
+    the file name (`.jsonl`, `.gz`). Rows go from the models to the file
+    one at a time, through a temporary file replaced at the end. Returns
+    the number of rows written.
+    """
+    p = Path(filepath)
+    suffixes = [s.lower() for s in p.suffixes]
+    if compresser is None:
+        compresser = bool(suffixes) and suffixes[-1] == ".gz"
+    if format is None:
+        format = "jsonl" if ".jsonl" in suffixes else "csv"
+    if format not in ("csv", "jsonl"):
+        raise ValueError(f"Format d'export inconnu: {format!r}")
+    colonnes = list(colonnes or COLONNES_DEFAUT.get(mode, []))
+    rows = lignes(biblio, mode, colonnes, users=users)
+    ecrire = _ecrire_csv if format == "csv" else _ecrire_jsonl
+    tmp = None
+    try:
+        p.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=str(p.parent), prefix=p.name, suffix=".tmp")
+        os.close(fd)
+        if compresser:
+            with gzip.open(tmp, "wt", encoding="utf-8", newline="") as f:
+                n = ecrire(f, colonnes, rows)
+        else:
+            with open(tmp, "w", encoding="utf-8", newline="") as f:
+                n = ecrire(f, colonnes, rows)
+        os.replace(tmp, str(p))
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ErreurFichier(f"Impossible d'exporter '{filepath}': {e}")
+    finally:
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+    return n
+
+
+if __name__ == "__main__":
+    import argparse
+    from .file_manager import BibliothequeAvecFichier
+    from .storage import ouvrir_stockage
+
+    parser = argparse.ArgumentParser(prog="python -m src.export", description="Export du catalogue")
+    parser.add_argument("bib", help="bib.json, bib.bin ou base SQLite")
+    parser.add_argument("sortie", help="fichier produit (.csv, .jsonl, suivi de .gz pour compresser)")
+    parser.add_argument("--users", help="users.json (mode prets)")
+    parser.add_argument("--mode", default="titres", choices=list(MODES))
+    parser.add_argument("--colonnes", help="liste separee par des virgules")
+    args = parser.parse_args()
+
+    b = BibliothequeAvecFichier(Path(args.bib).stem)
+    users = None
+    if Path(args.bib).suffix in (".db", ".sqlite", ".sqlite3"):
+        stockage = ouvrir_stockage(args.bib)
+        stockage.charger(b)
+        users = stockage.charger_users()
+        stockage.fermer()
+    else:
+        b.charger(args.bib, streaming=True)
+        if args.users:
+            from .user_store import DepotUsers
+            depot = DepotUsers(DepotUsers.chemin_pour(args.users))
+            users = depot.tous() if depot.existe() else BibliothequeAvecFichier.charger_users(args.users)
+    n = exporter(b, args.sortie, mode=args.mode, colonnes=args.colonnes.split(",") if args.colonnes else None,
+                 users=users)
+    print(f"{n} lignes exportees vers {args.sortie}", file=sys.stderr)
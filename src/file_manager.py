@@ -1,5 +1,5 @@
 import json
-import csv
+from datetime import date, timedelta
 from pathlib import Path
 from typing import Optional
 import tempfile
@@ -7,11 +7,68 @@ import os
 
 from .models import AggregatedLivre, LivreNumerique, Bibliotheque
 from .exceptions import ErreurFichier
+from .fragments import Fragments, ecrire_json
+from .journal import Journal
 from .users import User
+from .utils import fsync_dossier
+from .verrou import VerrouFichier
 
 
 class BibliothequeAvecFichier(Bibliotheque):
     
+    journal: Optional[Journal] = None
+
+    def ouvrir_journal(self, bib_filepath: str) -> Journal:
+        self.journal = Journal(Journal.chemin_pour(bib_filepath))
+        return self.journal
+
+    def journaliser(self, isbns=(), reservations=(), users=()) -> None:
+        if self.journal is None:
+            raise ErreurFichier("Aucun journal ouvert")
+        self.journal.enregistrer(self, isbns=isbns, reservations=reservations, users=users)
+
+    def checkpoint(self, users: list, bib_filepath: str, users_filepath: str) -> None:
+        # fold the journal into fresh snapshots, then start a new journal and
+        # generation (other processes sharing the files see it, see StockageJSON)
+        with VerrouFichier(VerrouFichier.chemin_pour(bib_filepath)).exclusif() as tenu:
+            self.sauvegarder_transactionnel(users, bib_filepath, users_filepath)
+            Journal(Journal.chemin_pour(bib_filepath)).archiver()
+            tenu.incrementer()
+
+    def archiver_historique(self, users: list, bib_filepath: str, users_filepath: str,
+                            avant: date | None = None) -> int:
+        """Move the borrow records older than `avant` to the monthly archives.
+
+        A checkpoint whose commit also renames the archive files, so a
+        record is either in the snapshots or in the archive, never both.
+        Returns the number of records moved.
+        """
+        from .archives import ARCHIVE_APRES_JOURS, ArchiveHistorique
+        avant = avant or date.today() - timedelta(days=ARCHIVE_APRES_JOURS)
+        archive = ArchiveHistorique(ArchiveHistorique.chemin_pour(bib_filepath))
+        with VerrouFichier(VerrouFichier.chemin_pour(bib_filepath)).exclusif() as tenu:
+            archivage = archive.preparer(self, users, avant)
+            if not archivage.nb:
+                return 0
+            bib_data, users_data = self.donnees_snapshot(users)
+            archivage.retailler(bib_data, users_data)
+            try:
+                BibliothequeAvecFichier.ecrire_snapshots(bib_data, users_data, bib_filepath, users_filepath,
+                                                         autres=archive.ecrire(archivage))
+            except ErreurFichier:
+                if BibliothequeAvecFichier.chemin_commit(bib_filepath).exists():
+                    # committed, the renames finish at next load: memory follows
+                    archive.installer(archivage)
+                    self.archive = archive
+                raise
+            Journal(Journal.chemin_pour(bib_filepath)).archiver()
+            # two generations: other processes reload rather than merge
+            # records that have just been moved
+            tenu.incrementer()
+            tenu.incrementer()
+        archive.installer(archivage)
+        self.archive = archive
+        return archivage.nb
 
     def sauvegarder(self, filepath: str) -> None:
         p = Path(filepath)
@@ -31,95 +88,96 @@ class BibliothequeAvecFichier(Bibliotheque):
             exemplaires_map = {isbn: {"total": counts[isbn], "disponibles": avail[isbn]} for isbn in counts}
 
             data = {
-                "livres": [livre.to_dict() for livre in self.livres],
-                "reservations": getattr(self, "reservations", {}),
+                "livres": Fragments(livre.fragment_json() for livre in self.livres),
+                "reservations": {isbn: list(q) for isbn, q in getattr(self, "reservations", {}).items()},
                 "exemplaires": exemplaires_map,
             }
             dirpath = str(p.parent)
             with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=dirpath, delete=False) as tf:
-                json.dump(data, tf, ensure_ascii=False, indent=2)
+                ecrire_json(tf, data)
                 tf.flush()
                 os.fsync(tf.fileno())
             os.replace(tf.name, str(p))
+            fsync_dossier(p.parent)
         except Exception as e:
             raise ErreurFichier(f"Impossible d'ecrire le fichier '{filepath}': {e}")
 
-    def charger(self, filepath: str) -> None:
+    def charger(self, filepath: str, streaming: bool = False) -> None:
         p = Path(filepath)
+        BibliothequeAvecFichier.recuperer_commit(filepath)
         if not p.exists():
             raise ErreurFichier(f"Fichier '{filepath}' inexistant")
+        from .snapshot_binaire import est_binaire
+        if est_binaire(p):
+            self.charger_binary(filepath, journal_de=filepath)
+            return
+        if streaming:
+            self._charger_flux(p)
+        else:
+            self._charger_json(p)
+        journal = Journal(Journal.chemin_pour(filepath))
+        if journal.existe():
+            journal.rejouer_catalogue(self)
+        from .archives import ArchiveHistorique
+        self.archive = ArchiveHistorique(ArchiveHistorique.chemin_pour(filepath))
+
+    def sauvegarder_binary(self, filepath: str) -> None:
+        from .snapshot_binaire import encoder
+        try:
+            data = encoder(self)
+        except ErreurFichier:
+            raise
+        except Exception as e:
+            raise ErreurFichier(f"Impossible d'encoder le snapshot binaire: {e}")
+        BibliothequeAvecFichier.ecrire_binary(data, filepath)
+
+    @staticmethod
+    def ecrire_binary(data: bytes, filepath: str) -> None:
+        p = Path(filepath)
+        try:
+            p.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile("wb", dir=str(p.parent), delete=False) as tf:
+                tf.write(data)
+                tf.flush()
+                os.fsync(tf.fileno())
+            os.replace(tf.name, str(p))
+            fsync_dossier(p.parent)
+        except Exception as e:
+            raise ErreurFichier(f"Impossible d'ecrire le fichier '{filepath}': {e}")
+
+    def charger_binary(self, filepath: str, journal_de: str | None = None) -> None:
+        # `journal_de`: the JSON catalogue this snapshot stands for, whose
+        # journal is replayed on top
+        from .snapshot_binaire import decoder
+        try:
+            data = Path(filepath).read_bytes()
+        except FileNotFoundError:
+            raise ErreurFichier(f"Fichier '{filepath}' inexistant")
+        except Exception as e:
+            raise ErreurFichier(f"Impossible de lire '{filepath}': {e}")
+        try:
+            decoder(data, self)
+        except ErreurFichier:
+            raise
+        except Exception as e:
+            raise ErreurFichier(f"Snapshot binaire invalide '{filepath}': {e}")
+        if journal_de is not None:
+            journal = Journal(Journal.chemin_pour(journal_de))
+            if journal.existe():
+                journal.rejouer_catalogue(self)
+
+    def _charger_json(self, p: Path) -> None:
         try:
             with p.open("r", encoding="utf-8") as f:
                 data = json.load(f)
         except json.JSONDecodeError as e:
-            raise ErreurFichier(f"Format JSON invalide dans '{filepath}': {e}")
+            raise ErreurFichier(f"Format JSON invalide dans '{p}': {e}")
         except Exception as e:
-            raise ErreurFichier(f"Impossible de lire '{filepath}': {e}")
-        self.livres.clear()
+            raise ErreurFichier(f"Impossible de lire '{p}': {e}")
+        self.livres = []
         livres_data = data.get("livres") if isinstance(data, dict) else data
         for livre_dic in livres_data:
-            
-            exmap = livre_dic.get('exemplaires') or livre_dic.get('exemplaires_map')
-            if livre_dic.get("type") == "Livre Numerique":
-                livre = LivreNumerique(
-                    livre_dic.get("titre", ""),
-                    livre_dic.get("auteur", ""),
-                    livre_dic.get("ISBN", ""),
-                    livre_dic.get("taille_fichier", ""),
-                )
-                if livre_dic.get("genre"):
-                    livre.genre = livre_dic.get("genre")
-                try:
-                    livre.reviews = livre_dic.get("reviews", []) or []
-                except Exception:
-                    livre.reviews = []
-                
-                self.livres.append(livre)
-                continue
-
-            if isinstance(exmap, dict):
-                total = int(exmap.get('total', 1))
-                disponibles = int(exmap.get('disponibles', total))
-            else:
-                
-                total = livre_dic.get('nb_exemplaire') or 1
-                disponibles = livre_dic.get('disponibles') if 'disponibles' in livre_dic else total
-
-            livre = AggregatedLivre(
-                livre_dic.get("titre", ""),
-                livre_dic.get("auteur", ""),
-                livre_dic.get("ISBN", ""),
-                total=int(total),
-                disponibles=int(disponibles),
-            )
-            if livre_dic.get("genre"):
-                livre.genre = livre_dic.get("genre")
-            try:
-                livre.reviews = livre_dic.get("reviews", []) or []
-            except Exception:
-                livre.reviews = []
-            if livre_dic.get("history"):
-                try:
-                    livre.history = livre_dic.get("history", [])
-                except Exception:
-                    livre.history = []
-            
-            if livre_dic.get('exemplaires_details'):
-                try:
-                    livre.exemplaires_details = list(livre_dic.get('exemplaires_details', []))
-                except Exception:
-                    livre.exemplaires_details = []
-            # If per-exemplaire details are present, reconcile aggregate counts
-            if getattr(livre, 'exemplaires_details', None):
-                try:
-                    details = list(livre.exemplaires_details)
-                    livre.nb_exemplaire = len(details)
-                    # count entries whose 'etat' is 'disponible'
-                    livre.disponibles = sum(1 for d in details if str(d.get('etat', 'disponible')).lower() == 'disponible')
-                except Exception:
-                    # keep existing counts on error
-                    pass
-            self.livres.append(livre)
+            self._ajouter_au_catalogue(self._livre_depuis_dict(livre_dic))
 
         self.reservations = {}
         if isinstance(data, dict):
@@ -137,45 +195,128 @@ class BibliothequeAvecFichier(Bibliotheque):
         else:
             self.exemplaires = {}
 
-    def export_csv(self, filepath: str) -> None:
-        p = Path(filepath)
+    def _charger_flux(self, p: Path) -> None:
+        # Same result as charger() but the file is tokenized incrementally:
+        # each book record is decoded, turned into a livre and dropped before
+        # the next one is read, so the raw dict tree never exists in full.
+        from .json_stream import LecteurJSON
+        self.livres = []
+        self.reservations = {}
+        self.exemplaires = {}
         try:
-            p.parent.mkdir(parents=True, exist_ok=True)
-            with p.open("w", encoding="utf-8", newline="") as f:
-                writer = csv.writer(f)
-                writer.writerow(["type", "titre", "auteur", "ISBN", "taille_fichier"])
-                for livre in self.livres:
-                    d = livre.to_dict()
-                    writer.writerow([
-                        d.get("type", ""),
-                        d.get("titre", ""),
-                        d.get("auteur", ""),
-                        d.get("ISBN", ""),
-                        d.get("taille_fichier", ""),
-                    ])
+            with p.open("r", encoding="utf-8") as f:
+                lecteur = LecteurJSON(f)
+                if lecteur.regarder() == "[":
+                    for livre_dic in lecteur.iter_tableau():
+                        self._ajouter_au_catalogue(self._livre_depuis_dict(livre_dic))
+                    return
+                for cle in lecteur.iter_objet():
+                    if cle == "livres" and lecteur.regarder() == "[":
+                        for livre_dic in lecteur.iter_tableau():
+                            self._ajouter_au_catalogue(self._livre_depuis_dict(livre_dic))
+                    elif cle == "reservations" and lecteur.regarder() == "{":
+                        for isbn in lecteur.iter_objet():
+                            self.reservations[isbn] = list(lecteur.valeur())
+                    elif cle == "exemplaires" and lecteur.regarder() == "{":
+                        for isbn in lecteur.iter_objet():
+                            self.exemplaires[str(isbn).strip()] = lecteur.valeur()
+                    else:
+                        lecteur.valeur()
+        except json.JSONDecodeError as e:
+            raise ErreurFichier(f"Format JSON invalide dans '{p}': {e}")
         except Exception as e:
-            raise ErreurFichier(f"Impossible d'exporter CSV '{filepath}': {e}")
+            raise ErreurFichier(f"Impossible de lire '{p}': {e}")
+
+    def _livre_depuis_dict(self, livre_dic: dict) -> AggregatedLivre:
+        
+        exmap = livre_dic.get('exemplaires') or livre_dic.get('exemplaires_map')
+        if livre_dic.get("type") == "Livre Numerique":
+            livre = LivreNumerique(
+                livre_dic.get("titre", ""),
+                livre_dic.get("auteur", ""),
+                livre_dic.get("ISBN", ""),
+                livre_dic.get("taille_fichier", ""),
+            )
+            if livre_dic.get("genre"):
+                livre.genre = livre_dic.get("genre")
+            try:
+                livre.reviews = livre_dic.get("reviews", []) or []
+            except Exception:
+                livre.reviews = []
+            
+            return livre
+
+        if isinstance(exmap, dict):
+            total = int(exmap.get('total', 1))
+            disponibles = int(exmap.get('disponibles', total))
+        else:
+            
+            total = livre_dic.get('nb_exemplaire') or 1
+            disponibles = livre_dic.get('disponibles') if 'disponibles' in livre_dic else total
+
+        livre = AggregatedLivre(
+            livre_dic.get("titre", ""),
+            livre_dic.get("auteur", ""),
+            livre_dic.get("ISBN", ""),
+            total=int(total),
+            disponibles=int(disponibles),
+        )
+        if livre_dic.get("genre"):
+            livre.genre = livre_dic.get("genre")
+        try:
+            livre.reviews = livre_dic.get("reviews", []) or []
+        except Exception:
+            livre.reviews = []
+        if livre_dic.get("history"):
+            try:
+                livre.history = livre_dic.get("history", [])
+            except Exception:
+                livre.history = []
+        
+        # If per-exemplaire details are present, the compact store takes over
+        # the aggregate counts (total and disponibles are derived from it)
+        if livre_dic.get('exemplaires_details'):
+            try:
+                livre.exemplaires_details = livre_dic.get('exemplaires_details', [])
+            except Exception:
+                livre.exemplaires_details = []
+        return livre
+
+    def export_csv(self, filepath: str) -> None:
+        self.exporter(filepath, mode="titres", format="csv", compresser=False)
+
+    def exporter(self, filepath: str, mode: str = "titres", colonnes: list[str] | None = None,
+                 format: str | None = None, compresser: bool | None = None, users: list | None = None) -> int:
+        """Streaming export (titres, exemplaires, prets, avis); see `export.exporter`."""
+        from .export import exporter
+        return exporter(self, filepath, mode=mode, colonnes=colonnes, format=format, compresser=compresser, users=users)
+
+    def import_csv(self, filepath: str, taille_lot: int | None = None):
+        """Streaming import of a catalogue/copies CSV; see `import_csv.importer_csv`."""
+        from .import_csv import TAILLE_LOT, importer_csv
+        return importer_csv(self, filepath, taille_lot or TAILLE_LOT)
 
     @staticmethod
     def sauvegarder_users(users: list, filepath: str) -> None:
         p = Path(filepath)
         try:
             p.parent.mkdir(parents=True, exist_ok=True)
-            data = [u.to_dict() for u in users]
+            data = Fragments(u.fragment_json() for u in users)
             dirpath = str(p.parent)
             with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=dirpath, delete=False) as tf:
-                json.dump(data, tf, ensure_ascii=False, indent=2)
+                ecrire_json(tf, data)
                 tf.flush()
                 os.fsync(tf.fileno())
             os.replace(tf.name, str(p))
+            fsync_dossier(p.parent)
         except Exception as e:
             raise ErreurFichier(f"Impossible d'ecrire le fichier users '{filepath}': {e}")
 
     @staticmethod
-    def charger_users(filepath: str) -> list:
+    def charger_users(filepath: str, journal: Optional[Journal] = None) -> list:
         p = Path(filepath)
         if not p.exists():
-            return []
+            return journal.rejouer_users([]) if journal is not None else []
         try:
             with p.open("r", encoding="utf-8") as f:
                 data = json.load(f)
@@ -189,26 +330,33 @@ class BibliothequeAvecFichier(Bibliotheque):
                 users.append(User.from_dict(ud))
             except Exception:
                 continue
+        if journal is not None:
+            users = journal.rejouer_users(users)
         return users
 
     @staticmethod
-    def notifier_user(username: str, message: str, users_filepath: str) -> None:
-        try:
-            users = BibliothequeAvecFichier.charger_users(users_filepath)
-        except ErreurFichier:
-            users = []
-        updated = False
-        for u in users:
-            if getattr(u, 'username', None) == username:
-                u.notifications.append(message)
-                updated = True
-                break
-        if not updated:
-            from .users import User
-            new = User(username, "")
-            new.notifications.append(message)
-            users.append(new)
-        BibliothequeAvecFichier.sauvegarder_users(users, users_filepath)
+    def notifier_user(username: str, message: str, users_filepath: str | None = None, depot=None) -> None:
+        # `depot` (DepotUsers or a Stockage) touches only this user's record;
+        # a plain users.json path still goes through load-all/save-all
+        if depot is not None:
+            depot.ajouter_notification(username, message)
+        else:
+            try:
+                users = BibliothequeAvecFichier.charger_users(users_filepath)
+            except ErreurFichier:
+                users = []
+            updated = False
+            for u in users:
+                if getattr(u, 'username', None) == username:
+                    u.notifications.append(message)
+                    updated = True
+                    break
+            if not updated:
+                from .users import User
+                new = User(username, "")
+                new.notifications.append(message)
+                users.append(new)
+            BibliothequeAvecFichier.sauvegarder_users(users, users_filepath)
         # Simulate sending an email by appending to a log file in data/
         try:
             from .utils import get_data_dir
@@ -222,70 +370,138 @@ class BibliothequeAvecFichier(Bibliotheque):
             pass
 
     def sauvegarder_transactionnel(self, users: list, bib_filepath: str, users_filepath: str) -> None:
-        bib_p = Path(bib_filepath)
-        users_p = Path(users_filepath)
         try:
-            bib_p.parent.mkdir(parents=True, exist_ok=True)
-            users_p.parent.mkdir(parents=True, exist_ok=True)
+            bib_data, users_data = self.donnees_snapshot(users)
+        except Exception as e:
+            raise ErreurFichier(f"Erreur lors de la sauvegarde transactionnelle: {e}")
+        BibliothequeAvecFichier.ecrire_snapshots(bib_data, users_data, bib_filepath, users_filepath)
 
-            from collections import defaultdict
-            counts = defaultdict(int)
-            avail = defaultdict(int)
-            for livre in self.livres:
-                isbn = str(getattr(livre, 'ISBN', '') or '')
-                total = int(getattr(livre, 'nb_exemplaire', 1))
-                disp = int(getattr(livre, 'disponibles', total))
-                counts[isbn] += total
-                avail[isbn] += disp
-            exemplaires_map = {isbn: {"total": counts[isbn], "disponibles": avail[isbn]} for isbn in counts}
+    def donnees_snapshot(self, users: list) -> tuple[dict, list]:
+        # plain data only, so the writing and fsync can happen on another
+        # thread; books and users are JSON texts, re-encoded only when modified
+        from collections import defaultdict
+        counts = defaultdict(int)
+        avail = defaultdict(int)
+        for livre in self.livres:
+            isbn = str(getattr(livre, 'ISBN', '') or '')
+            total = int(getattr(livre, 'nb_exemplaire', 1))
+            disp = int(getattr(livre, 'disponibles', total))
+            counts[isbn] += total
+            avail[isbn] += disp
+        exemplaires_map = {isbn: {"total": counts[isbn], "disponibles": avail[isbn]} for isbn in counts}
 
-            bib_data = {
-                "livres": [livre.to_dict() for livre in self.livres],
-                "reservations": getattr(self, "reservations", {}),
-                "exemplaires": exemplaires_map,
-            }
-            users_data = [u.to_dict() for u in users]
-
-            bib_dir = str(bib_p.parent)
-            users_dir = str(users_p.parent)
-            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=bib_dir, delete=False) as tf_bib:
-                json.dump(bib_data, tf_bib, ensure_ascii=False, indent=2)
-                tf_bib.flush(); os.fsync(tf_bib.fileno())
-            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=users_dir, delete=False) as tf_users:
-                json.dump(users_data, tf_users, ensure_ascii=False, indent=2)
-                tf_users.flush(); os.fsync(tf_users.fileno())
-
-            os.replace(tf_bib.name, str(bib_p))
-            os.replace(tf_users.name, str(users_p))
+        bib_data = {
+            "livres": Fragments(livre.fragment_json() for livre in self.livres),
+            "reservations": {isbn: list(q) for isbn, q in getattr(self, "reservations", {}).items()},
+            "exemplaires": exemplaires_map,
+        }
+        return bib_data, Fragments(u.fragment_json() for u in users)
+
+    @staticmethod
+    def chemin_commit(bib_filepath: str) -> Path:
+        return Path(str(bib_filepath) + ".commit")
+
+    @staticmethod
+    def ecrire_snapshots(bib_data: dict, users_data: list, bib_filepath: str, users_filepath: str,
+                         autres: list = ()) -> None:
+        # Both temp files are made durable, then one commit record naming the
+        # renames. Once that record exists the commit has happened: the
+        # renames are redone by `recuperer_commit` if a crash interrupts
+        # them, so bib.json and users.json always change together.
+        # `autres` are (temp, final) pairs already durable that join the
+        # same commit (archive files, see archiver_historique).
+        commit = BibliothequeAvecFichier.chemin_commit(bib_filepath)
+        temporaires = [tmp for tmp, _ in autres]
+        try:
+            for filepath, data in ((bib_filepath, bib_data), (users_filepath, users_data)):
+                p = Path(filepath)
+                p.parent.mkdir(parents=True, exist_ok=True)
+                with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=str(p.parent), delete=False) as tf:
+                    temporaires.append(tf.name)
+                    ecrire_json(tf, data)
+                    tf.flush()
+                    os.fsync(tf.fileno())
+            renommages = list(autres) + list(zip(temporaires[len(autres):], (str(bib_filepath), str(users_filepath))))
+            _ecrire_commit(commit, renommages)
         except Exception as e:
-            try:
-                if 'tf_bib' in locals() and tf_bib and Path(tf_bib.name).exists():
-                    os.remove(tf_bib.name)
-            except Exception:
-                pass
-            try:
-                if 'tf_users' in locals() and tf_users and Path(tf_users.name).exists():
-                    os.remove(tf_users.name)
-            except Exception:
-                pass
+            for tmp in temporaires:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
             raise ErreurFichier(f"Erreur lors de la sauvegarde transactionnelle: {e}")
+        try:
+            _appliquer_commit(commit, renommages)
+        except Exception as e:
+            raise ErreurFichier(f"Sauvegarde interrompue, terminée au prochain chargement: {e}")
+
+    @staticmethod
+    def recuperer_commit(bib_filepath: str) -> bool:
+        """Finish a snapshot commit a crash interrupted; True if there was one.
+
+        Redoing the renames is idempotent, so a reader racing the writer
+        that is still applying them ends with the same files.
+        """
+        commit = BibliothequeAvecFichier.chemin_commit(bib_filepath)
+        try:
+            with commit.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            raise ErreurFichier(f"Enregistrement de commit illisible '{commit}': {e}")
+        base = commit.parent
+        _appliquer_commit(commit, [(str(base / tmp), str(base / final)) for tmp, final in data.get("renommer", [])])
+        return True
 
     def reconcile_reservations(self, users: list, persist: bool = False, users_path: str | None = None, bib_path: str | None = None) -> None:
-        
+        # set-based: only the queue entries of unknown users are visited,
+        # through the reservations' username index
         valid_usernames = {getattr(u, 'username', None) for u in users}
-        for isbn, queue in list(getattr(self, 'reservations', {}).items()):
-            newq = [u for u in queue if u in valid_usernames]
-            self.reservations[isbn] = newq
+        for username in self.reservations.utilisateurs() - valid_usernames:
+            for isbn in self.reservations.isbns_de(username):
+                self.reservations[isbn].remove(username)
         for u in users:
             for r in getattr(u, 'reservations', []):
                 isbn = getattr(r, 'isbn', None)
                 if not isbn:
                     continue
-                q = self.reservations.setdefault(isbn, [])
-                if u.username not in q:
-                    q.append(u.username)
+                # no-op when already queued
+                self.reservations.setdefault(isbn).append(u.username)
+        self.reprendre_retenues(users)
         if persist:
             if users_path:
                 BibliothequeAvecFichier.sauvegarder_users(users, users_path)
             if bib_path:
                 self.sauvegarder(bib_path)
+
+
+def _ecrire_commit(commit: Path, renommages: list) -> None:
+    # paths relative to the record, so a moved data directory still recovers
+    base = commit.parent
+    data = {"renommer": [[os.path.relpath(tmp, base), os.path.relpath(final, base)] for tmp, final in renommages]}
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=str(base), delete=False) as tf:
+        json.dump(data, tf)
+        tf.flush()
+        os.fsync(tf.fileno())
+    os.replace(tf.name, str(commit))
+    fsync_dossier(base)
+
+
+def _appliquer_commit(commit: Path, renommages: list) -> None:
+    dossiers = {str(commit.parent)}
+    for tmp, final in renommages:
+        try:
+            os.replace(tmp, final)
+        except FileNotFoundError:
+            # already renamed (recovery after the renames, or a racing reader)
+            pass
+        dossiers.add(str(Path(final).parent))
+    # one directory fsync per directory, however many files were renamed in it
+    for dossier in dossiers:
+        fsync_dossier(dossier)
+    try:
+        os.remove(str(commit))
+    except FileNotFoundError:
+        pass
+    fsync_dossier(commit.parent)
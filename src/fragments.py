@@ -0,0 +1,68 @@
+import json
+from typing import IO, Iterator
+
+
+class FragmentJSON:
+    """Mixin keeping the JSON text of `to_dict()` between saves.
+
+    `_empreinte()` returns the object's scalar fields plus cheap counters
+    for its lists; the cached text is reused while it compares equal.
+    In-place changes it cannot see are signalled with `marquer_modifie()`.
+    A clean object hands back its cached text, so a snapshot only encodes
+    the records changed since the previous one.
+    """
+
+    _fragment = None
+    _fragment_empreinte = None
+
+    def _empreinte(self):
+        return None
+
+    def marquer_modifie(self) -> None:
+        self._fragment = None
+
+    @property
+    def modifie(self) -> bool:
+        return self._fragment is None or self._fragment_empreinte != self._empreinte()
+
+    def fragment_json(self) -> str:
+        """`to_dict()` encoded like the snapshots (indent=2, top level)."""
+        if self.modifie:
+            empreinte = self._empreinte()
+            texte = json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+            self._fragment = texte
+            self._fragment_empreinte = empreinte
+        return self._fragment
+
+
+class Fragments(list):
+    """List of records already encoded by `fragment_json`, written as a
+    JSON array by `ecrire_json`."""
+
+
+def _iter_json(valeur, niveau: int, indent: int) -> Iterator[str]:
+    marge = "\n" + " " * (indent * niveau)
+    interieur = marge + " " * indent
+    if isinstance(valeur, Fragments):
+        if not valeur:
+            yield "[]"
+            return
+        yield "["
+        for i, texte in enumerate(valeur):
+            yield ("," if i else "") + interieur + texte.replace("\n", interieur)
+        yield marge + "]"
+    elif isinstance(valeur, dict) and any(isinstance(v, Fragments) for v in valeur.values()):
+        yield "{"
+        for i, (cle, v) in enumerate(valeur.items()):
+            yield ("," if i else "") + interieur + json.dumps(str(cle), ensure_ascii=False) + ": "
+            yield from _iter_json(v, niveau + 1, indent)
+        yield marge + "}"
+    else:
+        texte = json.dumps(valeur, ensure_ascii=False, indent=indent)
+        yield texte.replace("\n", marge) if niveau else texte
+
+
+def ecrire_json(f: IO[str], valeur, indent: int = 2) -> None:
+    """Same output as `json.dump(valeur, f, ensure_ascii=False, indent=indent)`,
+    with `Fragments` spliced in without decoding them."""
+    f.writelines(_iter_json(valeur, 0, indent))
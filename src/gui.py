@@ -1,21 +1,40 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
+from tkinter import ttk, messagebox, simpledialog, filedialog
 from pathlib import Path
 from typing import Optional
 
+from .annuaire import AnnuaireUsers
 from .file_manager import BibliothequeAvecFichier
 from .models import AggregatedLivre
-from .users import User, SUBSCRIPTIONS
+from .prets import prets_en_cours
+from .ecritures import PlanificateurEcritures
+from .storage import Stockage, ouvrir_stockage
+from .taches import TachesArrierePlan
+from .users import Loan, User, SUBSCRIPTIONS
 from .utils import get_data_dir
 
 
 DATA_DIR = get_data_dir()
 DATA_FILE = DATA_DIR / "bib.json"
 USERS_FILE = DATA_DIR / "users.json"
+# journal records accumulated before they are folded into new snapshots
+JOURNAL_MAX_RECORDS = 500
+# catalogue rows created per step while scrolling the book list
+PAGE_LIGNES = 200
+# saves requested within this delay are merged into one background write
+# (see ecritures.POLITIQUES for the other durability policies)
+POLITIQUE_ECRITURE = "groupee"
+DELAI_REGROUPEMENT_MS = 200
+# how often the files are checked for what other desks wrote
+DELAI_SYNCHRO_MS = 3000
+# names listed when an admin dialog's user name matches several accounts
+CANDIDATS_MAX = 15
+# how often lapsed reservation holds are passed on
+DELAI_RETENUES_MS = 60 * 60 * 1000
 
 
 class BibliothequeApp(tk.Tk):
-    def __init__(self, data_file: Path = DATA_FILE, users_file: Path = USERS_FILE):
+    def __init__(self, data_file: Path = DATA_FILE, users_file: Path = USERS_FILE, stockage: Optional[Stockage] = None):
         super().__init__()
         self.title("Gestionnaire de bibliotheque")
         self.geometry("1200x700")
@@ -25,29 +44,193 @@ class BibliothequeApp(tk.Tk):
         self.users_file = users_file
         # `get_data_dir()` already ensures the directory exists
 
+        self.stockage = stockage or ouvrir_stockage(self.data_file, self.users_file)
         self.biblio = BibliothequeAvecFichier("Mes livres")
-        try:
-            if self.data_file.exists():
-                self.biblio.charger(str(self.data_file))
-        except Exception:
-            pass
-
-        try:
-            self.users = BibliothequeAvecFichier.charger_users(str(self.users_file))
-        except Exception:
-            self.users = []
-
-        try:
-            self.biblio.reconcile_reservations(self.users, persist=True, users_path=str(self.users_file), bib_path=str(self.data_file))
-        except Exception:
-            pass
-
+        self.users = []
         self.current_user: Optional[User] = None
 
+        # persistence and loading run on a worker thread; results come back
+        # through `after()`
+        self.taches = TachesArrierePlan(self.after)
+        self.ecritures = PlanificateurEcritures(self.stockage, self.taches, self.after, politique=POLITIQUE_ECRITURE,
+                                                delai_ms=DELAI_REGROUPEMENT_MS, quand_fini=self._ecriture_terminee,
+                                                en_erreur=self._ecriture_echouee)
+        self._journal_records = 0
+        self._chargement = True
+        self._sondage_postes = False
+        self._import_en_cours = False
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+
         self._build_ui()
         self._refresh_list()
+        self._set_statut("Chargement…")
+        self.taches.soumettre(self._charger_donnees, quand_fini=self._donnees_chargees,
+                              en_erreur=lambda e: self._donnees_chargees((BibliothequeAvecFichier("Mes livres"), [], [str(e)])))
+
+    @property
+    def users(self) -> AnnuaireUsers:
+        return self._users
+
+    @users.setter
+    def users(self, users) -> None:
+        # loaders hand back plain lists: index them by username
+        self._users = users if isinstance(users, AnnuaireUsers) else AnnuaireUsers(users)
+
+    def _charger_donnees(self):
+        # worker thread: fills objects the Tk thread does not see yet
+        erreurs = []
+        biblio = BibliothequeAvecFichier("Mes livres")
+        try:
+            self.stockage.charger(biblio)
+        except Exception as e:
+            erreurs.append(f"Catalogue: {e}")
+        users = []
+        try:
+            # indexed here, off the Tk thread
+            users = AnnuaireUsers(self.stockage.charger_users())
+        except Exception as e:
+            erreurs.append(f"Utilisateurs: {e}")
+        return biblio, users, erreurs
+
+    def _donnees_chargees(self, resultat):
+        biblio, users, erreurs = resultat
+        self.biblio = biblio
+        self.users = users
+        self.biblio.prets.suivre(self.users)
+        self._chargement = False
+        try:
+            self.biblio.reconcile_reservations(self.users)
+            self._checkpoint()
+        except Exception as e:
+            erreurs.append(f"Réservations: {e}")
+        self._refresh_list()
+        self._set_statut("")
+        if erreurs:
+            messagebox.showerror("Erreur de chargement", "\n".join(erreurs))
+        if not self._sondage_postes:
+            self._sondage_postes = True
+            self.after(DELAI_SYNCHRO_MS, self._sonder_autres_postes)
+            self._expirer_retenues()
+
+    def _sonder_autres_postes(self):
+        # other desks sharing data/: merge what they wrote. Skipped while our
+        # own writes are in flight, their results bring the same news
+        if not self._chargement and not self.taches.en_cours and not self.ecritures.en_attente:
+            self.taches.soumettre(self.stockage.synchroniser, quand_fini=self._synchroniser,
+                                  en_erreur=lambda e: None)
+        self.after(DELAI_SYNCHRO_MS, self._sonder_autres_postes)
+
+    def _synchroniser(self, synchro):
+        if synchro is None:
+            return
+        if synchro.recharger:
+            self._recharger(synchro.conflits)
+            return
+        conflits = self.stockage.appliquer(self.biblio, self.users, synchro)
+        if synchro.users:
+            # holds given or lapsed on another desk
+            isbns = self.biblio.reprendre_retenues(self.users)
+            if isbns:
+                self._persister(isbns=isbns)
+        if synchro.livres or synchro.reservations or synchro.users:
+            self._refresh_list()
+        if conflits:
+            messagebox.showwarning("Modifié sur un autre poste",
+                                   "Opération annulée, ces données ont changé sur un autre poste :\n" + "\n".join(conflits))
+
+    def _recharger(self, conflits=()):
+        # the journal this desk was following has been folded twice: start over
+        self._chargement = True
+        self._set_statut("Rechargement…")
+        username = self.current_user.username if self.current_user else None
+
+        def recharge(resultat):
+            self._donnees_chargees(resultat)
+            self.current_user = self.users.get(username)
+            if conflits:
+                messagebox.showwarning("Modifié sur un autre poste",
+                                       "Opération annulée, les données ont été rechargées :\n" + "\n".join(conflits))
+
+        self.taches.soumettre(self._charger_donnees, quand_fini=recharge,
+                              en_erreur=lambda e: self._donnees_chargees((self.biblio, self.users, [str(e)])))
+
+    def _set_statut(self, texte: str):
+        if hasattr(self, 'lbl_statut'):
+            self.lbl_statut.config(text=texte)
+
+    def _persister(self, isbns=(), reservations=(), users=()) -> bool:
+        # write only the touched records (journal append or SQLite rows).
+        # Serializing happens here, on the Tk thread; the write itself is
+        # batched with the other saves by `self.ecritures` and done by the
+        # worker.
+        try:
+            ecriture = self.stockage.preparer(self.biblio, isbns=isbns, reservations=reservations, users=users)
+        except Exception as e:
+            messagebox.showerror("Erreur", f"Echec sauvegarde: {e}")
+            return False
+        self.ecritures.ajouter(ecriture)
+        self._journal_records += len(isbns) + len(reservations) + len(users)
+        self._set_statut("Sauvegarde…")
+        if self._journal_records >= JOURNAL_MAX_RECORDS:
+            self._checkpoint()
+        return True
+
+    def _ecriture_terminee(self, synchro=None):
+        self._synchroniser(synchro)
+        if not self.taches.en_cours and not self.ecritures.en_attente:
+            m = self.ecritures.mesures
+            self._set_statut(f"Enregistré ({m.derniere_latence * 1000:.0f} ms, "
+                             f"{m.taille_moyenne:.1f} opérations par écriture)" if m.lots else "Enregistré")
+
+    def _ecriture_echouee(self, erreur):
+        self._set_statut("Echec de la sauvegarde")
+        messagebox.showerror("Erreur", f"Echec sauvegarde: {erreur}")
+
+    def _checkpoint(self, complet: bool = False):
+        # pending writes go first so the worker keeps the order
+        self.ecritures.vider()
+        donnees = self.stockage.preparer_checkpoint(self.biblio, self.users, complet=complet)
+        self._journal_records = 0
+        self._set_statut("Sauvegarde…")
+        self.taches.soumettre(self.stockage.ecrire_checkpoint, donnees,
+                              quand_fini=self._ecriture_terminee, en_erreur=self._ecriture_echouee)
+
+    def ajouter_notification(self, username: str, message: str) -> None:
+        # used as the `depot` of retourner_exemplaire: keep the loaded user
+        # and the saved one in step through the write queue
+        user = self.users.get(username)
+        if user is None:
+            self.stockage.ajouter_notification(username, message)
+            return
+        user.notifications.append(message)
+        self._persister(users=[user])
+
+    def _expirer_retenues(self):
+        # only the holds past their deadline are visited; the users they
+        # move between are saved by the notifications (see ajouter_notification)
+        if not self._chargement:
+            echues = self.biblio.expirer_retenues(depot=self)
+            if echues:
+                isbns = sorted({retenue.isbn for retenue, _ in echues})
+                self._persister(isbns=isbns, reservations=isbns)
+                self._refresh_list()
+        self.after(DELAI_RETENUES_MS, self._expirer_retenues)
+
+    def _on_close(self):
+        if not self._chargement:
+            try:
+                self._checkpoint()
+            except Exception as e:
+                # the journal still holds every change; it is replayed at next start
+                messagebox.showerror("Erreur", f"Echec du checkpoint: {e}")
+        self.taches.fermer()
+        self.stockage.fermer()
+        self.destroy()
 
     def _build_ui(self):
+        self.lbl_statut = ttk.Label(self, text="", anchor=tk.W, padding=(8, 2))
+        self.lbl_statut.pack(side=tk.BOTTOM, fill=tk.X)
+
         top = ttk.Frame(self, padding=8)
         top.pack(fill=tk.X)
 
@@ -105,10 +288,21 @@ class BibliothequeApp(tk.Tk):
         ttk.Button(searchfrm, text="Rechercher", command=self._on_search).pack(side=tk.LEFT, padx=4)
 
         cols = ("#", "Titre", "Auteur", "Genre", "ISBN", "Exemplaire", "Etat", "Dispo/Total")
-        self.tree = ttk.Treeview(left, columns=cols, show="headings")
+        treefrm = ttk.Frame(left)
+        treefrm.pack(fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(treefrm, columns=cols, show="headings")
         for c in cols:
             self.tree.heading(c, text=c)
-        self.tree.pack(fill=tk.BOTH, expand=True)
+        self.tree_scroll = ttk.Scrollbar(treefrm, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_tree_scroll)
+        self.tree_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        # virtual list: ISBNs of the current view, only the first
+        # `_lignes_chargees` of them have a Treeview row
+        self._vue_isbns: list = []
+        self._vue_groupes: dict = {}
+        self._vue_iids: list = []
+        self._vue_valeurs: list = []
 
         books_action_frame = ttk.Frame(left)
         books_action_frame.pack(fill=tk.X, pady=6)
@@ -121,6 +315,7 @@ class BibliothequeApp(tk.Tk):
         self.admin_frame = ttk.Frame(left)
         self.admin_frame.pack(fill=tk.X, pady=6)
         ttk.Button(self.admin_frame, text="Ajouter exemplaire", command=self._admin_add_exemplar).pack(side=tk.LEFT, padx=4)
+        ttk.Button(self.admin_frame, text="Importer CSV", command=self._admin_import_csv).pack(side=tk.LEFT, padx=4)
         ttk.Button(self.admin_frame, text="Supprimer livre (ISBN)", command=self._admin_delete_by_isbn).pack(side=tk.LEFT, padx=4)
         ttk.Button(self.admin_frame, text="Marquer exemplaire endommagé", command=self._admin_mark_damaged).pack(side=tk.LEFT, padx=4)
         ttk.Button(self.admin_frame, text="Renouveler abonnement utilisateur", command=self._admin_renew_subscription).pack(side=tk.LEFT, padx=4)
@@ -129,6 +324,7 @@ class BibliothequeApp(tk.Tk):
         ttk.Button(self.admin_frame, text="Modifier genre (ISBN)", command=self._admin_set_genre).pack(side=tk.LEFT, padx=4)
         ttk.Button(self.admin_frame, text="Modifier genre (sélection)", command=self._admin_set_genre_selected).pack(side=tk.LEFT, padx=4)
         ttk.Button(self.admin_frame, text="Stats bibliothèque", command=self._admin_show_stats).pack(side=tk.LEFT, padx=4)
+        ttk.Button(self.admin_frame, text="Archiver l'historique", command=self._admin_archive_history).pack(side=tk.LEFT, padx=4)
 
         
         ttk.Label(right_inner, text="Utilisateur connecté:").pack(anchor=tk.W)
@@ -161,6 +357,9 @@ class BibliothequeApp(tk.Tk):
 
     
     def _show_login(self):
+        if self._chargement:
+            messagebox.showinfo("Patientez", "Chargement des données en cours")
+            return
         dlg = tk.Toplevel(self)
         dlg.title("Se connecter")
         ttk.Label(dlg, text="Nom d'utilisateur:").grid(column=0, row=0, sticky=tk.W, padx=6, pady=6)
@@ -173,17 +372,20 @@ class BibliothequeApp(tk.Tk):
         def do_login():
             uname = e_user.get().strip()
             pwd = e_pwd.get().strip()
-            for u in self.users:
-                if u.username == uname and u.check_password(pwd):
-                    self.current_user = u
-                    self._on_login()
-                    dlg.destroy()
-                    return
+            u = self.users.trouver(uname)
+            if u is not None and u.check_password(pwd):
+                self.current_user = u
+                self._on_login()
+                dlg.destroy()
+                return
             messagebox.showerror("Erreur", "Nom d'utilisateur ou mot de passe invalide")
 
         ttk.Button(dlg, text="Se connecter", command=do_login).grid(column=0, row=2, columnspan=2, pady=8)
 
     def _show_register(self):
+        if self._chargement:
+            messagebox.showinfo("Patientez", "Chargement des données en cours")
+            return
         dlg = tk.Toplevel(self)
         dlg.title("S'inscrire")
         dlg.geometry("340x220")
@@ -209,13 +411,14 @@ class BibliothequeApp(tk.Tk):
             if not uname or not pwd:
                 messagebox.showwarning("Champs manquants", "Remplissez nom et mot de passe")
                 return
-            if any(u.username == uname for u in self.users):
+            if self.users.existe(uname):
                 messagebox.showwarning("Existe", "Nom d'utilisateur déjà utilisé")
                 return
             # allow creating an admin account if checkbox checked
             new = User.create(uname, pwd, subscription_type=sub, is_admin=bool(is_admin_var.get()))
             self.users.append(new)
-            BibliothequeAvecFichier.sauvegarder_users(self.users, str(self.users_file))
+            self.biblio.prets.suivre([new])
+            self._persister(users=[new])
             messagebox.showinfo("Ok", "Compte créé. Connectez-vous.")
             dlg.destroy()
 
@@ -231,7 +434,7 @@ class BibliothequeApp(tk.Tk):
             messagebox.showinfo("Notifications", msgs)
             
             self.current_user.notifications.clear()
-            BibliothequeAvecFichier.sauvegarder_users(self.users, str(self.users_file))
+            self._persister(users=[self.current_user])
         self._refresh_user_panel()
         
         if self.current_user and self.current_user.is_admin:
@@ -254,15 +457,14 @@ class BibliothequeApp(tk.Tk):
         auteur = self.entry_search.get().strip()
         titre = getattr(self, 'entry_title', None) and self.entry_title.get().strip()
         genre = getattr(self, 'combo_genre', None) and (self.combo_genre.get() or '').strip()
-        if not auteur and not titre:
+        if not auteur and not titre and not genre:
             self._refresh_list()
             return
-        if titre:
-            resultats = [lv for lv in self.biblio.lister() if titre.lower() in getattr(lv, 'titre', '').lower()]
-        else:
-            resultats = self.biblio.recherche_par_auteur(auteur)
-        if genre:
-            resultats = [lv for lv in resultats if getattr(lv, 'genre', None) and genre.lower() in getattr(lv, 'genre', '').lower()]
+        # every word is matched as a prefix (accents and case ignored)
+        resultats = self.biblio.rechercher(titre=titre, auteur=auteur, genre=genre)
+        if not resultats:
+            # tolerate one typo per word before giving up
+            resultats = self.biblio.rechercher(titre=titre, auteur=auteur, genre=genre, fuzzy=1)
         self._populate_tree(resultats)
 
     def _refresh_list(self):
@@ -270,58 +472,93 @@ class BibliothequeApp(tk.Tk):
         self._refresh_user_panel()
 
     def _populate_tree(self, livres):
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-        
+        # Rows are created a page at a time as the list is scrolled. When the
+        # view keeps the same ISBNs (refresh after a borrow, a return...),
+        # only the loaded rows whose values changed are updated.
         try:
-            genres = sorted({getattr(lv, 'genre') for lv in self.biblio.lister() if getattr(lv, 'genre', None)})
-            if hasattr(self, 'combo_genre'):
-                self.combo_genre['values'] = [''] + genres
+            genres = [''] + self.biblio.recherche.genres()
+            if hasattr(self, 'combo_genre') and genres != getattr(self, '_genres_affiches', None):
+                self.combo_genre['values'] = genres
+                self._genres_affiches = genres
         except Exception:
             pass
 
-        
         by_isbn: dict = {}
         for lv in livres:
             by_isbn.setdefault(lv.ISBN, []).append(lv)
+        isbns = list(by_isbn)
+        self._vue_groupes = by_isbn
+
+        if isbns == self._vue_isbns:
+            for i, iid in enumerate(self._vue_iids):
+                valeurs = self._valeurs_ligne(i + 1, isbns[i], by_isbn[isbns[i]])
+                if valeurs != self._vue_valeurs[i]:
+                    self.tree.item(iid, values=valeurs)
+                    self._vue_valeurs[i] = valeurs
+            return
 
-        for idx, (isbn, lv_list) in enumerate(by_isbn.items(), start=1):
-            rep = lv_list[0]
-            titre = getattr(rep, 'titre', '')
-            auteur = getattr(rep, 'auteur', '')
-            genre = getattr(rep, 'genre', '')
-            
-            
-            try:
-                exmap = getattr(self.biblio, 'exemplaires', None)
-                if isinstance(exmap, dict) and isbn in exmap:
-                    entry = exmap[isbn]
-                    total = int(entry.get('total', 0))
-                    avail = int(entry.get('disponibles', 0))
-                else:
-                        stats = self.biblio.get_exemplar_statuses(isbn)
-                        total = int(stats.get('total', 0))
-                        avail = int(stats.get('disponible', 0))
-            except Exception:
-                        
-                        total = len(lv_list)
-                        avail = 0
-                        for l in lv_list:
-                            try:
-                                avail += int(getattr(l, 'disponibles', 1)) if hasattr(l, 'nb_exemplaire') else (1 if getattr(l, 'etat', 'disponible') == 'disponible' else 0)
-                            except Exception:
-                                avail += 0
-            dispo_txt = f"{avail}/{total}"
-            
-            if avail == 0:
-                etat = 'indisponible'
-            elif avail == total:
-                etat = 'disponible'
+        if self._vue_iids:
+            self.tree.delete(*self._vue_iids)
+        self._vue_isbns = isbns
+        self._vue_iids = []
+        self._vue_valeurs = []
+        self._charger_page()
+        self.tree.yview_moveto(0)
+
+    def _charger_page(self):
+        debut = len(self._vue_iids)
+        for i in range(debut, min(debut + PAGE_LIGNES, len(self._vue_isbns))):
+            isbn = self._vue_isbns[i]
+            valeurs = self._valeurs_ligne(i + 1, isbn, self._vue_groupes.get(isbn, []))
+            self._vue_iids.append(self.tree.insert("", tk.END, values=valeurs))
+            self._vue_valeurs.append(valeurs)
+
+    def _on_tree_scroll(self, first, last):
+        self.tree_scroll.set(first, last)
+        # load the next page before the end of the loaded rows comes into view
+        if float(last) > 0.9 and len(self._vue_iids) < len(self._vue_isbns):
+            self.after_idle(self._charger_page_si_besoin)
+
+    def _charger_page_si_besoin(self):
+        first, last = self.tree.yview()
+        if last > 0.9 and len(self._vue_iids) < len(self._vue_isbns):
+            self._charger_page()
+
+    def _valeurs_ligne(self, idx, isbn, lv_list):
+        rep = lv_list[0]
+        titre = getattr(rep, 'titre', '')
+        auteur = getattr(rep, 'auteur', '')
+        genre = getattr(rep, 'genre', '')
+
+        try:
+            exmap = getattr(self.biblio, 'exemplaires', None)
+            if isinstance(exmap, dict) and isbn in exmap:
+                entry = exmap[isbn]
+                total = int(entry.get('total', 0))
+                avail = int(entry.get('disponibles', 0))
             else:
-                etat = 'partiellement disponible'
-            
-            ex_id = '-'
-            self.tree.insert("", tk.END, values=(idx, titre, auteur, genre, isbn, ex_id, etat, dispo_txt))
+                stats = self.biblio.get_exemplar_statuses(isbn)
+                total = int(stats.get('total', 0))
+                avail = int(stats.get('disponible', 0))
+        except Exception:
+            total = len(lv_list)
+            avail = 0
+            for l in lv_list:
+                try:
+                    avail += int(getattr(l, 'disponibles', 1)) if hasattr(l, 'nb_exemplaire') else (1 if getattr(l, 'etat', 'disponible') == 'disponible' else 0)
+                except Exception:
+                    avail += 0
+        dispo_txt = f"{avail}/{total}"
+        
+        if avail == 0:
+            etat = 'indisponible'
+        elif avail == total:
+            etat = 'disponible'
+        else:
+            etat = 'partiellement disponible'
+        
+        ex_id = '-'
+        return (idx, titre, auteur, genre, isbn, ex_id, etat, dispo_txt)
 
     def _borrow_selected(self):
         if not self.current_user:
@@ -343,11 +580,7 @@ class BibliothequeApp(tk.Tk):
             messagebox.showerror("Erreur", f"Erreur lors de l'emprunt: {e}")
             return
 
-        try:
-            BibliothequeAvecFichier.sauvegarder_transactionnel(self.biblio, self.users, str(self.data_file), str(self.users_file))
-        except Exception as e:
-            messagebox.showerror("Erreur", f"Echec sauvegarde transactionnelle: {e}")
-            
+        self._persister(isbns=[isbn], reservations=[isbn], users=[self.current_user])
         messagebox.showinfo("Ok", f"Livre emprunté: {livre.titre}")
         self._refresh_list()
 
@@ -361,13 +594,9 @@ class BibliothequeApp(tk.Tk):
             return
         item = self.tree.item(sel[0])
         isbn = str(item['values'][4]).strip()
-        ok = self.biblio.reserver_livre(isbn, user_obj=self.current_user, users_file=str(self.users_file))
+        ok = self.biblio.reserver_livre(isbn, user_obj=self.current_user)
         if ok:
-            
-            try:
-                BibliothequeAvecFichier.sauvegarder_transactionnel(self.biblio, self.users, str(self.data_file), str(self.users_file))
-            except Exception:
-                pass
+            self._persister(reservations=[isbn], users=[self.current_user])
             messagebox.showinfo("Réservé", "Réservation ajoutée")
         else:
             messagebox.showinfo("Réservation", "Vous avez déjà réservé ce livre ou réservation non autorisée")
@@ -389,12 +618,17 @@ class BibliothequeApp(tk.Tk):
             self._active_loans = []
             return
         # Only show active loans (not yet returned) in the "Prêts en cours" list
-        self._active_loans = [l for l in getattr(self.current_user, 'loans', []) if getattr(l, 'date_retour_effective', None) is None]
+        self._active_loans = prets_en_cours(self.current_user)
         for l in self._active_loans:
             status = "en cours"
             self.lst_loans.insert(tk.END, f"{l.isbn} (ex:{l.exemplaire_id}) - {status} - due {l.date_retour_prevue}")
+        positions = self.biblio.reservations.de_user(self.current_user.username)
         for r in self.current_user.reservations:
-            self.lst_res.insert(tk.END, f"{r.isbn} (ex:{r.exemplaire_id}) - {r.date_reservation}")
+            rang = positions.get(r.isbn)
+            place = f" - position {rang + 1}" if rang is not None else ""
+            if r.date_limite:
+                place += f" - à retirer avant le {r.date_limite}"
+            self.lst_res.insert(tk.END, f"{r.isbn} (ex:{r.exemplaire_id}) - {r.date_reservation}{place}")
         self.lbl_pen.config(text=f"{self.current_user.penalites:.2f}")
         
         if getattr(self.current_user, 'subscription', None):
@@ -460,11 +694,8 @@ class BibliothequeApp(tk.Tk):
         except Exception:
             messagebox.showerror("Erreur", "Prêt sélectionné invalide")
             return
-        montant = self.biblio.retourner_exemplaire(loan.exemplaire_id, self.current_user, str(self.users_file))
-        try:
-            BibliothequeAvecFichier.sauvegarder_transactionnel(self.biblio, self.users, str(self.data_file), str(self.users_file))
-        except Exception:
-            pass
+        montant = self.biblio.retourner_exemplaire(loan.exemplaire_id, self.current_user, depot=self)
+        self._persister(isbns=[loan.isbn], users=[self.current_user])
         if montant:
             messagebox.showinfo("Retour", f"Retour enregistré. Pénalité: {montant:.2f} €")
         else:
@@ -478,13 +709,10 @@ class BibliothequeApp(tk.Tk):
             return
         idx = sel[0]
         res = self.current_user.reservations[idx]
-        ok = self.biblio.annuler_reservation(res.isbn, user_obj=self.current_user, users_file=str(self.users_file))
+        ok = self.biblio.annuler_reservation(res.isbn, user_obj=self.current_user, depot=self)
         if ok:
-            
-            try:
-                BibliothequeAvecFichier.sauvegarder_users(self.users, str(self.users_file))
-            except Exception:
-                pass
+            # a held copy goes to the next user or back on the shelf
+            self._persister(isbns=[res.isbn], reservations=[res.isbn], users=[self.current_user])
             messagebox.showinfo("Ok", "Réservation annulée")
         else:
             messagebox.showwarning("Erreur", "Impossible d'annuler")
@@ -498,7 +726,7 @@ class BibliothequeApp(tk.Tk):
             return
         
         self.current_user.penalites = 0.0
-        BibliothequeAvecFichier.sauvegarder_users(self.users, str(self.users_file))
+        self._persister(users=[self.current_user])
         messagebox.showinfo("Paiement", "Pénalités réglées")
         self._refresh_user_panel()
 
@@ -517,7 +745,16 @@ class BibliothequeApp(tk.Tk):
             tree.heading(c, text=c)
         tree.pack(fill=tk.BOTH, expand=True)
 
-        for l in self.current_user.loans:
+        # the only place the archived loans get decoded, with the ones moved
+        # to the monthly archives
+        loans = list(self.current_user.loans)
+        archive = getattr(self.biblio, 'archive', None)
+        if archive is not None:
+            try:
+                loans.extend(Loan.from_dict(d) for d in archive.prets_user(self.current_user.username))
+            except Exception as e:
+                messagebox.showerror("Erreur", f"Archives illisibles: {e}")
+        for l in sorted(loans, key=lambda l: l.date_emprunt):
             date_emp = l.date_emprunt.isoformat() if getattr(l, 'date_emprunt', None) else ''
             date_prev = l.date_retour_prevue.isoformat() if getattr(l, 'date_retour_prevue', None) else ''
             date_ret = l.date_retour_effective.isoformat() if getattr(l, 'date_retour_effective', None) else ''
@@ -554,15 +791,70 @@ class BibliothequeApp(tk.Tk):
                 self.biblio.ajouter_exemplaire(t, a, i, ex, genre=gen if gen else None)
             except TypeError:
                 self.biblio.ajouter_exemplaire(t, a, i, ex)
-            try:
-                self.biblio.sauvegarder(str(self.data_file))
-            except Exception as e:
-                messagebox.showerror("Erreur", f"Echec sauvegarde: {e}")
+            self._persister(isbns=[i])
             dlg.destroy(); self._refresh_list()
 
         # place the Add button on the dialog (row adjusted for new Genre field)
         ttk.Button(dlg, text="Ajouter", command=do_add).grid(column=0, row=5, columnspan=2, pady=8)
 
+    def _admin_import_csv(self):
+        if not self.current_user or not self.current_user.is_admin:
+            messagebox.showwarning("Accès refusé", "Administrateur requis")
+            return
+        if self._import_en_cours:
+            messagebox.showinfo("Patientez", "Un import est déjà en cours")
+            return
+        path = filedialog.askopenfilename(title="Importer un catalogue", initialdir=str(get_data_dir()),
+                                          filetypes=[("CSV", "*.csv"), ("Tous les fichiers", "*.*")])
+        if not path:
+            return
+        # read and checked on the worker one batch at a time; each batch is
+        # merged here before the next is read, so memory stays flat
+        from .import_csv import RapportImport, lire_csv
+        rapport = RapportImport()
+        lots = lire_csv(path, rapport)
+        self._import_en_cours = True
+        self._set_statut("Import…")
+        self._lire_lot_import(lots, rapport)
+
+    def _lire_lot_import(self, lots, rapport):
+        self.taches.soumettre(next, lots, None,
+                              quand_fini=lambda groupes: self._import_lot(lots, rapport, groupes),
+                              en_erreur=self._import_echoue)
+
+    def _import_echoue(self, e):
+        self._import_en_cours = False
+        self._set_statut("")
+        messagebox.showerror("Erreur", f"Import impossible: {e}")
+
+    def _import_lot(self, lots, rapport, groupes):
+        from .import_csv import fusionner_csv
+        if groupes is not None:
+            try:
+                fusionner_csv(self.biblio, groupes, rapport)
+            except Exception as e:
+                lots.close()
+                self._import_echoue(e)
+                return
+            self._set_statut(f"Import… {rapport.lignes} lignes")
+            self._lire_lot_import(lots, rapport)
+            return
+        self._import_en_cours = False
+        self._set_statut("")
+        if rapport.livres_crees or rapport.exemplaires_ajoutes:
+            # may touch any number of titles: write a full snapshot
+            self._checkpoint(complet=True)
+        self._refresh_list()
+        lignes = [
+            f"Lignes lues: {rapport.lignes}",
+            f"Livres créés: {rapport.livres_crees}",
+            f"Exemplaires ajoutés: {rapport.exemplaires_ajoutes}",
+            f"Lignes ignorées (déjà présentes): {rapport.ignorees}",
+            f"Lignes rejetées: {rapport.nb_erreurs}",
+        ]
+        lignes += [f"  ligne {n}: {msg}" for n, msg in rapport.erreurs[:20]]
+        messagebox.showinfo("Import terminé", "\n".join(lignes))
+
     def _admin_delete_by_isbn(self):
         if not self.current_user or not self.current_user.is_admin:
             messagebox.showwarning("Accès refusé", "Administrateur requis")
@@ -574,20 +866,13 @@ class BibliothequeApp(tk.Tk):
         if not isbn:
             return
 
+        # users whose held copy goes with the book
+        retenus = [self.biblio.retenues.user(r.username) for r in self.biblio.retenues if r.isbn == isbn]
         removed = False
-        for livre in list(self.biblio.livres):
-            if str(getattr(livre, 'ISBN', '')).strip() == isbn:
-                self.biblio.livres.remove(livre)
-                removed = True
+        while self.biblio.supprimer_livre(isbn):
+            removed = True
         if removed:
-            try:
-                
-                BibliothequeAvecFichier.sauvegarder_transactionnel(self.biblio, self.users, str(self.data_file), str(self.users_file))
-            except Exception:
-                try:
-                    self.biblio.sauvegarder(str(self.data_file))
-                except Exception:
-                    pass
+            self._persister(isbns=[isbn], users=[u for u in retenus if u is not None])
             messagebox.showinfo("Ok", "Suppression effectuée")
             self._refresh_list()
         else:
@@ -600,26 +885,10 @@ class BibliothequeApp(tk.Tk):
         exid = simpledialog.askstring("Marquer endommagé", "Entrez exemplaire ID:")
         if not exid:
             return
-        found = False
-        for livre in self.biblio.livres:
-            for d in getattr(livre, 'exemplaires_details', []):
-                if d.get('exemplaire_id') == exid:
-                    d['etat'] = 'endommage'
-                    
-                    if d.get('etat') != 'disponible':
-                        try:
-                            livre.disponibles = max(0, livre.disponibles - 1)
-                        except Exception:
-                            pass
-                    found = True
-                    break
-            if found:
-                break
+        ex = self.biblio.find_exemplar_by_id(exid)
+        found = self.biblio.set_exemplaire_status(exid, 'endommage')
         if found:
-            try:
-                self.biblio.sauvegarder(str(self.data_file))
-            except Exception:
-                pass
+            self._persister(isbns=[ex.ISBN])
             messagebox.showinfo("Ok", "Exemplaire marqué endommagé")
             self._refresh_list()
         else:
@@ -629,30 +898,22 @@ class BibliothequeApp(tk.Tk):
         if not self.current_user or not self.current_user.is_admin:
             messagebox.showwarning("Accès refusé", "Administrateur requis")
             return
-        uname = simpledialog.askstring("Renouveler", "Nom d'utilisateur à renouveler:")
-        if not uname:
+        target = self._choisir_user("Renouveler", "Nom d'utilisateur à renouveler:")
+        if not target:
             return
         days = simpledialog.askinteger("Jours", "Nombre de jours à ajouter:", minvalue=1, initialvalue=365)
         if not days:
             return
-        target = next((u for u in self.users if u.username == uname), None)
-        if not target:
-            messagebox.showinfo("Introuvable", "Utilisateur non trouvé")
-            return
         new_exp = target.renew_subscription(days)
-        BibliothequeAvecFichier.sauvegarder_users(self.users, str(self.users_file))
-        messagebox.showinfo("Renouvelé", f"Abonnement de {uname} prolongé jusqu'à {new_exp}")
+        self._persister(users=[target])
+        messagebox.showinfo("Renouvelé", f"Abonnement de {target.username} prolongé jusqu'à {new_exp}")
 
     def _admin_change_subscription(self):
         if not self.current_user or not self.current_user.is_admin:
             messagebox.showwarning("Accès refusé", "Administrateur requis")
             return
-        uname = simpledialog.askstring("Changer abonnement", "Nom d'utilisateur:")
-        if not uname:
-            return
-        target = next((u for u in self.users if u.username == uname), None)
+        target = self._choisir_user("Changer abonnement", "Nom d'utilisateur:")
         if not target:
-            messagebox.showinfo("Introuvable", "Utilisateur non trouvé")
             return
         new_type = simpledialog.askstring("Type", "Nouveau type (basique/premium/VIP):")
         if not new_type:
@@ -668,8 +929,8 @@ class BibliothequeApp(tk.Tk):
                 target.subscription.type = new_type
                 target.subscription.date_debut = date.today()
                 target.subscription.date_expiration = date.today() + timedelta(days=duration * 12)
-            BibliothequeAvecFichier.sauvegarder_users(self.users, str(self.users_file))
-            messagebox.showinfo("Ok", f"Abonnement de {uname} changé en {new_type}")
+            self._persister(users=[target])
+            messagebox.showinfo("Ok", f"Abonnement de {target.username} changé en {new_type}")
         except Exception as e:
             messagebox.showerror("Erreur", f"Impossible de modifier l'abonnement: {e}")
 
@@ -685,24 +946,11 @@ class BibliothequeApp(tk.Tk):
         if new_genre is None:
             return
         new_genre = new_genre.strip()
-        updated = False
-        for livre in self.biblio.livres:
-            if str(getattr(livre, 'ISBN', '')).strip() == isbn:
-                try:
-                    livre.genre = new_genre
-                except Exception:
-                    pass
-                updated = True
+        updated = self.biblio.modifier_genre(isbn, new_genre)
         if not updated:
             messagebox.showinfo("Introuvable", "Aucun livre trouvé pour cet ISBN")
             return
-        try:
-            BibliothequeAvecFichier.sauvegarder_transactionnel(self.biblio, self.users, str(self.data_file), str(self.users_file))
-        except Exception:
-            try:
-                self.biblio.sauvegarder(str(self.data_file))
-            except Exception:
-                pass
+        self._persister(isbns=[isbn])
         messagebox.showinfo("Ok", f"Genre mis à jour pour ISBN {isbn}")
         self._refresh_list()
 
@@ -724,24 +972,11 @@ class BibliothequeApp(tk.Tk):
         if new_genre is None:
             return
         new_genre = new_genre.strip()
-        updated = False
-        for livre in self.biblio.livres:
-            if str(getattr(livre, 'ISBN', '')).strip() == isbn:
-                try:
-                    livre.genre = new_genre
-                except Exception:
-                    pass
-                updated = True
+        updated = self.biblio.modifier_genre(isbn, new_genre)
         if not updated:
             messagebox.showinfo("Introuvable", "Aucun livre trouvé pour cet ISBN")
             return
-        try:
-            BibliothequeAvecFichier.sauvegarder_transactionnel(self.biblio, self.users, str(self.data_file), str(self.users_file))
-        except Exception:
-            try:
-                self.biblio.sauvegarder(str(self.data_file))
-            except Exception:
-                pass
+        self._persister(isbns=[isbn])
         messagebox.showinfo("Ok", f"Genre mis à jour pour ISBN {isbn}")
         self._refresh_list()
 
@@ -756,11 +991,8 @@ class BibliothequeApp(tk.Tk):
         try:
             removed = self.biblio.trim_exemplaires(maxn)
             if removed:
-                
-                try:
-                    self.biblio.sauvegarder(str(self.data_file))
-                except Exception:
-                    pass
+                # touches every title: write a full snapshot
+                self._checkpoint(complet=True)
         except Exception as e:
             messagebox.showerror("Erreur", f"Impossible de supprimer exemplaires: {e}")
             return
@@ -785,10 +1017,10 @@ class BibliothequeApp(tk.Tk):
         tree.pack(fill=tk.BOTH, expand=True)
         for lv in exs:
             
-            details = getattr(lv, 'exemplaires_details', None) or []
-            if details:
-                for d in details:
-                    tree.insert("", tk.END, values=(d.get('exemplaire_id', '-'), d.get('etat', 'disponible'), getattr(lv, 'titre', '')))
+            stock = getattr(lv, 'exemplaires_stock', None)
+            if stock:
+                for exid, etat in stock:
+                    tree.insert("", tk.END, values=(exid or '-', etat, getattr(lv, 'titre', '')))
             else:
                 
                 total = int(getattr(lv, 'nb_exemplaire', 0) or 0)
@@ -813,10 +1045,7 @@ class BibliothequeApp(tk.Tk):
                 return
             ok = self.biblio.set_exemplaire_status(exid, new)
             if ok:
-                try:
-                    self.biblio.sauvegarder(str(self.data_file))
-                except Exception:
-                    pass
+                self._persister(isbns=[isbn])
                 messagebox.showinfo("Ok", "Statut modifié")
                 dlg.destroy()
                 self._refresh_list()
@@ -837,6 +1066,12 @@ class BibliothequeApp(tk.Tk):
         isbn = str(item['values'][4]).strip()
         
         entries = []
+        archive = getattr(self.biblio, 'archive', None)
+        if archive is not None:
+            try:
+                entries.extend(archive.historique_livre(isbn))
+            except Exception as e:
+                messagebox.showerror("Erreur", f"Archives illisibles: {e}")
         for lv in self.biblio.trouver_exemplaires(isbn):
             for h in getattr(lv, 'history', []):
                 entries.append(h)
@@ -883,10 +1118,7 @@ class BibliothequeApp(tk.Tk):
             comment = txt.get("1.0", tk.END).strip()
             ok = self.biblio.add_review(isbn, self.current_user.username, rating, comment)
             if ok:
-                try:
-                    BibliothequeAvecFichier.sauvegarder_transactionnel(self.biblio, self.users, str(self.data_file), str(self.users_file))
-                except Exception:
-                    pass
+                self._persister(isbns=[isbn])
                 messagebox.showinfo("Merci", "Avis enregistré")
                 dlg.destroy()
             else:
@@ -925,16 +1157,71 @@ class BibliothequeApp(tk.Tk):
         if not self.current_user or not self.current_user.is_admin:
             messagebox.showwarning("Accès refusé", "Administrateur requis")
             return
-        uname = tk.simpledialog.askstring("Marquer payé", "Nom d'utilisateur:")
-        if not uname:
-            return
-        target = next((u for u in self.users if u.username == uname), None)
+        target = self._choisir_user("Marquer payé", "Nom d'utilisateur:")
         if not target:
-            messagebox.showinfo("Introuvable", "Utilisateur non trouvé")
             return
         target.penalites = 0.0
-        BibliothequeAvecFichier.sauvegarder_users(self.users, str(self.users_file))
-        messagebox.showinfo("Ok", f"Pénalités de {uname} marquées payées")
+        self._persister(users=[target])
+        messagebox.showinfo("Ok", f"Pénalités de {target.username} marquées payées")
+
+    def _choisir_user(self, titre: str, invite: str) -> Optional[User]:
+        # exact or case-insensitive name, else the only user starting with it
+        uname = simpledialog.askstring(titre, invite)
+        if not uname:
+            return None
+        target = self.users.trouver(uname.strip())
+        if target is not None:
+            return target
+        candidats = self.users.rechercher(uname, limite=CANDIDATS_MAX + 1)
+        if len(candidats) == 1:
+            return candidats[0]
+        if not candidats:
+            messagebox.showinfo("Introuvable", "Utilisateur non trouvé")
+        else:
+            noms = [u.username for u in candidats[:CANDIDATS_MAX]]
+            if len(candidats) > CANDIDATS_MAX:
+                noms.append("…")
+            messagebox.showinfo("Plusieurs utilisateurs", "Précisez le nom :\n" + "\n".join(noms))
+        return None
+
+    def _admin_archive_history(self):
+        if not self.current_user or not self.current_user.is_admin:
+            messagebox.showwarning("Accès refusé", "Administrateur requis")
+            return
+        from datetime import date, timedelta
+        from .archives import ARCHIVE_APRES_JOURS
+        from .popularite import FENETRES
+        jours = simpledialog.askinteger("Archiver l'historique", "Archiver les emprunts de plus de (jours):",
+                                        minvalue=max(FENETRES), initialvalue=ARCHIVE_APRES_JOURS)
+        if not jours:
+            return
+        # pending writes go first so the worker keeps the order
+        self.ecritures.vider()
+        try:
+            donnees = self.stockage.preparer_archivage(self.biblio, self.users, date.today() - timedelta(days=jours))
+        except Exception as e:
+            messagebox.showerror("Erreur", f"Archivage impossible: {e}")
+            return
+        if donnees is None:
+            messagebox.showinfo("Archivage", "Aucun emprunt à archiver pour ce stockage")
+            return
+        self._set_statut("Archivage…")
+        self.taches.soumettre(self.stockage.ecrire_archivage, donnees,
+                              quand_fini=lambda resultat: self._archivage_termine(donnees, resultat),
+                              en_erreur=self._ecriture_echouee)
+
+    def _archivage_termine(self, donnees, resultat):
+        synchro, ecrit = resultat
+        if ecrit:
+            archive, archivage = donnees[0], donnees[1]
+            archive.installer(archivage)
+            self.biblio.archive = archive
+            self._journal_records = 0
+        self._ecriture_terminee(synchro)
+        if ecrit:
+            messagebox.showinfo("Archivage", f"{archivage.nb} enregistrements archivés")
+        else:
+            messagebox.showwarning("Archivage", "Des changements d'un autre poste sont arrivés, réessayez")
 
     def _renew_own_subscription(self):
         if not self.current_user:
@@ -944,7 +1231,7 @@ class BibliothequeApp(tk.Tk):
         if not days:
             return
         new_exp = self.current_user.renew_subscription(days)
-        BibliothequeAvecFichier.sauvegarder_users(self.users, str(self.users_file))
+        self._persister(users=[self.current_user])
         messagebox.showinfo("Renouvelé", f"Votre abonnement est prolongé jusqu'à {new_exp}")
 
     def _admin_show_stats(self):
@@ -963,6 +1250,12 @@ class BibliothequeApp(tk.Tk):
         for isbn, title, cnt in stats.get('popular_books', [])[:10]:
             txt.insert(tk.END, f"{title} ({isbn}): {cnt}\n")
 
+        ttk.Label(frm, text="Les plus empruntés sur 30 jours").pack(anchor=tk.W, pady=(8, 0))
+        txt6 = tk.Text(frm, height=6, width=80)
+        txt6.pack(fill=tk.X)
+        for isbn, title, cnt in stats.get('popular_by_window', {}).get(30, []):
+            txt6.insert(tk.END, f"{title} ({isbn}): {cnt}\n")
+
         ttk.Label(frm, text="Nombre d'exemplaires par ISBN").pack(anchor=tk.W, pady=(8, 0))
         txt2 = tk.Text(frm, height=6, width=80)
         txt2.pack(fill=tk.X)
@@ -981,6 +1274,12 @@ class BibliothequeApp(tk.Tk):
         txt3.insert(tk.END, f"Utilisateurs actifs: {stats.get('active_users', 0)}\n")
         txt3.insert(tk.END, f"Prêts en retard: {stats.get('overdue_loans', 0)}\n")
 
+        ttk.Label(frm, text="Prochaines échéances").pack(anchor=tk.W, pady=(8, 0))
+        txt5 = tk.Text(frm, height=6, width=80)
+        txt5.pack(fill=tk.X)
+        for uname, loan in self.biblio.prets.en_retard(n=5) + self.biblio.prets.prochaines_echeances(5):
+            txt5.insert(tk.END, f"{loan.date_retour_prevue.isoformat()}  {uname}: {loan.isbn} ({loan.exemplaire_id})\n")
+
         ttk.Button(frm, text="Fermer", command=dlg.destroy).pack(pady=8)
 
 
@@ -0,0 +1,157 @@
+import csv
+from dataclasses import dataclass, field
+from itertools import islice
+from pathlib import Path
+
+from .exceptions import ErreurFichier
+from .exemplaires import ETATS
+from .models import AggregatedLivre, LivreNumerique
+
+
+TAILLE_LOT = 5000         # rows read and merged together
+MAX_ERREURS = 1000        # rejected rows kept with their message
+
+# accepted column names -> field (the export_csv header is a subset)
+_COLONNES = {
+    "type": "type", "titre": "titre", "auteur": "auteur", "isbn": "ISBN",
+    "taille_fichier": "taille_fichier", "genre": "genre",
+    "exemplaire_id": "exemplaire_id", "etat": "etat",
+    "nb_exemplaires": "nb_exemplaires", "nb_exemplaire": "nb_exemplaires", "total": "nb_exemplaires",
+}
+
+
+@dataclass
+class RapportImport:
+    lignes: int = 0
+    livres_crees: int = 0
+    exemplaires_ajoutes: int = 0
+    ignorees: int = 0
+    nb_erreurs: int = 0
+    # (line number, message) of the first MAX_ERREURS rejected rows
+    erreurs: list = field(default_factory=list)
+
+    def rejeter(self, ligne: int, message: str) -> None:
+        self.nb_erreurs += 1
+        if len(self.erreurs) < MAX_ERREURS:
+            self.erreurs.append((ligne, message))
+
+
+def _lire_lignes(f, rapport: RapportImport):
+    lecteur = csv.reader(f)
+    try:
+        entete = next(lecteur)
+    except StopIteration:
+        return
+    champs = [_COLONNES.get(c.strip().lower()) for c in entete]
+    if "ISBN" not in champs:
+        raise ErreurFichier("Colonne ISBN absente de l'en-tete CSV")
+    for valeurs in lecteur:
+        if not any(v.strip() for v in valeurs):
+            continue
+        rapport.lignes += 1
+        ligne = {c: v.strip() for c, v in zip(champs, valeurs) if c is not None}
+        yield lecteur.line_num, ligne
+
+
+def _nouveau_livre(ligne: dict) -> AggregatedLivre:
+    isbn = ligne["ISBN"]
+    if ligne.get("type") == "Livre Numerique":
+        livre = LivreNumerique(ligne["titre"], ligne.get("auteur", ""), isbn, ligne.get("taille_fichier", ""))
+    else:
+        total = 0 if ligne.get("exemplaire_id") else int(ligne.get("nb_exemplaires") or 1)
+        livre = AggregatedLivre(ligne["titre"], ligne.get("auteur", ""), isbn, total=total, disponibles=total)
+    if ligne.get("genre"):
+        livre.genre = ligne["genre"]
+    return livre
+
+
+def _fusionner_groupe(biblio, isbn: str, lignes: list, rapport: RapportImport) -> None:
+    # one index lookup per ISBN and batch
+    livre = biblio.trouver_livre(isbn)
+    for num, ligne in lignes:
+        exid = ligne.get("exemplaire_id")
+        etat = (ligne.get("etat") or "disponible").lower()
+        if exid and biblio.find_exemplar_by_id(exid) is not None:
+            rapport.rejeter(num, f"Exemplaire deja present: {exid!r}")
+            continue
+        if livre is None:
+            if not ligne.get("titre"):
+                rapport.rejeter(num, "Titre manquant pour un nouvel ISBN")
+                continue
+            livre = _nouveau_livre(ligne)
+            biblio.ajouter_livre(livre)
+            rapport.livres_crees += 1
+            if not exid:
+                continue
+        if exid:
+            biblio.ajouter_exemplaire(livre.titre, livre.auteur, isbn, exid, etat=etat)
+            rapport.exemplaires_ajoutes += 1
+        elif ligne.get("genre") and ligne["genre"] != livre.genre:
+            biblio.modifier_genre(isbn, ligne["genre"])
+        else:
+            rapport.ignorees += 1
+
+
+def _valider(num: int, ligne: dict, rapport: RapportImport) -> bool:
+    # checks that need the row only, not the catalogue
+    if not ligne.get("ISBN"):
+        rapport.rejeter(num, "ISBN manquant")
+        return False
+    etat = (ligne.get("etat") or "disponible").lower()
+    if etat not in ETATS:
+        rapport.rejeter(num, f"Etat inconnu: {etat!r}")
+        return False
+    nb = ligne.get("nb_exemplaires")
+    if nb and not nb.isdigit():
+        rapport.rejeter(num, f"Nombre d'exemplaires invalide: {nb!r}")
+        return False
+    return True
+
+
+def lire_csv(filepath: str | Path, rapport: RapportImport, taille_lot: int = TAILLE_LOT):
+    """Read and check a catalogue CSV one batch at a time (any thread: the
+    catalogue is not touched); yields ISBN -> [(line number, row)] per batch,
+    to merge with `fusionner_csv` before the next one is read."""
+    p = Path(filepath)
+    try:
+        with p.open("r", encoding="utf-8-sig", newline="") as f:
+            lignes = _lire_lignes(f, rapport)
+            while True:
+                lot = list(islice(lignes, taille_lot))
+                if not lot:
+                    break
+                groupes: dict[str, list] = {}
+                for num, ligne in lot:
+                    if _valider(num, ligne, rapport):
+                        groupes.setdefault(ligne["ISBN"], []).append((num, ligne))
+                yield groupes
+    except FileNotFoundError:
+        raise ErreurFichier(f"Fichier '{filepath}' inexistant")
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ErreurFichier(f"CSV invalide '{filepath}': {e}")
+
+
+def fusionner_csv(biblio, groupes: dict, rapport: RapportImport) -> None:
+    """Merge one batch from `lire_csv` into `biblio` (where the models are
+    mutated: the Tk thread in the GUI). Only index lookups are left."""
+    for isbn, groupe in groupes.items():
+        _fusionner_groupe(biblio, isbn, groupe, rapport)
+
+
+def importer_csv(biblio, filepath: str | Path, taille_lot: int = TAILLE_LOT) -> RapportImport:
+    """Merge a catalogue CSV into `biblio`, streaming it in batches.
+
+    One row is a title (`type,titre,auteur,ISBN,taille_fichier` as written
+    by `export_csv`, optionally `genre` and `nb_exemplaires`) or, with an
+    `exemplaire_id` column (and optional `etat`), one copy. Rows of a
+    batch are grouped by ISBN and merged into the existing book found
+    through the ISBN index; known titles are not duplicated. Bad rows are
+    reported in the returned `RapportImport` and do not stop the import.
+
+    The GUI runs the two halves apart, batch after batch: `lire_csv` on
+    the worker thread, `fusionner_csv` on the Tk thread.
+    """
+    rapport = RapportImport()
+    for groupes in lire_csv(filepath, rapport, taille_lot):
+        fusionner_csv(biblio, groupes, rapport)
+    return rapport
@@ -0,0 +1,247 @@
+import json
+import os
+from pathlib import Path
+from typing import Iterator
+
+from .exceptions import ErreurFichier
+
+
+class Journal:
+    """Append-only write-ahead journal kept next to a `bib.json` snapshot.
+
+    Each record is the new state image of what a mutation touched: every
+    book sharing an ISBN (empty list once deleted), one reservation queue or
+    one user. Replaying images is idempotent, so a crash between a
+    checkpoint and the journal reset only replays states already in the
+    snapshot.
+    """
+
+    def __init__(self, filepath: str | Path):
+        self.path = Path(filepath)
+
+    @staticmethod
+    def chemin_pour(bib_filepath: str | Path) -> Path:
+        return Path(str(bib_filepath) + ".journal")
+
+    def existe(self) -> bool:
+        return self.path.exists() and self.path.stat().st_size > 0
+
+    @staticmethod
+    def _fin_complete(f) -> int:
+        # offset just after the last "\n" of binary file `f`: what follows
+        # is the torn tail of an append cut short by a crash
+        fin = f.seek(0, os.SEEK_END)
+        if fin == 0:
+            return 0
+        f.seek(fin - 1)
+        if f.read(1) == b"\n":
+            return fin
+        while fin > 0:
+            debut = max(0, fin - 4096)
+            f.seek(debut)
+            i = f.read(fin - debut).rfind(b"\n")
+            if i >= 0:
+                return debut + i + 1
+            fin = debut
+        return 0
+
+    def ajouter(self, *records: dict) -> None:
+        if not records:
+            return
+        lignes = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in records)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # one write and one fsync for the whole mutation
+            with self.path.open("a+b") as f:
+                # a torn tail is cut first, or these records would be glued
+                # to it and lost on replay
+                fin = self._fin_complete(f)
+                if fin != f.seek(0, os.SEEK_END):
+                    f.truncate(fin)
+                f.write(lignes.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+        except Exception as e:
+            raise ErreurFichier(f"Impossible d'ecrire le journal '{self.path}': {e}")
+
+    def enregistrer(self, biblio=None, isbns=(), reservations=(), users=()) -> None:
+        self.enregistrer_images(
+            livres={isbn: [l.to_dict() for l in biblio.trouver_exemplaires(isbn)] for isbn in isbns},
+            reservations={isbn: list(biblio.reservations.get(isbn, [])) for isbn in reservations},
+            users={u.username: u.to_dict() for u in users},
+        )
+
+    def enregistrer_images(self, livres: dict | None = None, reservations: dict | None = None, users: dict | None = None,
+                           users_modifies=(), poste: str | None = None) -> None:
+        # already-serialized images (ISBN -> book dicts, ISBN -> queue, username -> user dict);
+        # `users_modifies` only records that a user kept elsewhere changed
+        records = [{"op": "livre", "ISBN": isbn, "data": data} for isbn, data in (livres or {}).items()]
+        records += [{"op": "reservations", "ISBN": isbn, "file": q} for isbn, q in (reservations or {}).items()]
+        records += [{"op": "user", "data": data} for data in (users or {}).values()]
+        records += [{"op": "user", "username": username} for username in users_modifies]
+        if poste is not None:
+            for r in records:
+                r["poste"] = poste
+        self.ajouter(*records)
+
+    def lire(self) -> Iterator[dict]:
+        if not self.path.exists():
+            return
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                for ligne in f:
+                    if not ligne.endswith("\n"):
+                        # torn tail from a crash during append: never acknowledged
+                        return
+                    try:
+                        yield json.loads(ligne)
+                    except json.JSONDecodeError:
+                        # a complete line that does not decode: skip it, the
+                        # records after it were acknowledged
+                        continue
+        except OSError as e:
+            raise ErreurFichier(f"Impossible de lire le journal '{self.path}': {e}")
+
+    def lire_depuis(self, offset: int = 0, path: Path | None = None) -> Iterator[tuple[int, dict]]:
+        """(end offset, record) for the complete records after byte `offset`."""
+        path = path or self.path
+        try:
+            with path.open("rb") as f:
+                f.seek(offset)
+                fin = offset
+                for ligne in f:
+                    if not ligne.endswith(b"\n"):
+                        return
+                    fin += len(ligne)
+                    try:
+                        r = json.loads(ligne)
+                    except ValueError:
+                        continue
+                    yield fin, r
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            raise ErreurFichier(f"Impossible de lire le journal '{path}': {e}")
+
+    def taille(self, path: Path | None = None) -> int:
+        """End of the complete records: a torn tail is not counted, since
+        the next append cuts it and writes over its place."""
+        try:
+            with (path or self.path).open("rb") as f:
+                return self._fin_complete(f)
+        except FileNotFoundError:
+            return 0
+        except OSError as e:
+            raise ErreurFichier(f"Impossible de lire le journal '{path or self.path}': {e}")
+
+    @property
+    def precedent(self) -> Path:
+        return Path(str(self.path) + ".precedent")
+
+    def archiver(self) -> None:
+        # after a checkpoint: the folded journal is kept one generation, for
+        # the other processes still reading it from where they stopped
+        try:
+            if self.path.exists():
+                os.replace(str(self.path), str(self.precedent))
+            elif self.precedent.exists():
+                os.remove(str(self.precedent))
+        except Exception as e:
+            raise ErreurFichier(f"Impossible d'archiver le journal '{self.path}': {e}")
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.lire())
+
+    @staticmethod
+    def appliquer_images(biblio, livres: dict | None = None, reservations: dict | None = None) -> None:
+        """Install state images (as in the records) for a few ISBNs, in place."""
+        exmap = getattr(biblio, "exemplaires", None)
+        for isbn, image in (livres or {}).items():
+            anciens = []
+            for livre in biblio.trouver_exemplaires(isbn):
+                anciens.extend(livre.exemplaires_stock.ids())
+                biblio._retirer_du_catalogue(livre)
+            for d in image:
+                biblio._ajouter_au_catalogue(biblio._livre_depuis_dict(d))
+            # holds stay on the copies the image still has
+            biblio._lacher_retenues(anciens)
+            if isinstance(exmap, dict):
+                if image:
+                    exmap[isbn] = {
+                        "total": sum(int(d.get("exemplaires", {}).get("total", 0)) for d in image),
+                        "disponibles": sum(int(d.get("exemplaires", {}).get("disponibles", 0)) for d in image),
+                    }
+                else:
+                    exmap.pop(isbn, None)
+        for isbn, q in (reservations or {}).items():
+            if q:
+                biblio.reservations[isbn] = list(q)
+            else:
+                biblio.reservations.pop(isbn, None)
+
+    def rejouer_catalogue(self, biblio) -> None:
+        # keep only the last image per key, then rebuild the catalogue in one pass
+        images: dict[str, list] = {}
+        files: dict[str, list] = {}
+        for r in self.lire():
+            op = r.get("op")
+            if op == "livre":
+                images[r.get("ISBN")] = r.get("data") or []
+            elif op == "reservations":
+                files[r.get("ISBN")] = list(r.get("file") or [])
+        if images:
+            touches = dict(images)
+            livres = []
+            remplaces = set()
+            for livre in biblio.livres:
+                isbn = getattr(livre, "ISBN", None)
+                if isbn in remplaces:
+                    # later books with the same ISBN are part of the image
+                    continue
+                if isbn in images:
+                    livres.extend(biblio._livre_depuis_dict(d) for d in images.pop(isbn))
+                    remplaces.add(isbn)
+                    continue
+                livres.append(livre)
+            for image in images.values():
+                livres.extend(biblio._livre_depuis_dict(d) for d in image)
+            exmap = getattr(biblio, "exemplaires", None)
+            if isinstance(exmap, dict):
+                for isbn, image in touches.items():
+                    if image:
+                        exmap[isbn] = {
+                            "total": sum(int(d.get("exemplaires", {}).get("total", 0)) for d in image),
+                            "disponibles": sum(int(d.get("exemplaires", {}).get("disponibles", 0)) for d in image),
+                        }
+                    else:
+                        exmap.pop(isbn, None)
+            biblio.livres = livres
+        for isbn, q in files.items():
+            if q:
+                biblio.reservations[isbn] = q
+            else:
+                biblio.reservations.pop(isbn, None)
+
+    def rejouer_users(self, users: list) -> list:
+        from .users import User
+        images: dict[str, dict] = {}
+        for r in self.lire():
+            if r.get("op") == "user" and isinstance(r.get("data"), dict):
+                images[r["data"].get("username")] = r["data"]
+        if not images:
+            return users
+        result = []
+        for u in users:
+            data = images.pop(getattr(u, "username", None), None)
+            result.append(User.from_dict(data) if data is not None else u)
+        result.extend(User.from_dict(d) for d in images.values())
+        return result
+
+    def vider(self) -> None:
+        try:
+            if self.path.exists():
+                with self.path.open("w", encoding="utf-8") as f:
+                    f.flush()
+                    os.fsync(f.fileno())
+        except Exception as e:
+            raise ErreurFichier(f"Impossible de vider le journal '{self.path}': {e}")
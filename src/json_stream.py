@@ -0,0 +1,107 @@
+import json
+from typing import Iterator, TextIO
+
+
+_DECODER = json.JSONDecoder()
+_BLANCS = " \t\n\r"
+
+
+class LecteurJSON:
+    """Pull-style incremental JSON reader.
+
+    Containers are walked with `iter_objet` / `iter_tableau` while leaf
+    values (a whole book record, a reservation queue...) are decoded one at a
+    time with `valeur`, so only the current record is ever held in memory.
+    """
+
+    def __init__(self, f: TextIO, taille_bloc: int = 1 << 16):
+        self._f = f
+        self._taille_bloc = taille_bloc
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _remplir(self, taille: int | None = None) -> bool:
+        if self._eof:
+            return False
+        chunk = self._f.read(taille or self._taille_bloc)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _erreur(self, msg: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(msg, self._buf, self._pos)
+
+    def regarder(self) -> str:
+        """Return the next non-blank character without consuming it ('' at EOF)."""
+        while True:
+            n = len(self._buf)
+            while self._pos < n and self._buf[self._pos] in _BLANCS:
+                self._pos += 1
+            if self._pos < n:
+                return self._buf[self._pos]
+            if not self._remplir():
+                return ""
+
+    def attendre(self, ch: str) -> None:
+        if self.regarder() != ch:
+            raise self._erreur(f"'{ch}' attendu")
+        self._pos += 1
+
+    def valeur(self):
+        """Decode and return the next complete JSON value."""
+        self.regarder()
+        while True:
+            try:
+                val, fin = _DECODER.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                # value spans past the buffer: read a bigger block and retry
+                if self._remplir(max(self._taille_bloc, len(self._buf) - self._pos)):
+                    continue
+                raise
+            # a number ending exactly at the buffer boundary may continue
+            if fin == len(self._buf) and self._remplir():
+                continue
+            self._pos = fin
+            return val
+
+    def iter_tableau(self) -> Iterator:
+        """Yield the items of the array starting at the current position."""
+        self.attendre("[")
+        if self.regarder() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self.valeur()
+            c = self.regarder()
+            self._pos += 1
+            if c == "]":
+                return
+            if c != ",":
+                raise self._erreur("',' ou ']' attendu")
+
+    def iter_objet(self) -> Iterator[str]:
+        """Yield the keys of the object starting at the current position.
+
+        The caller must consume the value (with `valeur`, `iter_tableau` or
+        `iter_objet`) before asking for the next key.
+        """
+        self.attendre("{")
+        if self.regarder() == "}":
+            self._pos += 1
+            return
+        while True:
+            if self.regarder() != '"':
+                raise self._erreur("cle attendue")
+            cle = self.valeur()
+            self.attendre(":")
+            yield cle
+            c = self.regarder()
+            self._pos += 1
+            if c == "}":
+                return
+            if c != ",":
+                raise self._erreur("',' ou '}' attendu")
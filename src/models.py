@@ -1,10 +1,23 @@
 import json
 import csv
+from collections import Counter
+from datetime import date, timedelta
 from pathlib import Path
 from typing import List, Optional
 
+from .echeances import IndexPrets
+from .exemplaires import ExemplairesCompacts
+from .fragments import FragmentJSON
+from .prets import isbns_prets, pret_en_cours
+from .reservations import Reservations
+from .retenues import DUREE_RETENUE_JOURS, Retenue, Retenues
 
-class AggregatedLivre:
+
+# new borrows after which co-borrow similarities are recomputed
+RECALCUL_SIMILARITES = 500
+
+
+class AggregatedLivre(FragmentJSON):
     
     def __init__(self, titre: str, auteur: str, ISBN: str, total: int = 0, disponibles: int = 0, genre: str | None = None):
         self.type = "Livre"
@@ -12,12 +25,42 @@ class AggregatedLivre:
         self.auteur = auteur
         # Normalize ISBN to avoid mismatches due to surrounding whitespace
         self.ISBN = ISBN.strip() if isinstance(ISBN, str) else (str(ISBN) if ISBN is not None else "")
-        self.nb_exemplaire = int(total)
-        self.disponibles = int(disponibles)
+        self._total = int(total)
+        self._disponibles = int(disponibles)
         self.genre = genre
         self.reviews: list[dict] = []
         self.history: list[dict] = []
-        self.exemplaires_details: list[dict] = []
+        self.exemplaires_stock = ExemplairesCompacts()
+
+    # Once a book has per-copy details the store is authoritative; the
+    # aggregate numbers only describe books without detailed copies.
+    @property
+    def nb_exemplaire(self) -> int:
+        return len(self.exemplaires_stock) or self._total
+
+    @nb_exemplaire.setter
+    def nb_exemplaire(self, value) -> None:
+        self._total = int(value)
+
+    @property
+    def disponibles(self) -> int:
+        if self.exemplaires_stock:
+            return self.exemplaires_stock.disponibles
+        return self._disponibles
+
+    @disponibles.setter
+    def disponibles(self, value) -> None:
+        self._disponibles = int(value)
+
+    @property
+    def exemplaires_details(self) -> list[dict]:
+        # read-only snapshot in the historical format; change copies through
+        # `exemplaires_stock` or the Bibliotheque methods
+        return self.exemplaires_stock.en_dicts()
+
+    @exemplaires_details.setter
+    def exemplaires_details(self, details) -> None:
+        self.exemplaires_stock = ExemplairesCompacts.depuis_dicts(details)
 
     def to_dict(self) -> dict:
         return {
@@ -31,9 +74,16 @@ class AggregatedLivre:
             "reviews": list(self.reviews),
             "history": list(self.history),
             "exemplaires": {"total": int(self.nb_exemplaire), "disponibles": int(self.disponibles)},
-            "exemplaires_details": list(self.exemplaires_details),
+            "exemplaires_details": self.exemplaires_stock.en_dicts(),
         }
 
+    def _empreinte(self):
+        # reviews and history are append-only
+        stock = self.exemplaires_stock
+        return (self.type, self.titre, self.auteur, self.ISBN, self.genre, self._total, self._disponibles,
+                getattr(self, 'taille_fichier', None), id(self.reviews), len(self.reviews),
+                id(self.history), len(self.history), id(stock), stock.version)
+
     def __repr__(self) -> str:
         return f"AggregatedLivre(ISBN={self.ISBN!r}, total={self.nb_exemplaire}, disponibles={self.disponibles})"
 
@@ -56,13 +106,122 @@ Livre = AggregatedLivre
 class Bibliotheque:
     def __init__(self, nom: str):
         self.nom = nom
-        self.livres: List[AggregatedLivre] = []
-        self.reservations: dict[str, list[str]] = {}
+        self._livres: List[AggregatedLivre] = []
+        # ISBN -> livres (in catalogue order) and exemplaire_id -> (livre, slot)
+        self._par_isbn: dict[str, list[AggregatedLivre]] = {}
+        self._par_exemplaire: dict[str, tuple[AggregatedLivre, int]] = {}
+        # full-text index, built on first search then maintained incrementally
+        self._recherche = None
+        # borrow counts per ISBN, rebuilt from `history` on first use
+        self._popularite = None
+        # recommendation data, computed in batch on first use
+        self._recommandation = None
+        self.reservations = Reservations()
+        # returned copies set aside for the queues, by deadline
+        self.retenues = Retenues()
+        self.prets = IndexPrets()
+        # ArchiveHistorique of the borrow records moved out of `history`
+        self.archive = None
+
+    @property
+    def livres(self) -> List[AggregatedLivre]:
+        return self._livres
+
+    @property
+    def reservations(self) -> Reservations:
+        return self._reservations
+
+    @reservations.setter
+    def reservations(self, files) -> None:
+        # loaders assign plain dicts of lists: they become queues
+        self._reservations = files if isinstance(files, Reservations) else Reservations(files)
+
+    @livres.setter
+    def livres(self, livres) -> None:
+        self._livres = list(livres)
+        self._reindexer()
+
+    def _reindexer(self) -> None:
+        self._par_isbn = {}
+        self._par_exemplaire = {}
+        self._recherche = None
+        self._popularite = None
+        self._recommandation = None
+        for livre in self._livres:
+            self._indexer_livre(livre)
+
+    def _indexer_livre(self, livre: AggregatedLivre) -> None:
+        bucket = self._par_isbn.setdefault(getattr(livre, 'ISBN', None), [])
+        bucket.append(livre)
+        par_exemplaire = self._par_exemplaire
+        for slot, exid in enumerate(livre.exemplaires_stock.ids()):
+            # same rule as _indexer_exemplaire, inlined for bulk loads
+            if exid is not None:
+                par_exemplaire.setdefault(exid, (livre, slot))
+        if self._recherche is not None:
+            self._recherche.ajouter(livre)
+        if self._popularite is not None:
+            self._popularite.ajouter_historique(livre)
+            if len(bucket) == 1:
+                # the ISBN is back: its archived borrows count again
+                self._compter_archive(livre.ISBN, 1)
+        if self._recommandation is not None:
+            self._recommandation.ajouter_livre(livre)
+
+    def _desindexer_livre(self, livre: AggregatedLivre) -> None:
+        isbn = getattr(livre, 'ISBN', None)
+        bucket = self._par_isbn.get(isbn)
+        if bucket is not None:
+            try:
+                bucket.remove(livre)
+            except ValueError:
+                pass
+            if not bucket:
+                del self._par_isbn[isbn]
+        for exid, _ in livre.exemplaires_stock:
+            self._desindexer_exemplaire(livre, exid)
+        if self._recherche is not None:
+            self._recherche.retirer(livre)
+        if self._popularite is not None:
+            self._popularite.retirer_historique(livre)
+            if bucket is not None and not bucket:
+                self._compter_archive(isbn, -1)
+        if self._recommandation is not None:
+            self._recommandation.retirer_livre(livre)
+
+    def _indexer_exemplaire(self, livre: AggregatedLivre, exid: str, slot: int) -> None:
+        if exid is not None:
+            # first occurrence wins, like the former linear scans
+            self._par_exemplaire.setdefault(exid, (livre, slot))
+
+    def _desindexer_exemplaire(self, livre: AggregatedLivre, exid: str) -> None:
+        entry = self._par_exemplaire.get(exid)
+        if entry is not None and entry[0] is livre:
+            del self._par_exemplaire[exid]
+
+    def _ajouter_au_catalogue(self, livre: AggregatedLivre) -> None:
+        self._livres.append(livre)
+        self._indexer_livre(livre)
+
+    def _ajouter_copie(self, livre: AggregatedLivre, exemplaire_id: str, etat: str = 'disponible') -> int:
+        slot = livre.exemplaires_stock.ajouter(exemplaire_id, etat)
+        self._indexer_exemplaire(livre, exemplaire_id, slot)
+        return slot
+
+    def _materialiser_exemplaires(self, livre: AggregatedLivre) -> None:
+        # give the copies of an aggregate-only title an id, using the same
+        # `<ISBN>-synthN` ids the GUI already displays for them
+        if livre.exemplaires_stock:
+            return
+        total = int(livre._total)
+        dispo = min(int(livre._disponibles), total)
+        for i in range(total):
+            self._ajouter_copie(livre, f"{livre.ISBN}-synth{i+1}", 'disponible' if i < dispo else 'emprunte')
 
     def ajouter_livre(self, livre: Livre) -> None:
         
         if isinstance(livre, AggregatedLivre):
-            self.livres.append(livre)
+            self._ajouter_au_catalogue(livre)
             return
         
         try:
@@ -77,7 +236,7 @@ class Bibliotheque:
         ag = AggregatedLivre(titre, auteur, isbn, total=int(total), disponibles=int(dispon))
         if 'exemplaires_details' in livre:
             ag.exemplaires_details = list(livre.get('exemplaires_details', []))
-        self.livres.append(ag)
+        self._ajouter_au_catalogue(ag)
 
     def afficher(self) -> None:
         
@@ -91,143 +250,178 @@ class Bibliotheque:
     def lister(self) -> list:
         return list(self.livres)
 
+    @property
+    def recherche(self):
+        if self._recherche is None:
+            from .search import IndexRecherche
+            self._recherche = IndexRecherche(self._livres)
+        return self._recherche
+
+    @property
+    def popularite(self):
+        if self._popularite is None:
+            from .popularite import Popularite
+            self._popularite = Popularite.depuis_historique(self._livres)
+            if self.archive is not None:
+                # archived borrows are older than every window: all-time only
+                for isbn, n in self.archive.comptes_livres().items():
+                    if isbn in self._par_isbn:
+                        self._popularite.enregistrer(isbn, None, delta=n)
+        return self._popularite
+
+    def _compter_archive(self, isbn: str, signe: int) -> None:
+        # archived borrows are older than every window: all-time only, and
+        # only while the ISBN is in the catalogue
+        n = self.archive.compte_livre(isbn) if self.archive is not None else 0
+        if n:
+            self._popularite.enregistrer(isbn, None, delta=signe * n)
+
+    def rechercher(self, titre: str | None = None, auteur: str | None = None, genre: str | None = None,
+                   prefixe: bool = True, fuzzy: int = 0) -> list:
+        return self.recherche.rechercher(titre=titre, auteur=auteur, genre=genre, prefixe=prefixe, fuzzy=fuzzy)
+
+    def modifier_genre(self, ISBN: str, genre: str | None) -> bool:
+        livres = self._par_isbn.get(ISBN, ())
+        for livre in livres:
+            livre.genre = genre
+            self._genre_modifie(livre)
+        return bool(livres)
+
+    def _genre_modifie(self, livre: AggregatedLivre) -> None:
+        if self._recherche is not None:
+            self._recherche.mettre_a_jour(livre)
+        # the genre -> books lists are rebuilt with the next batch
+        self._recommandation = None
+
+    def trouver_livre(self, ISBN: str) -> Optional[AggregatedLivre]:
+        bucket = self._par_isbn.get(ISBN)
+        return bucket[0] if bucket else None
+
     def supprimer_livre(self, ISBN: str) -> bool:
-        for livre in list(self.livres):
-            if livre.ISBN == ISBN:
-                self.livres.remove(livre)
-                return True
-        return False
+        livre = self.trouver_livre(ISBN)
+        if livre is None:
+            return False
+        self._retirer_du_catalogue(livre)
+        self._lacher_retenues(livre.exemplaires_stock.ids())
+        return True
+
+    def _retirer_du_catalogue(self, livre: AggregatedLivre) -> None:
+        self._livres.remove(livre)
+        self._desindexer_livre(livre)
+
+    def _lacher_retenues(self, exemplaire_ids) -> None:
+        # holds on copies that left the catalogue; their users keep their place in the queue
+        for exid in list(exemplaire_ids):
+            if exid not in self._par_exemplaire:
+                self.retenues.retirer(exid)
 
-    def ajouter_exemplaire(self, titre: str, auteur: str, ISBN: str, exemplaire_id: str, genre: str | None = None) -> None:
+    def ajouter_exemplaire(self, titre: str, auteur: str, ISBN: str, exemplaire_id: str, genre: str | None = None,
+                           etat: str = 'disponible') -> None:
         if not ISBN:
             return
-        ag = None
-        for livre in self.livres:
-            if getattr(livre, 'ISBN', None) == ISBN:
-                ag = livre
-                break
+        ag = self.trouver_livre(ISBN)
         if ag is None:
             
             ag = AggregatedLivre(titre, auteur, ISBN, total=1, disponibles=1)
             if genre:
                 ag.genre = genre
             if exemplaire_id:
-                ag.exemplaires_details.append({'exemplaire_id': exemplaire_id, 'etat': 'disponible'})
+                ag.exemplaires_stock.ajouter(exemplaire_id, etat)
             else:
                 
                 from uuid import uuid4
-                ag.exemplaires_details.append({'exemplaire_id': f"{ISBN}-ex{uuid4().hex[:8]}", 'etat': 'disponible'})
-            self.livres.append(ag)
+                ag.exemplaires_stock.ajouter(f"{ISBN}-ex{uuid4().hex[:8]}", etat)
+            self._ajouter_au_catalogue(ag)
             return
 
         
-        ag.nb_exemplaire = int(getattr(ag, 'nb_exemplaire', 0)) + 1
-        ag.disponibles = int(getattr(ag, 'disponibles', 0)) + 1
-        if genre:
-            try:
-                ag.genre = genre
-            except Exception:
-                pass
+        self._materialiser_exemplaires(ag)
+        if genre and genre != ag.genre:
+            ag.genre = genre
+            self._genre_modifie(ag)
         if exemplaire_id:
-            ag.exemplaires_details.append({'exemplaire_id': exemplaire_id, 'etat': 'disponible'})
+            self._ajouter_copie(ag, exemplaire_id, etat)
         else:
             from uuid import uuid4
-            ag.exemplaires_details.append({'exemplaire_id': f"{ISBN}-ex{uuid4().hex[:8]}", 'etat': 'disponible'})
-        ag.disponibles = min(ag.disponibles, ag.nb_exemplaire)
+            self._ajouter_copie(ag, f"{ISBN}-ex{uuid4().hex[:8]}", etat)
 
     def trouver_exemplaires(self, ISBN: str) -> list:
-        return [liv for liv in self.livres if getattr(liv, 'ISBN', None) == ISBN]
+        return list(self._par_isbn.get(ISBN, ()))
 
     def emprunter_exemplaire(self, ISBN: str, user) -> Optional[Livre]:
         
         queue = self.reservations.get(ISBN, [])
         username = getattr(user, 'username', None)
+        retenue = self.retenues.pour(ISBN, username)
+        entry = self._par_exemplaire.get(retenue.exemplaire_id) if retenue is not None else None
+        if retenue is not None and entry is None:
+            # the held copy left the catalogue: drop the hold, keep the place in the queue
+            self.retenues.retirer(retenue.exemplaire_id)
+        elif retenue is not None:
+            # the copy set aside for this user
+            livre, slot = entry
+            self._preter(livre, slot, user, username, 'reserve')
+            self.retenues.retirer(retenue.exemplaire_id)
+            self._quitter_file(ISBN, username, user)
+            return livre
         if queue and queue[0] != username:
             raise ValueError("Une réservation existe et vous n'êtes pas en tête de file")
-        for livre in self.livres:
-            if getattr(livre, 'ISBN', None) != ISBN:
-                continue
-
-            # If per-exemplar details exist, select an available exemplar
-            details = getattr(livre, 'exemplaires_details', []) or []
-            if details:
-                found = None
-                for d in details:
-                    if str(d.get('etat', 'disponible')).lower() == 'disponible':
-                        found = d
-                        break
-                if found is None:
-                    # no available exemplar in details
+        for livre in self._par_isbn.get(ISBN, ()):
+            stock = livre.exemplaires_stock
+            if not stock:
+                if int(getattr(livre, 'disponibles', 0)) <= 0:
                     continue
+                # aggregate-only title: give its copies ids so the loan can be returned
+                self._materialiser_exemplaires(livre)
 
-                # mark exemplar as borrowed
-                exid = found.get('exemplaire_id')
-                found['etat'] = 'emprunte'
-                livre.disponibles = max(0, int(getattr(livre, 'disponibles', 0)) - 1)
-                try:
-                    loan = user.borrow(ISBN, exid)
-                except Exception:
-                    # revert on failure
-                    found['etat'] = 'disponible'
-                    livre.disponibles = min(livre.nb_exemplaire, int(getattr(livre, 'disponibles', 0)) + 1)
-                    raise
-
-                entry = {}
-                try:
-                    entry = loan.to_dict()
-                    entry['username'] = username
-                except Exception:
-                    entry = {'username': username}
-                livre.history.append(entry)
-                if queue and queue[0] == username:
-                    queue.pop(0)
-                return livre
-
-            # No per-exemplar details present; fall back to aggregate behavior but synthesize an exemplar
-            if int(getattr(livre, 'disponibles', 0)) <= 0:
+            slot = stock.premier('disponible')
+            if slot is None:
+                # no available exemplar in details
                 continue
 
-            # synthesize an exemplar id and record it in details so future returns find it
-            synth_idx = len(getattr(livre, 'history', [])) + 1
-            exid = f"{ISBN}-synth{synth_idx}"
-            try:
-                livre.exemplaires_details.append({'exemplaire_id': exid, 'etat': 'emprunte'})
-            except Exception:
-                livre.exemplaires_details = [{'exemplaire_id': exid, 'etat': 'emprunte'}]
-            livre.nb_exemplaire = max(int(getattr(livre, 'nb_exemplaire', 0)), len(livre.exemplaires_details))
-            livre.disponibles = max(0, int(getattr(livre, 'disponibles', 0)) - 1)
-            try:
-                loan = user.borrow(ISBN, exid)
-            except Exception:
-                # revert synthesized detail
-                try:
-                    if livre.exemplaires_details and livre.exemplaires_details[-1].get('exemplaire_id') == exid:
-                        livre.exemplaires_details.pop()
-                except Exception:
-                    pass
-                livre.disponibles = min(livre.nb_exemplaire, int(getattr(livre, 'disponibles', 0)) + 1)
-                raise
-
-            entry = {}
-            try:
-                entry = loan.to_dict()
-                entry['username'] = username
-            except Exception:
-                entry = {'username': username}
-            livre.history.append(entry)
-            if queue and queue[0] == username:
-                queue.pop(0)
+            self._preter(livre, slot, user, username, 'disponible')
+            self._quitter_file(ISBN, username, user)
             return livre
 
         raise ValueError("Aucun exemplaire disponible pour cet ISBN")
 
-    def retourner_exemplaire(self, exemplaire_id: str, user, users_file: str | None = None) -> Optional[float]:
-        
-        loan = None
-        for l in getattr(user, 'loans', []):
-            if getattr(l, 'exemplaire_id', None) == exemplaire_id and getattr(l, 'date_retour_effective', None) is None:
-                loan = l
+    def _preter(self, livre: AggregatedLivre, slot: int, user, username, etat: str) -> None:
+        # mark exemplar as borrowed
+        stock = livre.exemplaires_stock
+        exid = stock.id(slot)
+        stock.changer_etat(slot, 'emprunte')
+        try:
+            loan = user.borrow(livre.ISBN, exid)
+        except Exception:
+            # revert on failure
+            stock.changer_etat(slot, etat)
+            raise
+
+        entry = {}
+        try:
+            entry = loan.to_dict()
+            entry['username'] = username
+        except Exception:
+            entry = {'username': username}
+        livre.history.append(entry)
+        if self._popularite is not None:
+            self._popularite.enregistrer(livre.ISBN, loan.date_emprunt)
+        if self._recommandation is not None:
+            self._recommandation.noter_emprunt(username, livre)
+
+    def _quitter_file(self, ISBN: str, username, user=None) -> None:
+        # a served (or lapsed) reservation leaves the queue and the user's list
+        queue = self.reservations.get(ISBN)
+        if queue is not None and username in queue:
+            queue.remove(username)
+        for i, r in enumerate(getattr(user, 'reservations', ())):
+            if getattr(r, 'isbn', None) == ISBN:
+                user.reservations.pop(i)
                 break
+
+    def retourner_exemplaire(self, exemplaire_id: str, user, users_file: str | None = None, depot=None) -> Optional[float]:
+        
+        loan = pret_en_cours(user, exemplaire_id)
         if loan is None:
             return None
         montant = user.return_loan(loan)
@@ -235,36 +429,110 @@ class Bibliotheque:
         isbn = getattr(loan, 'isbn', None) or getattr(loan, 'ISBN', None)
         if isbn is None:
             return montant
-        for livre in self.livres:
-            if getattr(livre, 'ISBN', None) == isbn:
-                # try to mark the matching exemplar detail as available again
-                updated_detail = False
-                for d in getattr(livre, 'exemplaires_details', []):
-                    if d.get('exemplaire_id') == exemplaire_id:
-                        # only set to disponible if not endommagé/perdu
-                        if str(d.get('etat', '')).lower() in ('emprunte', 'emprunt'):
-                            d['etat'] = 'disponible'
-                        updated_detail = True
-                        break
-
-                # update aggregate available count
-                if updated_detail:
-                    # recompute disponibles from details to be safe
-                    try:
-                        livre.disponibles = sum(1 for d in getattr(livre, 'exemplaires_details', []) if str(d.get('etat', 'disponible')).lower() == 'disponible')
-                    except Exception:
-                        livre.disponibles = min(livre.nb_exemplaire, int(getattr(livre, 'disponibles', 0)) + 1)
-                else:
-                    livre.disponibles = min(livre.nb_exemplaire, int(getattr(livre, 'disponibles', 0)) + 1)
-                queue = self.reservations.get(livre.ISBN, [])
-                if queue and users_file:
-                    next_username = queue[0]
-                    from .file_manager import BibliothequeAvecFichier
-                    BibliothequeAvecFichier.notifier_user(next_username, f"Livre disponible: {livre.titre}", users_file)
-                break
+        livre = self.trouver_livre(isbn)
+        if livre is None:
+            return montant
+        # try to mark the matching exemplar detail as available again
+        entry = self._par_exemplaire.get(exemplaire_id)
+        if entry is not None and entry[0] is livre:
+            slot = entry[1]
+            # only set to disponible if not endommagé/perdu
+            if livre.exemplaires_stock.etat(slot) in ('emprunte', 'emprunt'):
+                livre.exemplaires_stock.changer_etat(slot, 'disponible')
+                self._retenir(livre, slot, users_file=users_file, depot=depot)
+        else:
+            livre.disponibles = min(livre.nb_exemplaire, int(getattr(livre, 'disponibles', 0)) + 1)
         return montant
 
-    def reserver_livre(self, ISBN: str, username: str = None, user_obj=None, users_file: str | None = None) -> bool:
+    def _retenir(self, livre: AggregatedLivre, slot: int, aujourdhui: Optional[date] = None,
+                 users_file: str | None = None, depot=None) -> Optional[Retenue]:
+        # set an available copy aside for the first queued user not holding one yet
+        stock = livre.exemplaires_stock
+        if stock.etat(slot) != 'disponible':
+            return None
+        for username in self.reservations.get(livre.ISBN, ()):
+            if self.retenues.pour(livre.ISBN, username) is None:
+                break
+        else:
+            return None
+        stock.changer_etat(slot, 'reserve')
+        jusqu_au = (aujourdhui or date.today()) + timedelta(days=DUREE_RETENUE_JOURS)
+        retenue = self.retenues.ajouter(Retenue(livre.ISBN, stock.id(slot), username, jusqu_au))
+        self._notifier(username, f"Livre disponible: {livre.titre}, réservé pour vous jusqu'au {jusqu_au}",
+                       users_file, depot)
+        return retenue
+
+    def _ceder(self, retenue: Retenue, aujourdhui: Optional[date] = None,
+               users_file: str | None = None, depot=None) -> Optional[Retenue]:
+        # a hold ended without a loan: the copy goes to the next user, or back on the shelf
+        entry = self._par_exemplaire.get(retenue.exemplaire_id)
+        if entry is None:
+            return None
+        livre, slot = entry
+        if livre.exemplaires_stock.etat(slot) != 'reserve':
+            return None
+        livre.exemplaires_stock.changer_etat(slot, 'disponible')
+        return self._retenir(livre, slot, aujourdhui, users_file, depot)
+
+    @staticmethod
+    def _notifier(username: str, message: str, users_file: str | None, depot) -> None:
+        if users_file or depot is not None:
+            from .file_manager import BibliothequeAvecFichier
+            BibliothequeAvecFichier.notifier_user(username, message, users_file, depot=depot)
+
+    def expirer_retenues(self, aujourdhui: Optional[date] = None, users_file: str | None = None,
+                         depot=None) -> list[tuple[Retenue, Optional[Retenue]]]:
+        """Lapse the holds past their deadline and pass each copy on.
+
+        The lapsed user leaves the queue; the copy goes to the next queued
+        user or becomes available. Returns `(lapsed hold, new hold or None)`
+        pairs. Only the holds due are visited (see `Retenues.echues`).
+        """
+        aujourdhui = aujourdhui or date.today()
+        resultat = []
+        for retenue in self.retenues.echues(aujourdhui):
+            self._quitter_file(retenue.isbn, retenue.username, self.retenues.user(retenue.username))
+            livre = self.trouver_livre(retenue.isbn)
+            titre = livre.titre if livre is not None else retenue.isbn
+            self._notifier(retenue.username, f"Réservation expirée: {titre}", users_file, depot)
+            resultat.append((retenue, self._ceder(retenue, aujourdhui, users_file, depot)))
+        return resultat
+
+    def reprendre_retenues(self, users: list) -> list[str]:
+        """Rebuild the holds from the users' reservations after a load.
+
+        Copies left "reserve" without a matching hold are given to the next
+        queued user or put back on the shelf. Returns the ISBNs whose copies
+        changed that way.
+        """
+        self.retenues = Retenues()
+        self.retenues.suivre(users)
+        for u in users:
+            for r in getattr(u, 'reservations', []):
+                exid, limite = getattr(r, 'exemplaire_id', None), getattr(r, 'date_limite', None)
+                if not exid or limite is None:
+                    continue
+                entry = self._par_exemplaire.get(exid)
+                queue = self.reservations.get(r.isbn, ())
+                if (entry is not None and entry[0].ISBN == r.isbn and u.username in queue
+                        and entry[0].exemplaires_stock.etat(entry[1]) == 'reserve' and exid not in self.retenues):
+                    self.retenues.ajouter(Retenue(r.isbn, exid, u.username, limite))
+                else:
+                    r.exemplaire_id, r.date_limite = None, None
+                    u.marquer_modifie()
+        modifies = []
+        for livre in self._livres:
+            stock = livre.exemplaires_stock
+            if not stock.compter('reserve'):
+                continue
+            for slot, exid in enumerate(stock.ids()):
+                if stock.etat(slot) == 'reserve' and exid not in self.retenues:
+                    stock.changer_etat(slot, 'disponible')
+                    self._retenir(livre, slot)
+                    modifies.append(livre.ISBN)
+        return modifies
+
+    def reserver_livre(self, ISBN: str, username: str = None, user_obj=None, users_file: str | None = None, depot=None) -> bool:
         
         if username is None and user_obj is not None:
             username = getattr(user_obj, 'username', None)
@@ -278,15 +546,21 @@ class Bibliotheque:
         # Append username to reservation queue.
         q.append(username)
         if user_obj is not None:
+            self.retenues.suivre([user_obj])
             try:
                 from .users import Reservation
                 r = Reservation(ISBN, None, __import__('datetime').date.today())
                 user_obj.reservations.append(r)
             except Exception:
                 pass
-            # If a users file path is provided, update the persisted users list
-            # by loading existing users, updating/adding this user, then saving.
-            if users_file:
+            # A keyed users store rewrites only this user; a plain users file
+            # is loaded, updated/extended with this user, then saved.
+            if depot is not None:
+                try:
+                    depot.ecrire(user_obj)
+                except Exception:
+                    pass
+            elif users_file:
                 try:
                     from .file_manager import BibliothequeAvecFichier
                     existing = BibliothequeAvecFichier.charger_users(users_file)
@@ -305,39 +579,46 @@ class Bibliotheque:
 
     def add_review(self, ISBN: str, username: str, rating: int, comment: str | None = None) -> bool:
         
-        for livre in self.livres:
-            if livre.ISBN == ISBN:
-                if not hasattr(livre, 'reviews'):
-                    livre.reviews = []
-                livre.reviews.append({
-                    "username": username,
-                    "rating": int(rating),
-                    "comment": comment,
-                })
-                return True
-        return False
+        livre = self.trouver_livre(ISBN)
+        if livre is None:
+            return False
+        if not hasattr(livre, 'reviews'):
+            livre.reviews = []
+        livre.reviews.append({
+            "username": username,
+            "rating": int(rating),
+            "comment": comment,
+        })
+        return True
+
+    @property
+    def recommandation(self):
+        if self._recommandation is None:
+            from .recommandation import MoteurRecommandation
+            self._recommandation = MoteurRecommandation(self._livres)
+        elif self._recommandation.nouveaux_emprunts >= RECALCUL_SIMILARITES:
+            self._recommandation.calculer_similarites()
+        return self._recommandation
 
     def recommend_for_user(self, user, limit: int = 6) -> list:
         
-        genres = []
-
-        for l in getattr(user, 'loans', []):
-            for livre in self.livres:
-                if livre.ISBN == l.isbn and getattr(livre, 'genre', None):
-                    genres.append(livre.genre)
-
-        for livre in self.livres:
-            for h in getattr(livre, 'history', []):
-                if h.get('username') == getattr(user, 'username', None) and livre.genre:
-                    genres.append(livre.genre)
+        moteur = self.recommandation
+        username = getattr(user, 'username', None)
+        seen_isbns = set(isbns_prets(user))
+        recs = moteur.recommander(username, seen_isbns, self.trouver_livre, limit)
+        if len(recs) >= limit:
+            return recs
 
-        from collections import Counter
-        c = Counter(genres)
-        fav_genres = [g for g, _ in c.most_common()]
+        # thin data: complete with the genre-based selection
+        genres = Counter()
+        for isbn in isbns_prets(user):
+            for livre in self._par_isbn.get(isbn, ()):
+                if getattr(livre, 'genre', None):
+                    genres[livre.genre] += 1
+        genres.update(moteur.affinites.get(username, Counter()))
+        fav_genres = [g for g, _ in genres.most_common()]
 
-        recs = []
-        added_isbns = set()
-        seen_isbns = {l.isbn for l in getattr(user, 'loans', [])}
+        added_isbns = {lv.ISBN for lv in recs}
 
         if not fav_genres:
             for lv in self.livres:
@@ -355,12 +636,10 @@ class Bibliotheque:
             return recs
 
         for g in fav_genres:
-            for livre in self.livres:
+            for livre in moteur.par_genre.get(g, ()):
                 isbn = getattr(livre, 'ISBN', None)
                 if not isbn:
                     continue
-                if getattr(livre, 'genre', None) != g:
-                    continue
                 if isbn in seen_isbns or isbn in added_isbns:
                     continue
                 recs.append(livre)
@@ -369,7 +648,7 @@ class Bibliotheque:
                     return recs
         return recs
 
-    def annuler_reservation(self, ISBN: str, username: str = None, user_obj=None, users_file: str | None = None) -> bool:
+    def annuler_reservation(self, ISBN: str, username: str = None, user_obj=None, users_file: str | None = None, depot=None) -> bool:
         if username is None and user_obj is not None:
             username = getattr(user_obj, 'username', None)
         if username is None:
@@ -379,6 +658,10 @@ class Bibliotheque:
         if username in q:
             q.remove(username)
             removed = True
+        retenue = self.retenues.pour(ISBN, username)
+        if retenue is not None:
+            self.retenues.retirer(retenue.exemplaire_id)
+            self._ceder(retenue, users_file=users_file, depot=depot)
         if user_obj is not None:
             try:
                 for i, r in enumerate(list(user_obj.reservations)):
@@ -387,7 +670,12 @@ class Bibliotheque:
                         break
             except Exception:
                 pass
-            if users_file:
+            if depot is not None:
+                try:
+                    depot.ecrire(user_obj)
+                except Exception:
+                    pass
+            elif users_file:
                 from .file_manager import BibliothequeAvecFichier
                 try:
                     BibliothequeAvecFichier.sauvegarder_users([user_obj] + [], users_file)
@@ -398,24 +686,33 @@ class Bibliotheque:
     def get_reservations(self, ISBN: str) -> list:
         return list(self.reservations.get(ISBN, []))
 
+    def position_reservation(self, ISBN: str, username: str) -> Optional[int]:
+        """0-based place of `username` in the queue of `ISBN`, None if not waiting."""
+        return self.reservations.position(ISBN, username)
+
     def recherche_par_titre(self, titre: str):
-        return [livre for livre in self.livres if livre.titre == titre]
+        candidats = self.recherche.candidats('titre', titre)
+        if candidats is None:
+            return [livre for livre in self.livres if livre.titre == titre]
+        return [livre for livre in self.recherche.trier(candidats) if livre.titre == titre]
 
     def recherche_par_auteur(self, auteur: str):
-        return [livre for livre in self.livres if livre.auteur.lower() == auteur.lower()]
+        candidats = self.recherche.candidats('auteur', auteur)
+        if candidats is None:
+            return [livre for livre in self.livres if livre.auteur.lower() == auteur.lower()]
+        return [livre for livre in self.recherche.trier(candidats) if livre.auteur.lower() == auteur.lower()]
 
-    def stats(self, users: list | None = None) -> dict:
+    def stats(self, users: list | None = None, top: int = 10) -> dict:
         
         from collections import Counter, defaultdict
+        from .popularite import FENETRES
         res: dict = {}
-        
-        hist_counts = Counter()
-        title_map = {}
-        for livre in self.livres:
-            title_map[livre.ISBN] = getattr(livre, 'titre', None)
-            hist_counts[livre.ISBN] += len(getattr(livre, 'history', []))
-        popular = [(isbn, title_map.get(isbn), cnt) for isbn, cnt in hist_counts.most_common()]
-        res['popular_books'] = popular
+
+        def titres(classement):
+            return [(isbn, getattr(self.trouver_livre(isbn), 'titre', None), cnt) for isbn, cnt in classement]
+
+        res['popular_books'] = titres(self.popularite.top(top))
+        res['popular_by_window'] = {f: titres(self.popularite.top(top, fenetre=f)) for f in FENETRES}
 
         
         
@@ -434,90 +731,72 @@ class Bibliotheque:
         active_users = 0
         overdue = 0
         if users:
-            for u in users:
-                active = any(l.date_retour_effective is None for l in getattr(u, 'loans', []))
-                if active:
-                    active_users += 1
-                for l in getattr(u, 'loans', []):
-                    if l.date_retour_effective is None and getattr(l, 'date_retour_prevue', None) and l.date_retour_prevue < __import__('datetime').date.today():
-                        overdue += 1
+            # users already attached are skipped; their loans are kept current
+            # by User.borrow/return_loan
+            self.prets.suivre(users)
+            active_users = self.prets.nb_users_actifs
+            overdue = self.prets.nb_en_retard()
         res['active_users'] = active_users
         res['overdue_loans'] = overdue
         return res
 
     def set_exemplaire_status(self, exemplaire_id: str, status: str) -> bool:
         
-        for livre in self.livres:
-            
-            for d in getattr(livre, 'exemplaires_details', []):
-                if d.get('exemplaire_id') == exemplaire_id:
-                    old = d.get('etat', 'disponible')
-                    new = status
-                    d['etat'] = new
-                    
-                    if old == 'disponible' and new != 'disponible':
-                        livre.disponibles = max(0, livre.disponibles - 1)
-                    elif old != 'disponible' and new == 'disponible':
-                        livre.disponibles = min(livre.nb_exemplaire, livre.disponibles + 1)
-                    return True
-        return False
+        entry = self._par_exemplaire.get(exemplaire_id)
+        if entry is None:
+            return False
+        livre, slot = entry
+        # the store keeps the per-state counters (and so `disponibles`) in sync
+        livre.exemplaires_stock.changer_etat(slot, status)
+        if status != 'reserve':
+            # taken off the hold shelf by hand: the user keeps their place in the queue
+            self.retenues.retirer(exemplaire_id)
+        return True
 
     def get_exemplar_statuses(self, ISBN: str) -> dict:
         
-        from collections import Counter
-        for livre in self.livres:
-            if getattr(livre, 'ISBN', None) == ISBN:
-                details = getattr(livre, 'exemplaires_details', None)
-                if details:
-                    c = Counter()
-                    for d in details:
-                        st = d.get('etat', 'disponible')
-                        c[st] += 1
-                    c['total'] = sum(c.values())
-                    return dict(c)
-                empruntes = max(0, int(livre.nb_exemplaire) - int(livre.disponibles))
-                return {'disponible': int(livre.disponibles), 'emprunte': int(empruntes), 'total': int(livre.nb_exemplaire)}
-        return {'disponible': 0, 'emprunte': 0, 'total': 0}
+        livre = self.trouver_livre(ISBN)
+        if livre is None:
+            return {'disponible': 0, 'emprunte': 0, 'total': 0}
+        stock = livre.exemplaires_stock
+        if stock:
+            c = stock.statuts()
+            c['total'] = len(stock)
+            return c
+        empruntes = max(0, int(livre.nb_exemplaire) - int(livre.disponibles))
+        return {'disponible': int(livre.disponibles), 'emprunte': int(empruntes), 'total': int(livre.nb_exemplaire)}
 
     def find_exemplar_by_id(self, exemplaire_id: str):
         
-        for livre in self.livres:
-            for d in getattr(livre, 'exemplaires_details', []):
-                if d.get('exemplaire_id') == exemplaire_id:
-                    
-                    from types import SimpleNamespace
-                    obj = SimpleNamespace(**d)
-                    
-                    obj.ISBN = getattr(livre, 'ISBN', None)
-                    obj.titre = getattr(livre, 'titre', None)
-                    return obj
-        return None
+        entry = self._par_exemplaire.get(exemplaire_id)
+        if entry is None:
+            return None
+        livre, slot = entry
+        from types import SimpleNamespace
+        obj = SimpleNamespace(**livre.exemplaires_stock.detail(slot))
+        
+        obj.ISBN = getattr(livre, 'ISBN', None)
+        obj.titre = getattr(livre, 'titre', None)
+        return obj
 
     def ajouter_exemplaires_bulk(self, titre: str, auteur: str, ISBN: str, count: int) -> int:
         
         
         added = int(count)
-        ag = None
-        for livre in self.livres:
-            if getattr(livre, 'ISBN', None) == ISBN:
-                ag = livre
-                break
+        ag = self.trouver_livre(ISBN)
         if ag is None:
             ag = AggregatedLivre(titre, auteur, ISBN, total=added, disponibles=added)
             
             from uuid import uuid4
             for _ in range(added):
-                ag.exemplaires_details.append({'exemplaire_id': f"{ISBN}-ex{uuid4().hex[:8]}", 'etat': 'disponible'})
-            self.livres.append(ag)
+                ag.exemplaires_stock.ajouter(f"{ISBN}-ex{uuid4().hex[:8]}")
+            self._ajouter_au_catalogue(ag)
             return added
         
         from uuid import uuid4
+        self._materialiser_exemplaires(ag)
         for _ in range(added):
-            ag.nb_exemplaire += 1
-            ag.disponibles += 1
-            ag.exemplaires_details.append({'exemplaire_id': f"{ISBN}-ex{uuid4().hex[:8]}", 'etat': 'disponible'})
-        
-        ag.disponibles = min(ag.disponibles, ag.nb_exemplaire)
+            self._ajouter_copie(ag, f"{ISBN}-ex{uuid4().hex[:8]}")
         return added
 
     def ensure_min_exemplaires_for_all(self, min_count: int = 5) -> int:
@@ -538,7 +817,12 @@ class Bibliotheque:
             if livre.nb_exemplaire > max_per_isbn:
                 to_remove = int(livre.nb_exemplaire - max_per_isbn)
                 
-                livre.exemplaires_details = livre.exemplaires_details[:-to_remove] if len(livre.exemplaires_details) >= to_remove else []
+                stock = livre.exemplaires_stock
+                keep = len(stock) - to_remove if len(stock) >= to_remove else 0
+                retires = stock.tronquer(keep)
+                for exid in retires:
+                    self._desindexer_exemplaire(livre, exid)
+                self._lacher_retenues(retires)
                 livre.nb_exemplaire = max_per_isbn
                 livre.disponibles = min(livre.disponibles, livre.nb_exemplaire)
                 removed += to_remove
@@ -550,11 +834,16 @@ class Bibliotheque:
         b.livres = list(self.livres)
         return b.sauvegarder(filepath)
 
-    def charger(self, filepath: str) -> None:
+    def charger(self, filepath: str, streaming: bool = False) -> None:
         from .file_manager import BibliothequeAvecFichier
         b = BibliothequeAvecFichier(self.nom)
-        b.charger(filepath)
-        self.livres = b.livres
+        b.charger(filepath, streaming=streaming)
+        self._livres = b._livres
+        self._par_isbn = b._par_isbn
+        self._par_exemplaire = b._par_exemplaire
+        self._recherche = None
+        self._popularite = None
+        self._recommandation = None
 
     def export_csv(self, filepath: str) -> None:
         from .file_manager import BibliothequeAvecFichier
@@ -0,0 +1,128 @@
+from collections import Counter
+from datetime import date
+from typing import Iterable, Optional
+
+
+FENETRES = (7, 30, 365)
+
+
+def _jour(valeur) -> Optional[int]:
+    if isinstance(valeur, date):
+        return valeur.toordinal()
+    try:
+        return date.fromisoformat(str(valeur)[:10]).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+class _Classement:
+    """Counts per ISBN with ISBNs grouped by count, so a top-k walks the
+    few distinct count values instead of sorting every title."""
+
+    __slots__ = ("comptes", "groupes")
+
+    def __init__(self):
+        self.comptes: dict[str, int] = {}
+        # count -> ISBNs at that count (dict as an insertion-ordered set)
+        self.groupes: dict[int, dict[str, None]] = {}
+
+    def modifier(self, isbn: str, delta: int) -> None:
+        avant = self.comptes.get(isbn, 0)
+        apres = avant + delta
+        if avant:
+            groupe = self.groupes[avant]
+            del groupe[isbn]
+            if not groupe:
+                del self.groupes[avant]
+        if apres > 0:
+            self.comptes[isbn] = apres
+            self.groupes.setdefault(apres, {})[isbn] = None
+        else:
+            self.comptes.pop(isbn, None)
+
+    def top(self, k: int) -> list[tuple[str, int]]:
+        res = []
+        for n in sorted(self.groupes, reverse=True):
+            for isbn in self.groupes[n]:
+                res.append((isbn, n))
+                if len(res) >= k:
+                    return res
+        return res
+
+
+class Popularite:
+    """Borrow counts per ISBN, all-time and over sliding 7/30/365-day windows.
+
+    Events are bucketed per day; each window keeps its own ranking and
+    subtracts the days that slid out of it when queried on a later day.
+    Built from the books' `history` and fed by `emprunter_exemplaire`.
+    """
+
+    def __init__(self, aujourdhui: Optional[date] = None):
+        self._jours: dict[int, Counter] = {}
+        self._total = _Classement()
+        self._fenetres = {f: _Classement() for f in FENETRES}
+        self._aujourdhui = (aujourdhui or date.today()).toordinal()
+
+    @classmethod
+    def depuis_historique(cls, livres: Iterable, aujourdhui: Optional[date] = None) -> "Popularite":
+        pop = cls(aujourdhui)
+        for livre in livres:
+            pop.ajouter_historique(livre)
+        return pop
+
+    def ajouter_historique(self, livre) -> None:
+        for h in getattr(livre, "history", []):
+            self.enregistrer(livre.ISBN, h.get("date_emprunt") if isinstance(h, dict) else None)
+
+    def retirer_historique(self, livre) -> None:
+        for h in getattr(livre, "history", []):
+            self.enregistrer(livre.ISBN, h.get("date_emprunt") if isinstance(h, dict) else None, delta=-1)
+
+    def enregistrer(self, isbn: str, jour=None, delta: int = 1) -> None:
+        self._total.modifier(isbn, delta)
+        j = _jour(jour)
+        if j is None or j <= self._aujourdhui - max(FENETRES):
+            # undated or older than every window: counts all-time only
+            return
+        jour_compteur = self._jours.setdefault(j, Counter())
+        jour_compteur[isbn] += delta
+        if jour_compteur[isbn] <= 0:
+            del jour_compteur[isbn]
+            if not jour_compteur:
+                del self._jours[j]
+        for f, classement in self._fenetres.items():
+            if j > self._aujourdhui - f:
+                classement.modifier(isbn, delta)
+
+    def _avancer(self, aujourdhui: Optional[date]) -> None:
+        nouveau = (aujourdhui or date.today()).toordinal()
+        if nouveau <= self._aujourdhui:
+            return
+        for f, classement in self._fenetres.items():
+            # days that slid out of the window since the last query
+            debut, fin = self._aujourdhui - f + 1, nouveau - f + 1
+            if fin - debut > len(self._jours):
+                sortants = [j for j in self._jours if debut <= j < fin]
+            else:
+                sortants = [j for j in range(debut, fin) if j in self._jours]
+            for j in sortants:
+                for isbn, n in self._jours[j].items():
+                    classement.modifier(isbn, -n)
+        self._aujourdhui = nouveau
+        limite = nouveau - max(FENETRES)
+        for j in [j for j in self._jours if j <= limite]:
+            del self._jours[j]
+
+    def top(self, k: int = 10, fenetre: Optional[int] = None, aujourdhui: Optional[date] = None) -> list[tuple[str, int]]:
+        """The `k` most borrowed ISBNs, all-time or over `fenetre` days."""
+        if fenetre is None:
+            return self._total.top(k)
+        self._avancer(aujourdhui)
+        return self._fenetres[fenetre].top(k)
+
+    def compte(self, isbn: str, fenetre: Optional[int] = None, aujourdhui: Optional[date] = None) -> int:
+        if fenetre is None:
+            return self._total.comptes.get(isbn, 0)
+        self._avancer(aujourdhui)
+        return self._fenetres[fenetre].comptes.get(isbn, 0)
@@ -0,0 +1,189 @@
+from datetime import date
+from typing import Iterable, Iterator, Optional
+
+
+class ArchivePrets:
+    """Returned loans of one user, append-only (old ones may move on to the
+    history archive, see `anciens`).
+
+    The records read from storage are kept as dicts and only turned into
+    `Loan` objects the first time the archive is iterated (the history
+    dialog, exports). `dicts()` and `isbns()` answer from the raw records,
+    so loading and saving a user never parses their past loans.
+    """
+
+    __slots__ = ("_bruts", "_prets")
+
+    def __init__(self, bruts: Iterable[dict] = ()):
+        self._bruts: Optional[list[dict]] = list(bruts) or None
+        self._prets: list = []
+
+    def _decoder(self) -> None:
+        if self._bruts is not None:
+            from .users import Loan
+            self._prets[:0] = [Loan.from_dict(d) for d in self._bruts]
+            self._bruts = None
+
+    @property
+    def decodee(self) -> bool:
+        return self._bruts is None
+
+    def append(self, loan) -> None:
+        self._prets.append(loan)
+
+    def __len__(self) -> int:
+        return len(self._bruts or ()) + len(self._prets)
+
+    def __iter__(self) -> Iterator:
+        self._decoder()
+        return iter(self._prets)
+
+    def isbns(self) -> Iterator[str]:
+        for d in self._bruts or ():
+            yield d.get("isbn")
+        for loan in self._prets:
+            yield loan.isbn
+
+    def dicts(self, sauf: Iterable = ()) -> list[dict]:
+        ids = {id(r) for r in sauf}
+        return ([dict(d) for d in self._bruts or () if id(d) not in ids]
+                + [loan.to_dict() for loan in self._prets if id(loan) not in ids])
+
+    def anciens(self, avant: date) -> list:
+        """Records (raw dicts or `Loan`) borrowed before `avant`, not decoded."""
+        borne = avant.isoformat()
+        anciens = []
+        for d in self._bruts or ():
+            jour = str(d.get("date_emprunt") or "")[:10]
+            try:
+                date.fromisoformat(jour)
+            except ValueError:
+                continue
+            if jour < borne:
+                anciens.append(d)
+        anciens.extend(loan for loan in self._prets if loan.date_emprunt < avant)
+        return anciens
+
+    def retirer(self, records: Iterable) -> None:
+        """Drop records returned by `anciens` (moved to the history archive)."""
+        records = list(records)
+        ids = {id(r) for r in records}
+        if self._bruts is not None:
+            self._bruts = [d for d in self._bruts if id(d) not in ids] or None
+        else:
+            # decoded in the meantime: the raw records match by value
+            bruts = [r for r in records if isinstance(r, dict)]
+            if bruts:
+                garder = []
+                for loan in self._prets:
+                    d = loan.to_dict()
+                    if d in bruts:
+                        bruts.remove(d)
+                    else:
+                        garder.append(loan)
+                self._prets = garder
+        self._prets = [loan for loan in self._prets if id(loan) not in ids]
+
+
+class PretsUser:
+    """Loans of one user: open ones by exemplaire id, returned ones archived.
+
+    Open loans sit in a dict keyed by copy id, so a return finds its loan
+    without walking the user's history; `clore` moves it to the `archive`.
+    Iterating gives the archive then the open loans, and compares equal to
+    the list of both, like the former `User.loans` list.
+    """
+
+    __slots__ = ("_ouverts", "archive")
+
+    def __init__(self, loans: Iterable = (), archive: Optional[ArchivePrets] = None):
+        # exemplaire id -> open loan, in borrow order; loans without a copy
+        # id (or sharing one) are keyed by their identity
+        self._ouverts: dict = {}
+        self.archive = archive if archive is not None else ArchivePrets()
+        for loan in loans:
+            self.append(loan)
+
+    def append(self, loan) -> None:
+        if loan.date_retour_effective is not None:
+            self.archive.append(loan)
+            return
+        cle = loan.exemplaire_id
+        if cle is None or cle in self._ouverts:
+            cle = id(loan)
+        self._ouverts[cle] = loan
+
+    def extend(self, loans: Iterable) -> None:
+        for loan in loans:
+            self.append(loan)
+
+    def clore(self, loan) -> None:
+        """Move a loan that was just returned to the archive."""
+        cle = loan.exemplaire_id
+        if self._ouverts.get(cle) is not loan:
+            cle = next((c for c, l in self._ouverts.items() if l is loan), None)
+            if cle is None:
+                return
+        del self._ouverts[cle]
+        self.archive.append(loan)
+
+    def en_cours(self) -> list:
+        return [loan for loan in self._ouverts.values() if loan.date_retour_effective is None]
+
+    def en_cours_pour(self, exemplaire_id: str):
+        loan = self._ouverts.get(exemplaire_id)
+        return loan if loan is not None and loan.date_retour_effective is None else None
+
+    def isbns(self) -> Iterator[str]:
+        """ISBN of every loan, returned ones included, without decoding the archive."""
+        yield from self.archive.isbns()
+        for loan in self._ouverts.values():
+            yield loan.isbn
+
+    def dicts(self, sauf: Iterable = ()) -> list[dict]:
+        """Every loan as stored, less the archived records in `sauf`."""
+        return self.archive.dicts(sauf) + [loan.to_dict() for loan in self._ouverts.values()]
+
+    def __len__(self) -> int:
+        return len(self.archive) + len(self._ouverts)
+
+    def __iter__(self) -> Iterator:
+        yield from self.archive
+        yield from self._ouverts.values()
+
+    def __getitem__(self, i):
+        return list(self)[i]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (PretsUser, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+# helpers accepting users whose `loans` is still a plain list
+
+def prets_en_cours(user) -> list:
+    loans = getattr(user, 'loans', None) or []
+    if isinstance(loans, PretsUser):
+        return loans.en_cours()
+    return [l for l in loans if getattr(l, 'date_retour_effective', None) is None]
+
+
+def pret_en_cours(user, exemplaire_id: str):
+    loans = getattr(user, 'loans', None) or []
+    if isinstance(loans, PretsUser):
+        return loans.en_cours_pour(exemplaire_id)
+    return next((l for l in loans if getattr(l, 'exemplaire_id', None) == exemplaire_id
+                 and getattr(l, 'date_retour_effective', None) is None), None)
+
+
+def isbns_prets(user) -> Iterator[str]:
+    loans = getattr(user, 'loans', None) or []
+    if isinstance(loans, PretsUser):
+        return loans.isbns()
+    return (l.isbn for l in loans)
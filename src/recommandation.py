@@ -0,0 +1,189 @@
+from collections import Counter
+from math import sqrt
+from typing import Iterable, Optional
+
+
+VOISINS_MAX = 20          # neighbours kept per ISBN
+ARTICLES_MAX = 200        # most recent borrows per user used for co-borrows
+
+
+class MoteurRecommandation:
+    """Precomputed data behind `Bibliotheque.recommend_for_user`.
+
+    Built in one pass over the catalogue and its `history`:
+    user -> genre affinity, genre -> books (catalogue order), user -> ISBNs
+    borrowed, and for each ISBN its most similar ISBNs by co-borrow (cosine
+    over the sets of borrowers). Serving a user only touches their own
+    items and the neighbour lists.
+
+    The borrower and co-borrow counts are kept, so a book added or removed
+    later (journal replay, another desk's change) only recounts its
+    borrowers and recomputes the neighbour lists of the ISBNs they touch.
+    """
+
+    def __init__(self, livres: Iterable = ()):
+        self.affinites: dict[str, Counter] = {}
+        self.par_genre: dict[str, list] = {}
+        self.articles: dict[str, list[str]] = {}
+        self.voisins: dict[str, list[tuple[str, float]]] = {}
+        # ISBN -> borrowers, ISBN -> co-borrowed ISBN -> borrowers in common,
+        # user -> the ISBNs of theirs counted in both
+        self._lecteurs: Counter = Counter()
+        self._paires: dict[str, Counter] = {}
+        self._comptes: dict[str, set] = {}
+        # users whose new borrows are not counted yet
+        self._en_attente: set = set()
+        self._nouveaux = 0
+        for livre in livres:
+            genre = getattr(livre, "genre", None)
+            if genre:
+                self.par_genre.setdefault(genre, []).append(livre)
+            for h in getattr(livre, "history", []):
+                username = h.get("username") if isinstance(h, dict) else None
+                if username:
+                    self._noter(username, livre)
+        self.calculer_similarites()
+
+    def _noter(self, username: str, livre) -> None:
+        genre = getattr(livre, "genre", None)
+        if genre:
+            self.affinites.setdefault(username, Counter())[genre] += 1
+        self.articles.setdefault(username, []).append(livre.ISBN)
+        self._en_attente.add(username)
+
+    def _oublier(self, username: str, livre) -> None:
+        genre = getattr(livre, "genre", None)
+        affinite = self.affinites.get(username)
+        if genre and affinite is not None and affinite[genre] > 0:
+            affinite[genre] -= 1
+            if affinite[genre] <= 0:
+                del affinite[genre]
+        articles = self.articles.get(username)
+        if articles is not None and livre.ISBN in articles:
+            articles.remove(livre.ISBN)
+        self._en_attente.add(username)
+
+    def noter_emprunt(self, username: str, livre) -> None:
+        # affinity is exact at once; similarities wait for the next batch
+        self._noter(username, livre)
+        self._nouveaux += 1
+
+    def ajouter_livre(self, livre) -> None:
+        genre = getattr(livre, "genre", None)
+        if genre:
+            self.par_genre.setdefault(genre, []).append(livre)
+        self._historique(livre, self._noter)
+
+    def retirer_livre(self, livre) -> None:
+        genre = getattr(livre, "genre", None)
+        if genre in self.par_genre:
+            self.par_genre[genre] = [l for l in self.par_genre[genre] if l is not livre]
+            if not self.par_genre[genre]:
+                del self.par_genre[genre]
+        self._historique(livre, self._oublier)
+
+    def _historique(self, livre, action) -> None:
+        usernames = set()
+        for h in getattr(livre, "history", []):
+            username = h.get("username") if isinstance(h, dict) else None
+            if username:
+                action(username, livre)
+                usernames.add(username)
+        if usernames:
+            self._voisins_de(self._recompter(usernames))
+
+    @property
+    def nouveaux_emprunts(self) -> int:
+        return self._nouveaux
+
+    def _recompter(self, usernames: Iterable[str]) -> set:
+        # move each user's counted ISBNs to their current ones; returns the
+        # ISBNs whose counts or pairs changed
+        touches = set()
+        for username in usernames:
+            self._en_attente.discard(username)
+            articles = self.articles.get(username, [])
+            avant = self._comptes.get(username, set())
+            apres = set(articles[-ARTICLES_MAX:])
+            courants = set(avant)
+            for isbn in avant - apres:
+                courants.discard(isbn)
+                self._compter(isbn, courants, -1)
+            for isbn in apres - avant:
+                self._compter(isbn, courants, 1)
+                courants.add(isbn)
+            if avant != apres:
+                # the pairs changed are between these ISBNs
+                touches |= avant | apres
+            if apres:
+                self._comptes[username] = apres
+            else:
+                self._comptes.pop(username, None)
+            if not articles:
+                self.articles.pop(username, None)
+                if not self.affinites.get(username):
+                    self.affinites.pop(username, None)
+        return touches
+
+    def _compter(self, isbn: str, autres: set, delta: int) -> None:
+        self._lecteurs[isbn] += delta
+        if self._lecteurs[isbn] <= 0:
+            del self._lecteurs[isbn]
+        for autre in autres:
+            for a, b in ((isbn, autre), (autre, isbn)):
+                paires = self._paires.setdefault(a, Counter())
+                paires[b] += delta
+                if paires[b] <= 0:
+                    del paires[b]
+                    if not paires:
+                        del self._paires[a]
+
+    def _voisins_de(self, isbns: set) -> None:
+        # a borrower count enters the similarity of every pair of its ISBN
+        cibles = set(isbns)
+        for isbn in isbns:
+            cibles.update(self._paires.get(isbn, ()))
+        for isbn in cibles:
+            paires = self._paires.get(isbn)
+            if not paires:
+                self.voisins.pop(isbn, None)
+                continue
+            v = [(autre, n / sqrt(self._lecteurs[isbn] * self._lecteurs[autre])) for autre, n in paires.items()]
+            self.voisins[isbn] = sorted(v, key=lambda x: (-x[1], x[0]))[:VOISINS_MAX]
+
+    def calculer_similarites(self) -> None:
+        self._voisins_de(self._recompter(list(self._en_attente)))
+        self._nouveaux = 0
+
+    def recommander(self, username: Optional[str], exclus: set, livre_par_isbn, limit: int) -> list:
+        """Available books the user has not borrowed yet: co-borrowed with
+        their items first, then from their favourite genres."""
+        recs: list = []
+        ajoutes: set = set()
+
+        def proposer(livre) -> bool:
+            isbn = getattr(livre, "ISBN", None)
+            if not isbn or isbn in exclus or isbn in ajoutes:
+                return False
+            if getattr(livre, "disponibles", 0) <= 0:
+                return False
+            recs.append(livre)
+            ajoutes.add(isbn)
+            return len(recs) >= limit
+
+        deja_lus = set(self.articles.get(username, ()))
+        exclus = exclus | deja_lus
+        scores: Counter = Counter()
+        for isbn in deja_lus:
+            for voisin, sim in self.voisins.get(isbn, ()):
+                scores[voisin] += sim
+        for isbn, _ in sorted(scores.items(), key=lambda x: (-x[1], x[0])):
+            livre = livre_par_isbn(isbn)
+            if livre is not None and proposer(livre):
+                return recs
+
+        for genre, _ in self.affinites.get(username, Counter()).most_common():
+            for livre in self.par_genre.get(genre, ()):
+                if proposer(livre):
+                    return recs
+        return recs
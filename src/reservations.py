@@ -0,0 +1,203 @@
+from bisect import bisect_left, insort
+from collections import deque
+from typing import Iterable, Iterator, Optional
+
+
+class FileReservation:
+    """Waiting list of one ISBN: usernames in arrival order, each once.
+
+    Entries are `(ticket, username)` pairs in a deque. Cancelling only
+    forgets the user's ticket and leaves a tombstone, dropped once it
+    reaches the head, so `append`, membership and taking the head are O(1)
+    and `remove` is a bisection. A user's position is the distance between
+    their ticket and the head's, minus the tombstones in between.
+    Compares equal to the list of its usernames.
+    """
+
+    __slots__ = ("_entrees", "_tickets", "_tombes", "_suivant", "_isbn", "_index")
+
+    def __init__(self, usernames: Iterable[str] = (), isbn: Optional[str] = None, index: Optional[dict] = None):
+        self._entrees: deque[tuple[int, str]] = deque()
+        self._tickets: dict[str, int] = {}
+        # cancelled tickets still in _entrees, sorted
+        self._tombes: list[int] = []
+        self._suivant = 0
+        self._isbn = isbn
+        # username -> set of ISBNs, shared with the owning `Reservations`
+        self._index = index
+        for username in usernames:
+            self.append(username)
+
+    def _purger(self) -> None:
+        entrees, tickets = self._entrees, self._tickets
+        while entrees and tickets.get(entrees[0][1]) != entrees[0][0]:
+            entrees.popleft()
+            # the head tombstone is the smallest one
+            del self._tombes[0]
+
+    def _compacter(self) -> None:
+        tickets = self._tickets
+        self._entrees = deque(e for e in self._entrees if tickets.get(e[1]) == e[0])
+        self._tombes = []
+
+    def _oublier(self, username: str) -> int:
+        ticket = self._tickets.pop(username)
+        if self._index is not None:
+            isbns = self._index.get(username)
+            if isbns is not None:
+                isbns.discard(self._isbn)
+                if not isbns:
+                    del self._index[username]
+        return ticket
+
+    def _detacher(self) -> None:
+        # the file leaves its `Reservations`: drop its users from the index
+        if self._index is not None:
+            for username in list(self._tickets):
+                isbns = self._index.get(username)
+                if isbns is not None:
+                    isbns.discard(self._isbn)
+                    if not isbns:
+                        del self._index[username]
+        self._index = None
+
+    def append(self, username: str) -> None:
+        if username in self._tickets:
+            return
+        ticket = self._suivant
+        self._suivant += 1
+        self._entrees.append((ticket, username))
+        self._tickets[username] = ticket
+        if self._index is not None:
+            self._index.setdefault(username, set()).add(self._isbn)
+
+    def popleft(self) -> str:
+        self._purger()
+        if not self._entrees:
+            raise IndexError("file de reservation vide")
+        _, username = self._entrees.popleft()
+        self._oublier(username)
+        self._purger()
+        return username
+
+    def pop(self, i: int = 0) -> str:
+        if i == 0:
+            return self.popleft()
+        username = self[i]
+        self.remove(username)
+        return username
+
+    def remove(self, username: str) -> None:
+        try:
+            ticket = self._oublier(username)
+        except KeyError:
+            raise ValueError(f"{username!r} n'est pas dans la file") from None
+        insort(self._tombes, ticket)
+        self._purger()
+        if len(self._tombes) > 32 and len(self._tombes) > len(self._tickets):
+            self._compacter()
+
+    def position(self, username: str) -> Optional[int]:
+        """0-based rank of `username` in the queue, None if absent."""
+        ticket = self._tickets.get(username)
+        if ticket is None:
+            return None
+        # the head is live after every change, and every tombstone is past it
+        return ticket - self._entrees[0][0] - bisect_left(self._tombes, ticket)
+
+    def __contains__(self, username) -> bool:
+        return username in self._tickets
+
+    def __len__(self) -> int:
+        return len(self._tickets)
+
+    def __iter__(self) -> Iterator[str]:
+        tickets = self._tickets
+        for ticket, username in self._entrees:
+            if tickets.get(username) == ticket:
+                yield username
+
+    def __getitem__(self, i):
+        if i == 0 and self._entrees:
+            return self._entrees[0][1]
+        return list(self)[i]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (FileReservation, list, tuple, deque)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+class Reservations(dict):
+    """ISBN -> `FileReservation`, plus the reverse index username -> ISBNs.
+
+    Any iterable of usernames assigned to an ISBN becomes a queue, so the
+    loaders keep filling it like a dict of lists. `de_user` answers "where
+    am I waiting" without walking the queues.
+    """
+
+    def __init__(self, files=None):
+        super().__init__()
+        self._par_user: dict[str, set[str]] = {}
+        if files:
+            self.update(files)
+
+    def __setitem__(self, isbn: str, usernames) -> None:
+        ancienne = dict.get(self, isbn)
+        if ancienne is not None:
+            if ancienne is usernames:
+                return
+            ancienne._detacher()
+        super().__setitem__(isbn, FileReservation(usernames, isbn=isbn, index=self._par_user))
+
+    def __delitem__(self, isbn: str) -> None:
+        dict.__getitem__(self, isbn)._detacher()
+        super().__delitem__(isbn)
+
+    def pop(self, isbn: str, *defaut):
+        if isbn in self:
+            file = super().pop(isbn)
+            file._detacher()
+            return file
+        if defaut:
+            return defaut[0]
+        raise KeyError(isbn)
+
+    def popitem(self):
+        isbn, file = super().popitem()
+        file._detacher()
+        return isbn, file
+
+    def setdefault(self, isbn: str, defaut=()) -> FileReservation:
+        if isbn not in self:
+            self[isbn] = defaut or ()
+        return dict.__getitem__(self, isbn)
+
+    def update(self, *args, **kwargs) -> None:
+        for isbn, usernames in dict(*args, **kwargs).items():
+            self[isbn] = usernames
+
+    def clear(self) -> None:
+        for file in self.values():
+            file._detacher()
+        super().clear()
+
+    def utilisateurs(self) -> set[str]:
+        """Usernames waiting in at least one queue."""
+        return set(self._par_user)
+
+    def isbns_de(self, username: str) -> set[str]:
+        return set(self._par_user.get(username, ()))
+
+    def de_user(self, username: str) -> dict[str, int]:
+        """ISBN -> 0-based position of every queue `username` waits in."""
+        return {isbn: dict.__getitem__(self, isbn).position(username) for isbn in self._par_user.get(username, ())}
+
+    def position(self, isbn: str, username: str) -> Optional[int]:
+        file = dict.get(self, isbn)
+        return file.position(username) if file is not None else None
@@ -0,0 +1,117 @@
+import heapq
+from dataclasses import dataclass
+from datetime import date
+from typing import Iterable, Iterator, Optional
+
+# days a returned copy stays set aside for the user it was given to
+DUREE_RETENUE_JOURS = 3
+
+
+@dataclass
+class Retenue:
+    isbn: str
+    exemplaire_id: str
+    username: str
+    # last day the copy can be collected; the hold lapses the day after
+    jusqu_au: date
+
+
+class Retenues:
+    """Copies set aside for users of a reservation queue, by deadline.
+
+    Holds are indexed by copy and by (ISBN, username); deadlines sit in a
+    heap of `(ordinal, seq, exemplaire_id)`. Removing a hold leaves its heap
+    entry behind, skipped when it surfaces, so `echues` only looks at the
+    holds that actually lapsed instead of every book.
+    Users attached with `suivre` get each hold noted on their matching
+    `Reservation` (`exemplaire_id`, `date_limite`), which is how holds are
+    saved and found again by `Bibliotheque.reprendre_retenues`.
+    """
+
+    def __init__(self):
+        self._par_exemplaire: dict[str, tuple[int, Retenue]] = {}
+        self._par_user: dict[tuple[str, str], str] = {}
+        self._tas: list[tuple[int, int, str]] = []
+        self._users: dict[str, object] = {}
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self._par_exemplaire)
+
+    def __iter__(self) -> Iterator[Retenue]:
+        return (r for _, r in self._par_exemplaire.values())
+
+    def __contains__(self, exemplaire_id) -> bool:
+        return exemplaire_id in self._par_exemplaire
+
+    def suivre(self, users: Iterable) -> None:
+        for u in users:
+            self._users[u.username] = u
+
+    def user(self, username: str):
+        return self._users.get(username)
+
+    def get(self, exemplaire_id: str) -> Optional[Retenue]:
+        entree = self._par_exemplaire.get(exemplaire_id)
+        return entree[1] if entree is not None else None
+
+    def pour(self, isbn: str, username: str) -> Optional[Retenue]:
+        exid = self._par_user.get((isbn, username))
+        return self.get(exid) if exid is not None else None
+
+    def ajouter(self, retenue: Retenue) -> Retenue:
+        self.retirer(retenue.exemplaire_id)
+        self._seq += 1
+        self._par_exemplaire[retenue.exemplaire_id] = (self._seq, retenue)
+        self._par_user[(retenue.isbn, retenue.username)] = retenue.exemplaire_id
+        heapq.heappush(self._tas, (retenue.jusqu_au.toordinal(), self._seq, retenue.exemplaire_id))
+        self._noter(retenue.username, retenue.isbn, retenue.exemplaire_id, retenue.jusqu_au)
+        return retenue
+
+    def retirer(self, exemplaire_id: str) -> Optional[Retenue]:
+        entree = self._par_exemplaire.pop(exemplaire_id, None)
+        if entree is None:
+            return None
+        retenue = entree[1]
+        self._par_user.pop((retenue.isbn, retenue.username), None)
+        self._noter(retenue.username, retenue.isbn, None, None)
+        if len(self._tas) > 64 and len(self._tas) > 2 * len(self._par_exemplaire):
+            # mostly dead entries: rebuild from the live holds
+            self._tas = [(r.jusqu_au.toordinal(), seq, exid) for exid, (seq, r) in self._par_exemplaire.items()]
+            heapq.heapify(self._tas)
+        return retenue
+
+    def _purger(self) -> None:
+        tas = self._tas
+        while tas:
+            _, seq, exid = tas[0]
+            entree = self._par_exemplaire.get(exid)
+            if entree is not None and entree[0] == seq:
+                return
+            heapq.heappop(tas)
+
+    def prochaine_echeance(self) -> Optional[date]:
+        """Deadline of the hold that lapses first, None without holds."""
+        self._purger()
+        return date.fromordinal(self._tas[0][0]) if self._tas else None
+
+    def echues(self, aujourdhui: Optional[date] = None) -> list[Retenue]:
+        """Remove and return the holds whose deadline is before `aujourdhui`."""
+        limite = (aujourdhui or date.today()).toordinal()
+        echues = []
+        self._purger()
+        while self._tas and self._tas[0][0] < limite:
+            echues.append(self.retirer(heapq.heappop(self._tas)[2]))
+            self._purger()
+        return echues
+
+    def _noter(self, username: str, isbn: str, exemplaire_id: Optional[str], jusqu_au: Optional[date]) -> None:
+        user = self._users.get(username)
+        if user is None:
+            return
+        for r in getattr(user, 'reservations', []):
+            if getattr(r, 'isbn', None) == isbn:
+                if r.exemplaire_id != exemplaire_id or r.date_limite != jusqu_au:
+                    r.exemplaire_id, r.date_limite = exemplaire_id, jusqu_au
+                    user.marquer_modifie()
+                return
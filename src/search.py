@@ -0,0 +1,206 @@
+import re
+import unicodedata
+from collections import Counter
+from typing import Iterable, Iterator, Optional
+
+
+CHAMPS = ("titre", "auteur", "genre")
+_FIN = ""  # end-of-word marker in trie nodes (never a single character)
+_MOT = re.compile(r"\w+")
+
+
+def normaliser(texte) -> str:
+    """Case-fold and strip accents: 'Misérables' -> 'miserables'."""
+    if not texte:
+        return ""
+    decompose = unicodedata.normalize("NFKD", str(texte))
+    return "".join(c for c in decompose if not unicodedata.combining(c)).casefold()
+
+
+def tokeniser(texte) -> list[str]:
+    return _MOT.findall(normaliser(texte))
+
+
+class _Trie:
+    __slots__ = ("racine",)
+
+    def __init__(self):
+        self.racine: dict = {}
+
+    def ajouter(self, mot: str) -> None:
+        node = self.racine
+        for ch in mot:
+            node = node.setdefault(ch, {})
+        node[_FIN] = True
+
+    def retirer(self, mot: str) -> None:
+        chemin = [self.racine]
+        for ch in mot:
+            node = chemin[-1].get(ch)
+            if node is None:
+                return
+            chemin.append(node)
+        chemin[-1].pop(_FIN, None)
+        # prune branches that no longer lead to a word
+        for i in range(len(mot), 0, -1):
+            if chemin[i]:
+                break
+            del chemin[i - 1][mot[i - 1]]
+
+    def prefixe(self, pre: str) -> Iterator[str]:
+        node = self.racine
+        for ch in pre:
+            node = node.get(ch)
+            if node is None:
+                return
+        pile = [(node, pre)]
+        while pile:
+            node, mot = pile.pop()
+            for ch, fils in node.items():
+                if ch == _FIN:
+                    yield mot
+                else:
+                    pile.append((fils, mot + ch))
+
+    def proches(self, mot: str, dmax: int) -> Iterator[str]:
+        """Words within Levenshtein distance `dmax`, pruning whole subtrees."""
+        premiere = list(range(len(mot) + 1))
+        pile = [(fils, ch, ch, premiere) for ch, fils in self.racine.items() if ch != _FIN]
+        while pile:
+            node, ch, prefixe, prec = pile.pop()
+            ligne = [prec[0] + 1]
+            for i, c in enumerate(mot, start=1):
+                ligne.append(min(ligne[i - 1] + 1, prec[i] + 1, prec[i - 1] + (c != ch)))
+            if _FIN in node and ligne[-1] <= dmax:
+                yield prefixe
+            if min(ligne) <= dmax:
+                for ch2, fils in node.items():
+                    if ch2 != _FIN:
+                        pile.append((fils, ch2, prefixe + ch2, ligne))
+
+
+class IndexRecherche:
+    """Inverted index over titre/auteur/genre with prefix and fuzzy lookup.
+
+    Postings are sets of livre objects, so combining fields is a set
+    intersection (smallest first). The index is updated book by book by
+    `Bibliotheque` on add, delete and genre change.
+    """
+
+    def __init__(self, livres: Iterable = ()):
+        self._postings: dict[str, dict[str, set]] = {c: {} for c in CHAMPS}
+        self._tries: dict[str, _Trie] = {c: _Trie() for c in CHAMPS}
+        self._termes: dict = {}
+        self._genres: Counter = Counter()
+        self._ordre: dict = {}
+        self._seq = 0
+        for livre in livres:
+            self.ajouter(livre)
+
+    def __len__(self) -> int:
+        return len(self._termes)
+
+    def ajouter(self, livre) -> None:
+        if livre in self._termes:
+            self.retirer(livre)
+        termes = tuple((c, tuple(set(tokeniser(getattr(livre, c, None))))) for c in CHAMPS)
+        for champ, tokens in termes:
+            postings = self._postings[champ]
+            for t in tokens:
+                bucket = postings.get(t)
+                if bucket is None:
+                    bucket = postings[t] = set()
+                    self._tries[champ].ajouter(t)
+                bucket.add(livre)
+        self._termes[livre] = (termes, getattr(livre, "genre", None))
+        if termes[2][1]:
+            self._genres[getattr(livre, "genre")] += 1
+        if livre not in self._ordre:
+            self._seq += 1
+            self._ordre[livre] = self._seq
+
+    def retirer(self, livre, garder_ordre: bool = False) -> None:
+        entry = self._termes.pop(livre, None)
+        if entry is None:
+            return
+        termes, genre = entry
+        if termes[2][1]:
+            self._genres[genre] -= 1
+            if self._genres[genre] <= 0:
+                del self._genres[genre]
+        for champ, tokens in termes:
+            postings = self._postings[champ]
+            for t in tokens:
+                bucket = postings.get(t)
+                if bucket is None:
+                    continue
+                bucket.discard(livre)
+                if not bucket:
+                    del postings[t]
+                    self._tries[champ].retirer(t)
+        if not garder_ordre:
+            self._ordre.pop(livre, None)
+
+    def mettre_a_jour(self, livre) -> None:
+        # re-tokenize after a field change (e.g. genre) without moving the book
+        self.retirer(livre, garder_ordre=True)
+        self.ajouter(livre)
+
+    def _termes_pour(self, champ: str, token: str, prefixe: bool, fuzzy: int) -> set:
+        postings = self._postings[champ]
+        trie = self._tries[champ]
+        if fuzzy:
+            mots = trie.proches(token, fuzzy)
+        elif prefixe:
+            mots = trie.prefixe(token)
+        else:
+            mots = (token,) if token in postings else ()
+        res: set = set()
+        for m in mots:
+            res |= postings.get(m, set())
+        return res
+
+    def _champ(self, champ: str, texte: str, prefixe: bool, fuzzy: int) -> Optional[set]:
+        tokens = tokeniser(texte)
+        if not tokens:
+            return None
+        sets = sorted((self._termes_pour(champ, t, prefixe, fuzzy) for t in tokens), key=len)
+        res = set(sets[0])
+        for s in sets[1:]:
+            if not res:
+                break
+            res &= s
+        return res
+
+    def rechercher(self, titre: str | None = None, auteur: str | None = None, genre: str | None = None,
+                   prefixe: bool = True, fuzzy: int = 0) -> list:
+        """Books matching every given field, in catalogue order.
+
+        Every query token must match a token of the field, either exactly,
+        as a prefix (`prefixe`, for search-as-you-type) or within `fuzzy`
+        edits. An empty query returns [].
+        """
+        resultats = []
+        for champ, texte in (("titre", titre), ("auteur", auteur), ("genre", genre)):
+            if texte:
+                r = self._champ(champ, texte, prefixe, fuzzy)
+                if r is not None:
+                    resultats.append(r)
+        if not resultats:
+            return []
+        resultats.sort(key=len)
+        res = resultats[0]
+        for r in resultats[1:]:
+            res = res & r
+        return self.trier(res)
+
+    def trier(self, livres) -> list:
+        return sorted(livres, key=self._ordre.__getitem__)
+
+    def candidats(self, champ: str, texte: str) -> Optional[set]:
+        """Books containing every token of `texte` in `champ` (None if no token)."""
+        return self._champ(champ, texte, prefixe=False, fuzzy=0)
+
+    def genres(self) -> list[str]:
+        """Distinct genres currently in the catalogue (for the genre filter)."""
+        return sorted(self._genres)
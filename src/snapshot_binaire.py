@@ -0,0 +1,408 @@
+"""Compact binary catalogue snapshot (`bib.bin`).
+
+Layout, little-endian:
+
+    entete      magic "BIBS", version u16, reserve u16, nb chaines u32,
+                nb etats u32, nb livres u32, offset of `index` u64, offset
+                of `reservations` u64
+    chaines     nb chaines u32 end offsets (in bytes), then one UTF-8 blob
+    etats       nb etats u32 string refs: the copy states, in code order
+    livres      per book: u32 length, then the record (see `_LIVRE`), copy
+                id refs (u32 each), copy state codes (u8 each), reviews and
+                history as tagged values
+    index       per book, sorted by ISBN: ISBN ref u32, record offset u64
+    reservations  u32 count, then ISBN ref, u32 n, n username refs
+    exemplaires   u32 count, then ISBN ref, total u32, disponibles u32
+
+Every string (titles, authors, ISBNs, genres, states, usernames, dates,
+copy ids) is stored once in the table and referenced by index (0 is
+None). Offsets make every section reachable without reading the previous
+ones: `CatalogueMappe` uses that to look books up in a mapped file.
+"""
+import struct
+import sys
+from array import array
+from itertools import accumulate
+from pathlib import Path
+
+from .exceptions import ErreurFichier
+from .exemplaires import ExemplairesCompacts, code_etat
+
+
+MAGIC = b"BIBS"
+VERSION = 2
+
+_ENTETE = struct.Struct("<4sHHIIIQQ")
+_ENTREE_INDEX = struct.Struct("<IQ")
+# type, titre, auteur, ISBN, genre, taille_fichier, total, disponibles,
+# nb exemplaires, nb reviews, nb history
+_LIVRE = struct.Struct("<IIIIIIIIIII")
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+
+# tags of the generic values (reviews, history entries)
+_NONE, _FAUX, _VRAI, _ENTIER, _REEL, _CHAINE, _LISTE, _DICT, _GRAND_ENTIER, _LIGNE = range(10)
+# flat dicts (`_LIGNE`) are written as a schema ref (keys and field types,
+# itself a table string) followed by the values packed with one struct
+_TYPES_LIGNE = {"S": "I", "q": "q", "d": "d", "?": "?"}
+
+
+def est_binaire(filepath: str | Path) -> bool:
+    try:
+        with open(filepath, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class _Chaines:
+    # ref 0 is None, so nullable fields need no flag
+    def __init__(self):
+        self.index: dict[str, int] = {}
+        self.liste: list[str] = []
+
+    def ref(self, s) -> int:
+        if s is None:
+            return 0
+        if not isinstance(s, str):
+            s = str(s)
+        i = self.index.get(s)
+        if i is None:
+            self.liste.append(s)
+            i = self.index[s] = len(self.liste)
+        return i
+
+
+def _type_ligne(v) -> str | None:
+    if v is None or isinstance(v, str):
+        return "S"
+    if isinstance(v, bool):
+        return "?"
+    if isinstance(v, int):
+        return "q" if -(1 << 63) <= v < (1 << 63) else None
+    if isinstance(v, float):
+        return "d"
+    return None
+
+
+class _Encodeur:
+    def __init__(self):
+        self.chaines = _Chaines()
+        self._structs: dict[str, struct.Struct] = {}
+
+    def valeur(self, out: bytearray, v) -> None:
+        ref = self.chaines.ref
+        if isinstance(v, dict) and all(isinstance(k, str) for k in v):
+            types = [_type_ligne(x) for x in v.values()]
+            if None not in types:
+                lettres = "".join(types)
+                st = self._structs.get(lettres)
+                if st is None:
+                    st = self._structs[lettres] = struct.Struct("<" + "".join(_TYPES_LIGNE[t] for t in lettres))
+                out.append(_LIGNE)
+                out += _U32.pack(ref("\x1f".join(v) + "\x1e" + lettres))
+                out += st.pack(*(ref(x) if t == "S" else x for t, x in zip(lettres, v.values())))
+                return
+        if v is None:
+            out.append(_NONE)
+        elif v is True:
+            out.append(_VRAI)
+        elif v is False:
+            out.append(_FAUX)
+        elif isinstance(v, int):
+            if -(1 << 63) <= v < (1 << 63):
+                out.append(_ENTIER)
+                out += _I64.pack(v)
+            else:
+                out.append(_GRAND_ENTIER)
+                out += _U32.pack(ref(str(v)))
+        elif isinstance(v, float):
+            out.append(_REEL)
+            out += _F64.pack(v)
+        elif isinstance(v, str):
+            out.append(_CHAINE)
+            out += _U32.pack(ref(v))
+        elif isinstance(v, (list, tuple)):
+            out.append(_LISTE)
+            out += _U32.pack(len(v))
+            for x in v:
+                self.valeur(out, x)
+        elif isinstance(v, dict):
+            out.append(_DICT)
+            out += _U32.pack(len(v))
+            for k, x in v.items():
+                out += _U32.pack(ref(k))
+                self.valeur(out, x)
+        else:
+            raise ErreurFichier(f"Valeur non serialisable dans le snapshot binaire: {v!r}")
+
+
+def _u32s(valeurs) -> bytes:
+    a = array("I", valeurs)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a.tobytes()
+
+
+def encoder(biblio) -> bytes:
+    """Binary image of the catalogue, reservations and aggregate counts."""
+    enc = _Encodeur()
+    ref = enc.chaines.ref
+    # copies reference states by code; the file carries its own state table
+    etats: dict[str, int] = {}
+    livres = bytearray()
+    index = []
+    for livre in biblio.livres:
+        stock = livre.exemplaires_stock
+        reviews = list(getattr(livre, "reviews", None) or [])
+        history = list(getattr(livre, "history", None) or [])
+        rec = bytearray(_LIVRE.pack(
+            ref(livre.type), ref(livre.titre), ref(livre.auteur), ref(livre.ISBN), ref(livre.genre),
+            ref(getattr(livre, "taille_fichier", None)), int(livre.nb_exemplaire), int(livre.disponibles),
+            len(stock), len(reviews), len(history),
+        ))
+        rec += _u32s(ref(exid) for exid in stock.ids())
+        rec += bytes(etats.setdefault(etat, len(etats)) for _, etat in stock)
+        for v in reviews:
+            enc.valeur(rec, v)
+        for v in history:
+            enc.valeur(rec, v)
+        isbn = str(livre.ISBN or "")
+        index.append((isbn, len(livres), ref(isbn)))
+        livres += _U32.pack(len(rec))
+        livres += rec
+
+    annexes = bytearray()
+    reservations = getattr(biblio, "reservations", {}) or {}
+    annexes += _U32.pack(len(reservations))
+    for isbn, q in reservations.items():
+        annexes += _u32s([ref(isbn), len(q)] + [ref(u) for u in q])
+    agreges: dict[str, list[int]] = {}
+    for livre in biblio.livres:
+        a = agreges.setdefault(str(livre.ISBN or ""), [0, 0])
+        a[0] += int(livre.nb_exemplaire)
+        a[1] += int(livre.disponibles)
+    annexes += _U32.pack(len(agreges))
+    for isbn, (total, dispo) in agreges.items():
+        annexes += _u32s((ref(isbn), total, dispo))
+
+    refs_etats = [ref(e) for e in etats]
+    blobs = [c.encode("utf-8", "surrogatepass") for c in enc.chaines.liste]
+    tables = bytearray(_u32s(accumulate(len(b) for b in blobs)))
+    tables += b"".join(blobs)
+    tables += _u32s(refs_etats)
+    debut_livres = _ENTETE.size + len(tables)
+    off_index = debut_livres + len(livres)
+    index.sort()
+    entrees = b"".join(_ENTREE_INDEX.pack(r, debut_livres + off) for _, off, r in index)
+    entete = _ENTETE.pack(MAGIC, VERSION, 0, len(blobs), len(refs_etats), len(index),
+                          off_index, off_index + len(entrees))
+    return b"".join((entete, tables, livres, entrees, annexes))
+
+
+class _ChainesMappees:
+    """String table read in place: each lookup decodes one string."""
+
+    def __init__(self, data, debut: int, nb: int):
+        self._data = data
+        self._fins = debut
+        self._blob = debut + 4 * nb
+
+    def __getitem__(self, ref: int):
+        if ref == 0:
+            return None
+        fin = _U32.unpack_from(self._data, self._fins + 4 * (ref - 1))[0]
+        debut = _U32.unpack_from(self._data, self._fins + 4 * (ref - 2))[0] if ref > 1 else 0
+        return str(self._data[self._blob + debut:self._blob + fin], "utf-8", "surrogatepass")
+
+
+class _Decodeur:
+    """Reads the header and state table; `livre(pos)` then decodes one
+    length-prefixed book record. With `en_place`, strings are decoded on
+    access instead of all at once."""
+
+    def __init__(self, data, en_place: bool = False):
+        self.data = data
+        if len(data) < _ENTETE.size:
+            raise ErreurFichier("Snapshot binaire tronque")
+        magic, version, _, nb_chaines, nb_etats, self.nb_livres, self.off_index, self.off_annexes = \
+            _ENTETE.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ErreurFichier("Ce fichier n'est pas un snapshot binaire")
+        if version != VERSION:
+            raise ErreurFichier(f"Version de snapshot binaire non supportee: {version}")
+        pos = _ENTETE.size
+        if en_place:
+            self.chaines = _ChainesMappees(data, pos, nb_chaines)
+            taille = _U32.unpack_from(data, pos + 4 * (nb_chaines - 1))[0] if nb_chaines else 0
+        else:
+            fins = self._u32s(pos, nb_chaines)
+            taille = fins[-1] if nb_chaines else 0
+            blob = bytes(data[pos + 4 * nb_chaines:pos + 4 * nb_chaines + taille])
+            debuts = [0] + fins.tolist()
+            if blob.isascii():
+                # byte offsets are character offsets: decode once, then slice
+                texte = blob.decode("ascii")
+                self.chaines = [None] + [texte[a:b] for a, b in zip(debuts, fins)]
+            else:
+                self.chaines = [None] + [blob[a:b].decode("utf-8", "surrogatepass") for a, b in zip(debuts, fins)]
+        pos += 4 * nb_chaines + taille
+        # file state codes -> codes of this process
+        table = bytes(code_etat(self.chaines[r]) for r in self._u32s(pos, nb_etats))
+        pos += 4 * nb_etats
+        self._table_etats = None if table == bytes(range(len(table))) else table.ljust(256, b"\0")
+        self._lignes: dict[int, tuple] = {}
+        self.debut_livres = pos
+
+    def _u32s(self, pos: int, n: int) -> array:
+        a = array("I")
+        a.frombytes(self.data[pos:pos + 4 * n])
+        if sys.byteorder != "little":
+            a.byteswap()
+        return a
+
+    def _ligne(self, ref: int) -> tuple:
+        schema = self._lignes.get(ref)
+        if schema is None:
+            cles, lettres = self.chaines[ref].rsplit("\x1e", 1)
+            st = struct.Struct("<" + "".join(_TYPES_LIGNE[t] for t in lettres))
+            schema = self._lignes[ref] = (
+                tuple(cles.split("\x1f")) if cles else (), st, [i for i, t in enumerate(lettres) if t == "S"])
+        return schema
+
+    def valeur(self, pos: int):
+        data, ch = self.data, self.chaines
+        tag = data[pos]
+        pos += 1
+        if tag == _LIGNE:
+            cles, st, refs = self._ligne(_U32.unpack_from(data, pos)[0])
+            vals = list(st.unpack_from(data, pos + 4))
+            for i in refs:
+                vals[i] = ch[vals[i]]
+            return dict(zip(cles, vals)), pos + 4 + st.size
+        if tag == _CHAINE:
+            return ch[_U32.unpack_from(data, pos)[0]], pos + 4
+        if tag == _ENTIER:
+            return _I64.unpack_from(data, pos)[0], pos + 8
+        if tag == _NONE:
+            return None, pos
+        if tag == _VRAI:
+            return True, pos
+        if tag == _FAUX:
+            return False, pos
+        if tag == _REEL:
+            return _F64.unpack_from(data, pos)[0], pos + 8
+        if tag == _LISTE:
+            n = _U32.unpack_from(data, pos)[0]
+            pos += 4
+            out = []
+            for _ in range(n):
+                v, pos = self.valeur(pos)
+                out.append(v)
+            return out, pos
+        if tag == _DICT:
+            n = _U32.unpack_from(data, pos)[0]
+            pos += 4
+            d = {}
+            for _ in range(n):
+                k = ch[_U32.unpack_from(data, pos)[0]]
+                d[k], pos = self.valeur(pos + 4)
+            return d, pos
+        if tag == _GRAND_ENTIER:
+            return int(ch[_U32.unpack_from(data, pos)[0]]), pos + 4
+        raise ErreurFichier(f"Type de valeur inconnu dans le snapshot binaire: {tag}")
+
+    def livre(self, pos: int):
+        """Book record at `pos` (its length prefix) and the next record's offset."""
+        from .models import AggregatedLivre, LivreNumerique
+        data, ch = self.data, self.chaines
+        fin = pos + 4 + _U32.unpack_from(data, pos)[0]
+        (t, titre, auteur, isbn, genre, taille_fichier, total, dispo,
+         nb_ex, nb_rev, nb_hist) = _LIVRE.unpack_from(data, pos + 4)
+        pos += 4 + _LIVRE.size
+        ids = self._u32s(pos, nb_ex)
+        pos += 4 * nb_ex
+        codes = bytes(data[pos:pos + nb_ex])
+        pos += nb_ex
+        reviews = []
+        for _ in range(nb_rev):
+            v, pos = self.valeur(pos)
+            reviews.append(v)
+        history = []
+        for _ in range(nb_hist):
+            v, pos = self.valeur(pos)
+            history.append(v)
+        # same fields as `_livre_depuis_dict` restores from JSON
+        if ch[t] == "Livre Numerique":
+            livre = LivreNumerique(ch[titre], ch[auteur], ch[isbn], ch[taille_fichier])
+        else:
+            livre = AggregatedLivre(ch[titre], ch[auteur], ch[isbn], total=total, disponibles=dispo)
+            if history:
+                livre.history = history
+            if nb_ex:
+                if self._table_etats is not None:
+                    codes = codes.translate(self._table_etats)
+                livre.exemplaires_stock = ExemplairesCompacts.depuis_colonnes([ch[i] for i in ids], codes)
+        if genre:
+            livre.genre = ch[genre]
+        livre.reviews = reviews
+        return livre, fin
+
+    def iter_livres(self):
+        pos = self.debut_livres
+        for _ in range(self.nb_livres):
+            livre, pos = self.livre(pos)
+            yield livre
+
+    def entree_index(self, i: int) -> tuple[int, int]:
+        """(ISBN ref, record offset) of the i-th entry, in ISBN order."""
+        return _ENTREE_INDEX.unpack_from(self.data, self.off_index + i * _ENTREE_INDEX.size)
+
+    def annexes(self) -> tuple[dict, dict]:
+        """Reservations and aggregate counts."""
+        data, ch = self.data, self.chaines
+        pos = self.off_annexes
+        reservations = {}
+        for _ in range(_U32.unpack_from(data, pos)[0]):
+            isbn, n = self._u32s(pos + 4, 2)
+            reservations[ch[isbn]] = [ch[r] for r in self._u32s(pos + 12, n)]
+            pos += 8 + 4 * n
+        pos += 4
+        exemplaires = {}
+        for _ in range(_U32.unpack_from(data, pos)[0]):
+            isbn, total, dispo = self._u32s(pos + 4, 3)
+            exemplaires[ch[isbn].strip()] = {"total": total, "disponibles": dispo}
+            pos += 12
+        return reservations, exemplaires
+
+
+def decoder(data: bytes, biblio) -> None:
+    """Fill `biblio` (livres, reservations, exemplaires) from `encoder` output."""
+    dec = _Decodeur(memoryview(data))
+    livres = list(dec.iter_livres())
+    reservations, exemplaires = dec.annexes()
+    biblio.livres = livres
+    biblio.reservations = reservations
+    biblio.exemplaires = exemplaires
+
+
+def convertir(source: str | Path, destination: str | Path) -> None:
+    """Convert a snapshot between JSON and binary, in the direction given by
+    the source file's content."""
+    from .file_manager import BibliothequeAvecFichier
+    b = BibliothequeAvecFichier(Path(source).stem)
+    if est_binaire(source):
+        b.charger_binary(str(source))
+        b.sauvegarder(str(destination))
+    else:
+        b.charger(str(source), streaming=True)
+        b.sauvegarder_binary(str(destination))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python -m src.snapshot_binaire bib.json bib.bin  (ou bib.bin bib.json)")
+        sys.exit(2)
+    convertir(sys.argv[1], sys.argv[2])
+    print(f"Conversion terminee: {sys.argv[2]}")
@@ -0,0 +1,412 @@
+import json
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from .exceptions import ErreurFichier
+from .storage import Stockage
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS livres (
+    id INTEGER PRIMARY KEY,
+    isbn TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    titre TEXT,
+    auteur TEXT,
+    genre TEXT,
+    taille_fichier TEXT,
+    total INTEGER NOT NULL DEFAULT 0,
+    disponibles INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS livres_isbn ON livres(isbn);
+CREATE INDEX IF NOT EXISTS livres_position ON livres(position);
+
+CREATE TABLE IF NOT EXISTS exemplaires (
+    livre_id INTEGER NOT NULL REFERENCES livres(id) ON DELETE CASCADE,
+    slot INTEGER NOT NULL,
+    exemplaire_id TEXT,
+    etat TEXT NOT NULL,
+    PRIMARY KEY (livre_id, slot)
+);
+CREATE INDEX IF NOT EXISTS exemplaires_id ON exemplaires(exemplaire_id);
+
+CREATE TABLE IF NOT EXISTS historique (
+    livre_id INTEGER NOT NULL REFERENCES livres(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    username TEXT,
+    isbn TEXT,
+    exemplaire_id TEXT,
+    date_emprunt TEXT,
+    date_retour_prevue TEXT,
+    date_retour_effective TEXT,
+    penalite_acquise REAL,
+    PRIMARY KEY (livre_id, seq)
+);
+
+CREATE TABLE IF NOT EXISTS avis (
+    livre_id INTEGER NOT NULL REFERENCES livres(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    username TEXT,
+    rating INTEGER,
+    comment TEXT,
+    PRIMARY KEY (livre_id, seq)
+);
+
+CREATE TABLE IF NOT EXISTS reservations (
+    isbn TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    PRIMARY KEY (isbn, position)
+);
+CREATE INDEX IF NOT EXISTS reservations_username ON reservations(username);
+
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    pwd_hash TEXT NOT NULL,
+    is_admin INTEGER NOT NULL DEFAULT 0,
+    subscription_type TEXT,
+    date_debut TEXT,
+    date_expiration TEXT,
+    penalites REAL NOT NULL DEFAULT 0,
+    notifications TEXT NOT NULL DEFAULT '[]',
+    monthly_emprunts INTEGER NOT NULL DEFAULT 0,
+    last_reset TEXT
+);
+
+CREATE TABLE IF NOT EXISTS prets (
+    username TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    isbn TEXT,
+    exemplaire_id TEXT,
+    date_emprunt TEXT,
+    date_retour_prevue TEXT,
+    date_retour_effective TEXT,
+    penalite_acquise REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, seq)
+);
+CREATE INDEX IF NOT EXISTS prets_ouverts ON prets(date_retour_prevue) WHERE date_retour_effective IS NULL;
+
+CREATE TABLE IF NOT EXISTS reservations_users (
+    username TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    isbn TEXT,
+    exemplaire_id TEXT,
+    date_reservation TEXT,
+    date_limite TEXT,
+    PRIMARY KEY (username, seq)
+);
+"""
+
+_HISTO_COLS = ("username", "isbn", "exemplaire_id", "date_emprunt", "date_retour_prevue", "date_retour_effective", "penalite_acquise")
+_PRET_COLS = ("isbn", "exemplaire_id", "date_emprunt", "date_retour_prevue", "date_retour_effective", "penalite_acquise")
+
+
+class StockageSQLite(Stockage):
+    """SQLite backend (stdlib `sqlite3`, WAL mode).
+
+    Every mutation rewrites only the rows of the ISBNs, queues and users it
+    touched, inside one transaction. Keyed reads (`lire_livres`,
+    `lire_user`, `trouver_exemplaire`) go through indexes without loading
+    the rest of the library.
+    """
+
+    def __init__(self, db_filepath: str | Path):
+        self.db_filepath = str(db_filepath)
+        self._users: dict = {}
+        # one connection shared by the Tk thread and the writer thread
+        self._verrou = threading.RLock()
+        try:
+            Path(self.db_filepath).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_filepath, isolation_level=None, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=FULL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.executescript(SCHEMA)
+            # databases created before holds existed
+            colonnes = {r[1] for r in self._conn.execute("PRAGMA table_info(reservations_users)")}
+            if "date_limite" not in colonnes:
+                self._conn.execute("ALTER TABLE reservations_users ADD COLUMN date_limite TEXT")
+        except sqlite3.Error as e:
+            raise ErreurFichier(f"Impossible d'ouvrir la base '{self.db_filepath}': {e}")
+
+    @contextmanager
+    def _transaction(self):
+        with self._verrou:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    yield self._conn
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                raise ErreurFichier(f"Erreur SQLite sur '{self.db_filepath}': {e}")
+
+    def fermer(self) -> None:
+        with self._verrou:
+            self._conn.close()
+
+    # -- books ---------------------------------------------------------
+
+    def _ecrire_livre(self, c, d: dict, position: int) -> None:
+        ex = d.get("exemplaires") or {}
+        cur = c.execute(
+            "INSERT INTO livres (isbn, position, type, titre, auteur, genre, taille_fichier, total, disponibles)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (d.get("ISBN"), position, d.get("type"), d.get("titre"), d.get("auteur"), d.get("genre"),
+             d.get("taille_fichier"), int(ex.get("total", 0)), int(ex.get("disponibles", 0))),
+        )
+        lid = cur.lastrowid
+        c.executemany(
+            "INSERT INTO exemplaires (livre_id, slot, exemplaire_id, etat) VALUES (?, ?, ?, ?)",
+            ((lid, i, e.get("exemplaire_id"), e.get("etat", "disponible")) for i, e in enumerate(d.get("exemplaires_details") or [])),
+        )
+        c.executemany(
+            "INSERT INTO historique (livre_id, seq, " + ", ".join(_HISTO_COLS) + ") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((lid, i) + tuple(h.get(k) for k in _HISTO_COLS) for i, h in enumerate(d.get("history") or [])),
+        )
+        c.executemany(
+            "INSERT INTO avis (livre_id, seq, username, rating, comment) VALUES (?, ?, ?, ?, ?)",
+            ((lid, i, r.get("username"), r.get("rating"), r.get("comment")) for i, r in enumerate(d.get("reviews") or [])),
+        )
+
+    def _ecrire_isbn(self, c, isbn: str, image: list[dict]) -> None:
+        positions = [r[0] for r in c.execute("SELECT position FROM livres WHERE isbn = ? ORDER BY position", (isbn,))]
+        c.execute("DELETE FROM livres WHERE isbn = ?", (isbn,))
+        for d in image:
+            if positions:
+                pos = positions.pop(0)
+            else:
+                pos = c.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM livres").fetchone()[0]
+            self._ecrire_livre(c, d, pos)
+
+    def _dicts_livres(self, where: str = "", params: tuple = ()) -> list[dict]:
+        with self._verrou:
+            c = self._conn
+            rows = c.execute("SELECT * FROM livres " + where + " ORDER BY position", params).fetchall()
+            dicts: dict[int, dict] = {}
+            for r in rows:
+                d = {
+                    "type": r["type"], "titre": r["titre"], "auteur": r["auteur"], "ISBN": r["isbn"],
+                    "genre": r["genre"], "reviews": [], "history": [], "exemplaires_details": [],
+                    "exemplaires": {"total": r["total"], "disponibles": r["disponibles"]},
+                }
+                if r["type"] == "Livre Numerique":
+                    d["taille_fichier"] = r["taille_fichier"]
+                dicts[r["id"]] = d
+            if not dicts:
+                return []
+            if where:
+                ids = tuple(dicts)
+                filtre = f" WHERE livre_id IN ({','.join('?' * len(ids))})"
+            else:
+                ids, filtre = (), ""
+            for r in c.execute("SELECT livre_id, exemplaire_id, etat FROM exemplaires" + filtre + " ORDER BY livre_id, slot", ids):
+                dicts[r[0]]["exemplaires_details"].append({"exemplaire_id": r[1], "etat": r[2]})
+            for r in c.execute("SELECT livre_id, " + ", ".join(_HISTO_COLS) + " FROM historique" + filtre + " ORDER BY livre_id, seq", ids):
+                dicts[r[0]]["history"].append({k: r[k] for k in _HISTO_COLS})
+            for r in c.execute("SELECT livre_id, username, rating, comment FROM avis" + filtre + " ORDER BY livre_id, seq", ids):
+                dicts[r[0]]["reviews"].append({"username": r[1], "rating": r[2], "comment": r[3]})
+            return list(dicts.values())
+
+    def charger(self, biblio) -> None:
+        from .file_manager import BibliothequeAvecFichier
+        conv = biblio if isinstance(biblio, BibliothequeAvecFichier) else BibliothequeAvecFichier("conversion")
+        biblio.livres = [conv._livre_depuis_dict(d) for d in self._dicts_livres()]
+        biblio.reservations = {}
+        with self._verrou:
+            files = self._conn.execute("SELECT isbn, username FROM reservations ORDER BY isbn, position").fetchall()
+        for r in files:
+            biblio.reservations.setdefault(r[0], []).append(r[1])
+        biblio.exemplaires = {}
+
+    def lire_livres(self, ISBN: str) -> list:
+        from .file_manager import BibliothequeAvecFichier
+        conv = BibliothequeAvecFichier("lecture")
+        return [conv._livre_depuis_dict(d) for d in self._dicts_livres("WHERE isbn = ?", (ISBN,))]
+
+    def trouver_exemplaire(self, exemplaire_id: str) -> Optional[dict]:
+        with self._verrou:
+            r = self._conn.execute(
+                "SELECT l.isbn, l.titre, e.exemplaire_id, e.etat FROM exemplaires e JOIN livres l ON l.id = e.livre_id"
+                " WHERE e.exemplaire_id = ? ORDER BY l.position LIMIT 1",
+                (exemplaire_id,),
+            ).fetchone()
+            if r is None:
+                return None
+            return {"ISBN": r[0], "titre": r[1], "exemplaire_id": r[2], "etat": r[3]}
+
+    def changer_etat_exemplaire(self, exemplaire_id: str, etat: str) -> bool:
+        with self._transaction() as c:
+            cur = c.execute("UPDATE exemplaires SET etat = ? WHERE exemplaire_id = ?", (etat, exemplaire_id))
+            if cur.rowcount:
+                c.execute(
+                    "UPDATE livres SET disponibles = (SELECT COUNT(*) FROM exemplaires e WHERE e.livre_id = livres.id AND e.etat = 'disponible')"
+                    " WHERE id IN (SELECT livre_id FROM exemplaires WHERE exemplaire_id = ?)",
+                    (exemplaire_id,),
+                )
+            return bool(cur.rowcount)
+
+    # -- users ---------------------------------------------------------
+
+    def _ecrire_user(self, c, d: dict) -> None:
+        sub = d.get("subscription") or {}
+        c.execute("DELETE FROM users WHERE username = ?", (d["username"],))
+        c.execute(
+            "INSERT INTO users (username, pwd_hash, is_admin, subscription_type, date_debut, date_expiration,"
+            " penalites, notifications, monthly_emprunts, last_reset) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (d["username"], d.get("_pwd_hash", ""), int(bool(d.get("is_admin"))), sub.get("type"), sub.get("date_debut"),
+             sub.get("date_expiration"), float(d.get("penalites", 0.0)), json.dumps(d.get("notifications") or [], ensure_ascii=False),
+             int(d.get("monthly_emprunts", 0)), d.get("last_reset")),
+        )
+        c.executemany(
+            "INSERT INTO prets (username, seq, " + ", ".join(_PRET_COLS) + ") VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            ((d["username"], i) + tuple(l.get(k) for k in _PRET_COLS) for i, l in enumerate(d.get("loans") or [])),
+        )
+        c.executemany(
+            "INSERT INTO reservations_users (username, seq, isbn, exemplaire_id, date_reservation, date_limite) VALUES (?, ?, ?, ?, ?, ?)",
+            ((d["username"], i, r.get("isbn"), r.get("exemplaire_id"), r.get("date_reservation"), r.get("date_limite")) for i, r in enumerate(d.get("reservations") or [])),
+        )
+
+    def _dicts_users(self, where: str = "", params: tuple = ()) -> list[dict]:
+        with self._verrou:
+            c = self._conn
+            dicts: dict[str, dict] = {}
+            for r in c.execute("SELECT * FROM users " + where + " ORDER BY rowid", params):
+                sub = None
+                if r["subscription_type"]:
+                    sub = {"type": r["subscription_type"], "date_debut": r["date_debut"], "date_expiration": r["date_expiration"]}
+                dicts[r["username"]] = {
+                    "username": r["username"], "_pwd_hash": r["pwd_hash"], "is_admin": bool(r["is_admin"]),
+                    "subscription": sub, "loans": [], "reservations": [], "penalites": r["penalites"],
+                    "notifications": json.loads(r["notifications"] or "[]"), "monthly_emprunts": r["monthly_emprunts"],
+                    "last_reset": r["last_reset"],
+                }
+            if not dicts:
+                return []
+            for r in c.execute("SELECT username, " + ", ".join(_PRET_COLS) + " FROM prets " + where + " ORDER BY username, seq", params):
+                dicts[r[0]]["loans"].append({k: r[k] for k in _PRET_COLS})
+            for r in c.execute("SELECT username, isbn, exemplaire_id, date_reservation, date_limite FROM reservations_users " + where + " ORDER BY username, seq", params):
+                dicts[r[0]]["reservations"].append({"isbn": r[1], "exemplaire_id": r[2], "date_reservation": r[3], "date_limite": r[4]})
+            return list(dicts.values())
+
+    def charger_users(self) -> list:
+        from .users import User
+        users = []
+        for d in self._dicts_users():
+            try:
+                users.append(User.from_dict(d))
+            except Exception:
+                continue
+        self._users = {u.username: u for u in users}
+        return users
+
+    def lire_user(self, username: str):
+        from .users import User
+        if username in self._users:
+            return self._users[username]
+        dicts = self._dicts_users("WHERE username = ?", (username,))
+        if not dicts:
+            return None
+        user = self._users[username] = User.from_dict(dicts[0])
+        return user
+
+    def ajouter_notification(self, username: str, message: str) -> None:
+        user = self._users.get(username)
+        if user is not None:
+            user.notifications.append(message)
+        with self._transaction() as c:
+            r = c.execute("SELECT notifications FROM users WHERE username = ?", (username,)).fetchone()
+            if r is None:
+                from .users import User
+                new = User(username, "")
+                new.notifications.append(message)
+                self._ecrire_user(c, new.to_dict())
+                return
+            notifications = json.loads(r[0] or "[]")
+            notifications.append(message)
+            c.execute("UPDATE users SET notifications = ? WHERE username = ?",
+                      (json.dumps(notifications, ensure_ascii=False), username))
+
+    # -- writes --------------------------------------------------------
+
+    def _ecrire_file(self, c, isbn: str, file: list) -> None:
+        c.execute("DELETE FROM reservations WHERE isbn = ?", (isbn,))
+        c.executemany(
+            "INSERT INTO reservations (isbn, position, username) VALUES (?, ?, ?)",
+            ((isbn, i, u) for i, u in enumerate(file)),
+        )
+
+    def preparer(self, biblio, isbns=(), reservations=(), users=()) -> dict:
+        for u in users:
+            self._users[u.username] = u
+        return super().preparer(biblio, isbns=isbns, reservations=reservations, users=users)
+
+    def ecrire(self, ecriture: dict) -> None:
+        with self._transaction() as c:
+            for isbn, image in ecriture.get("livres", {}).items():
+                self._ecrire_isbn(c, isbn, image)
+            for isbn, q in ecriture.get("reservations", {}).items():
+                self._ecrire_file(c, isbn, q)
+            for d in ecriture.get("users", {}).values():
+                self._ecrire_user(c, d)
+
+    def sauvegarder_tout(self, biblio, users: list) -> None:
+        with self._transaction() as c:
+            for table in ("exemplaires", "historique", "avis", "livres", "reservations", "prets", "reservations_users", "users"):
+                c.execute(f"DELETE FROM {table}")
+            for pos, livre in enumerate(biblio.livres):
+                self._ecrire_livre(c, livre.to_dict(), pos)
+            for isbn, q in getattr(biblio, "reservations", {}).items():
+                self._ecrire_file(c, isbn, list(q))
+            for u in users:
+                self._ecrire_user(c, u.to_dict())
+
+    def preparer_checkpoint(self, biblio, users: list, complet: bool = False):
+        # rows are already current; persist the reconciled queues, or every
+        # row after a change that touched the whole catalogue
+        reservations = list(getattr(biblio, "reservations", {}))
+        if not complet:
+            return self.preparer(biblio, reservations=reservations)
+        isbns = list(dict.fromkeys(l.ISBN for l in biblio.livres))
+        return self.preparer(biblio, isbns=isbns, reservations=reservations, users=users)
+
+    def ecrire_checkpoint(self, donnees) -> None:
+        self.ecrire(donnees)
+        try:
+            with self._verrou:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            raise ErreurFichier(f"Checkpoint SQLite impossible sur '{self.db_filepath}': {e}")
+
+    def ecrire_archivage(self, donnees):
+        # `preparer_archivage` never prepares any: the rows stay in the tables
+        raise ErreurFichier("Le stockage SQLite ne garde pas d'archives d'historique")
+
+
+def migrer_json_vers_sqlite(bib_filepath: str, users_filepath: str, db_filepath: str) -> StockageSQLite:
+    """Import an existing `bib.json`/`users.json` pair (journal included)."""
+    from .storage import StockageJSON
+    from .file_manager import BibliothequeAvecFichier
+    source = StockageJSON(bib_filepath, users_filepath)
+    b = BibliothequeAvecFichier("migration")
+    source.charger(b)
+    users = source.charger_users()
+    cible = StockageSQLite(db_filepath)
+    cible.sauvegarder_tout(b, users)
+    return cible
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("usage: python -m src.sqlite_storage bib.json users.json bibliotheque.db")
+        sys.exit(2)
+    migrer_json_vers_sqlite(sys.argv[1], sys.argv[2], sys.argv[3]).fermer()
+    print(f"Migration terminee: {sys.argv[3]}")
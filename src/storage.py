@@ -0,0 +1,486 @@
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Optional
+from uuid import uuid4
+
+from .exceptions import ErreurFichier
+from .journal import Journal
+from .prets import prets_en_cours
+from .user_store import DepotUsers
+from .verrou import VerrouFichier
+
+
+@dataclass
+class Synchronisation:
+    """What a write, a checkpoint or a poll found in the shared files.
+
+    Images are states read from the files, each tagged with the journal
+    position (generation, offset) it stands at; `Stockage.appliquer`
+    installs on the Tk thread those newer than what the models already
+    hold. `conflits` describes the records of a refused write,
+    `recharger` asks for a full reload (the journal it started from is gone).
+    """
+
+    position: Optional[tuple[int, int]] = None
+    livres: dict = field(default_factory=dict)        # ISBN -> (position, [book dicts])
+    reservations: dict = field(default_factory=dict)  # ISBN -> (position, queue)
+    users: dict = field(default_factory=dict)         # username -> (position, user dict or None)
+    conflits: list = field(default_factory=list)
+    recharger: bool = False
+
+
+class Stockage(ABC):
+    """Persistence backend used by the GUI.
+
+    `enregistrer` receives what a mutation touched (ISBNs, reservation
+    queues, users) so a backend can write only those records; `checkpoint`
+    makes the persisted state compact and complete.
+
+    Both are split in two: `preparer*` serializes the touched objects and
+    must run where the models are mutated (the Tk thread); `ecrire*` only
+    does I/O on that plain data and may run on a worker thread. Prepared
+    writes can be merged with `fusionner` before being written.
+    """
+
+    @abstractmethod
+    def charger(self, biblio) -> None:
+        ...
+
+    @abstractmethod
+    def charger_users(self) -> list:
+        ...
+
+    def preparer(self, biblio, isbns=(), reservations=(), users=()) -> dict:
+        # what the caller reports as touched is re-encoded at the next
+        # snapshot too, whatever the in-place change was
+        for isbn in isbns:
+            for livre in biblio.trouver_exemplaires(isbn):
+                livre.marquer_modifie()
+        for u in users:
+            u.marquer_modifie()
+        return {
+            "livres": {isbn: [l.to_dict() for l in biblio.trouver_exemplaires(isbn)] for isbn in isbns},
+            "reservations": {isbn: list(biblio.reservations.get(isbn, [])) for isbn in reservations},
+            "users": {u.username: u.to_dict() for u in users},
+        }
+
+    @staticmethod
+    def fusionner(ecriture: dict, suivante: dict) -> dict:
+        # images are whole states, so the later one wins per key; the
+        # merged write is as old as its oldest part
+        for cle, images in suivante.items():
+            if cle == "base":
+                ecriture[cle] = images if ecriture.get(cle) is None or images is None else min(ecriture[cle], images)
+                continue
+            ecriture.setdefault(cle, {}).update(images)
+        return ecriture
+
+    @abstractmethod
+    def ecrire(self, ecriture: dict) -> Optional[Synchronisation]:
+        ...
+
+    def enregistrer(self, biblio, isbns=(), reservations=(), users=()) -> None:
+        self.ecrire(self.preparer(biblio, isbns=isbns, reservations=reservations, users=users))
+
+    @abstractmethod
+    def preparer_checkpoint(self, biblio, users: list, complet: bool = False):
+        ...
+
+    @abstractmethod
+    def ecrire_checkpoint(self, donnees) -> None:
+        ...
+
+    def checkpoint(self, biblio, users: list, complet: bool = False) -> None:
+        self.ecrire_checkpoint(self.preparer_checkpoint(biblio, users, complet=complet))
+
+    def preparer_archivage(self, biblio, users: list, avant):
+        """Borrow records to move to the monthly archives (see archives.py);
+        None when there are none or the backend keeps no archives."""
+        return None
+
+    @abstractmethod
+    def ecrire_archivage(self, donnees) -> tuple[Optional[Synchronisation], bool]:
+        ...
+
+    def synchroniser(self) -> Optional[Synchronisation]:
+        """Changes written by other processes since the last one seen."""
+        return None
+
+    def appliquer(self, biblio, users: list, synchro: Optional[Synchronisation]) -> list:
+        return []
+
+    @abstractmethod
+    def lire_livres(self, ISBN: str) -> list:
+        ...
+
+    @abstractmethod
+    def lire_user(self, username: str):
+        ...
+
+    @abstractmethod
+    def ajouter_notification(self, username: str, message: str) -> None:
+        ...
+
+    def fermer(self) -> None:
+        pass
+
+
+class StockageJSON(Stockage):
+    """`bib.json` snapshot plus the append-only journal; users in a keyed
+    `DepotUsers`, with `users.json` written at each checkpoint as export.
+
+    With `binaire`, each checkpoint also writes `bib.bin` (see
+    `snapshot_binaire`), which startup reads instead of `bib.json` while it
+    is not older. It defaults to on once a `bib.bin` exists.
+
+    Several processes may share the files. Every write happens under the
+    exclusive `VerrouFichier` and is a compare-and-swap against the journal
+    position the models were loaded or last synchronized at: records other
+    processes appended since are returned to be merged, and a write touching
+    one of their books, queues or users is refused whole (first writer
+    wins) and returned with the stored state of everything it touched. A
+    checkpoint only folds a journal it has fully merged. Positions stop at
+    the last complete record: a line torn by a crashed desk is cut by the
+    next append, which takes its place.
+    """
+
+    def __init__(self, bib_filepath: str | Path, users_filepath: str | Path, streaming: bool = True,
+                 binaire: bool | None = None):
+        self.bib_filepath = str(bib_filepath)
+        self.users_filepath = str(users_filepath)
+        self.streaming = streaming
+        self.journal = Journal(Journal.chemin_pour(self.bib_filepath))
+        self.depot = DepotUsers(DepotUsers.chemin_pour(self.users_filepath))
+        self.bin_filepath = str(Path(self.bib_filepath).with_suffix(".bin"))
+        self.binaire = Path(self.bin_filepath).exists() if binaire is None else binaire
+        self.verrou = VerrouFichier(VerrouFichier.chemin_pour(self.bib_filepath))
+        # tags this process's journal records; `position` is the journal
+        # point (generation, offset) the loaded models are up to date with
+        self.poste = uuid4().hex[:12]
+        self.position: Optional[tuple[int, int]] = None
+        # writes refused by the worker: (position, keys), see `_etrangers`
+        self._refusees: list = []
+
+    def _binaire_a_jour(self) -> bool:
+        if not self.binaire:
+            return False
+        try:
+            mtime_bin = Path(self.bin_filepath).stat().st_mtime_ns
+        except FileNotFoundError:
+            return False
+        try:
+            return mtime_bin >= Path(self.bib_filepath).stat().st_mtime_ns
+        except FileNotFoundError:
+            return True
+
+    def _recuperer(self) -> None:
+        # a checkpoint cut short by a crash is finished before anything is read
+        from .file_manager import BibliothequeAvecFichier
+        if BibliothequeAvecFichier.chemin_commit(self.bib_filepath).exists():
+            with self.verrou.exclusif():
+                BibliothequeAvecFichier.recuperer_commit(self.bib_filepath)
+
+    def charger(self, biblio) -> None:
+        biblio.journal = self.journal
+        self._recuperer()
+        with self.verrou.partage() as tenu:
+            self.position = (tenu.generation(), self.journal.taille())
+            self._charger_catalogue(biblio)
+            # only the index: the month files are read on demand
+            biblio.archive = self._archive(biblio)
+            biblio.archive.index
+
+    def _archive(self, biblio):
+        from .archives import ArchiveHistorique
+        archive = getattr(biblio, "archive", None)
+        if archive is None or archive.dossier != ArchiveHistorique.chemin_pour(self.bib_filepath):
+            archive = ArchiveHistorique(ArchiveHistorique.chemin_pour(self.bib_filepath))
+        return archive
+
+    def _charger_catalogue(self, biblio) -> None:
+        if self._binaire_a_jour():
+            try:
+                biblio.charger_binary(self.bin_filepath, journal_de=self.bib_filepath)
+                return
+            except ErreurFichier:
+                # unreadable (e.g. older format): bib.json is the reference
+                pass
+        if Path(self.bib_filepath).exists():
+            biblio.charger(self.bib_filepath, streaming=self.streaming)
+
+    def charger_users(self) -> list:
+        if not self.depot.existe():
+            self._recuperer()
+            # first start on this tree: import users.json (and any user
+            # records left in an older journal)
+            from .file_manager import BibliothequeAvecFichier
+            self.depot.importer(BibliothequeAvecFichier.charger_users(self.users_filepath, journal=self.journal))
+        return self.depot.tous()
+
+    def preparer(self, biblio, isbns=(), reservations=(), users=()) -> dict:
+        for u in users:
+            self.depot.retenir(u)
+        ecriture = super().preparer(biblio, isbns=isbns, reservations=reservations, users=users)
+        ecriture["base"] = self.position
+        return ecriture
+
+    def _etrangers(self, generation: int, base: tuple[int, int]) -> Optional[list]:
+        # (position, key, record) appended by other processes after `base`,
+        # then the keys of our own writes refused since; None when the
+        # journal `base` points into is gone
+        g, offset = base
+        if g == generation:
+            sources = [(g, self.journal.path, offset)]
+        elif g == generation - 1:
+            sources = [(g, self.journal.precedent, offset), (generation, self.journal.path, 0)]
+        else:
+            return None
+        etrangers = []
+        for gen, path, debut in sources:
+            if debut and self.journal.taille(path) < debut:
+                return None
+            for fin, r in self.journal.lire_depuis(debut, path):
+                cle = _cle(r)
+                if cle is not None and r.get("poste") != self.poste:
+                    etrangers.append(((gen, fin), cle, r))
+        self._refusees = [(pos, cles) for pos, cles in self._refusees if pos > base]
+        etrangers.extend((pos, cle, None) for pos, cles in self._refusees for cle in cles)
+        return etrangers
+
+    def _images(self, etrangers: list, position: tuple[int, int]) -> Synchronisation:
+        synchro = Synchronisation(position=position)
+        for pos, (op, cle), r in etrangers:
+            if r is None:
+                continue
+            if op == "livre":
+                synchro.livres[cle] = (pos, r.get("data") or [])
+            elif op == "reservations":
+                synchro.reservations[cle] = (pos, list(r.get("file") or []))
+            else:
+                synchro.users[cle] = (pos, self.depot._lire_dict(cle))
+        return synchro
+
+    def _restaurer(self, synchro: Synchronisation, cles: set) -> None:
+        # stored state of the records a refused write touched
+        from .file_manager import BibliothequeAvecFichier
+        stocke = None
+        for op, cle in cles:
+            images = {"livre": synchro.livres, "reservations": synchro.reservations, "user": synchro.users}[op]
+            if cle in images:
+                continue
+            if op == "user":
+                images[cle] = (synchro.position, self.depot._lire_dict(cle))
+                continue
+            if stocke is None:
+                stocke = BibliothequeAvecFichier("stocke")
+                self._charger_catalogue(stocke)
+            if op == "livre":
+                images[cle] = (synchro.position, [l.to_dict() for l in stocke.trouver_exemplaires(cle)])
+            else:
+                images[cle] = (synchro.position, list(stocke.reservations.get(cle, [])))
+
+    def ecrire(self, ecriture: dict) -> Synchronisation:
+        base = ecriture.get("base")
+        cles = {("livre", i) for i in ecriture.get("livres", {})}
+        cles |= {("reservations", i) for i in ecriture.get("reservations", {})}
+        cles |= {("user", u) for u in ecriture.get("users", {})}
+        with self.verrou.exclusif() as tenu:
+            generation = tenu.generation()
+            etrangers = [] if base is None else self._etrangers(generation, base)
+            if etrangers is None:
+                return Synchronisation(recharger=True, conflits=sorted(_decrire(c) for c in cles))
+            synchro = self._images(etrangers, (generation, self.journal.taille()))
+            conflits = cles & {cle for _, cle, _ in etrangers}
+            if conflits:
+                self._restaurer(synchro, cles)
+                synchro.conflits = sorted(_decrire(c) for c in conflits)
+                self._refusees.append((synchro.position, cles))
+                return synchro
+            for data in ecriture.get("users", {}).values():
+                self.depot.ecrire_dict(data)
+            self.journal.enregistrer_images(livres=ecriture.get("livres"), reservations=ecriture.get("reservations"),
+                                            users_modifies=list(ecriture.get("users", {})), poste=self.poste)
+            synchro.position = (generation, self.journal.taille())
+            return synchro
+
+    def preparer_checkpoint(self, biblio, users: list, complet: bool = False):
+        # a JSON checkpoint always rewrites both snapshots
+        bib_data, users_data = biblio.donnees_snapshot(users)
+        binaire = None
+        if self.binaire:
+            from .snapshot_binaire import encoder
+            binaire = encoder(biblio)
+        return bib_data, users_data, binaire, self.position
+
+    def ecrire_checkpoint(self, donnees) -> Synchronisation:
+        from .file_manager import BibliothequeAvecFichier
+        bib_data, users_data, binaire, base = donnees
+        with self.verrou.exclusif() as tenu:
+            generation = tenu.generation()
+            if base is not None:
+                etrangers = self._etrangers(generation, base)
+                if etrangers is None:
+                    return Synchronisation(recharger=True)
+                if etrangers:
+                    # the snapshot would lose them: merge now, fold next time
+                    return self._images(etrangers, (generation, self.journal.taille()))
+            BibliothequeAvecFichier.ecrire_snapshots(bib_data, users_data, self.bib_filepath, self.users_filepath)
+            if binaire is not None:
+                # written after bib.json, so it is never older than the JSON it mirrors
+                BibliothequeAvecFichier.ecrire_binary(binaire, self.bin_filepath)
+            self.journal.archiver()
+            return Synchronisation(position=(tenu.incrementer(), 0))
+
+    def preparer_archivage(self, biblio, users: list, avant):
+        archive = self._archive(biblio)
+        archivage = archive.preparer(biblio, users, avant)
+        if not archivage.nb:
+            return None
+        bib_data, users_data = biblio.donnees_snapshot(users)
+        archivage.retailler(bib_data, users_data)
+        # the users' own files, trimmed the same way
+        fiches = [archivage.user_dict(u, prets) for _, u, prets in archivage.users]
+        return archive, archivage, bib_data, users_data, fiches, self.position
+
+    def ecrire_archivage(self, donnees) -> tuple[Synchronisation, bool]:
+        """A checkpoint that also commits the archive files and the trimmed
+        users' files; False with the news to merge first when other desks
+        wrote since `base`. `ArchiveHistorique.installer` is then run on the
+        Tk thread."""
+        from .file_manager import BibliothequeAvecFichier
+        archive, archivage, bib_data, users_data, fiches, base = donnees
+        with self.verrou.exclusif() as tenu:
+            generation = tenu.generation()
+            if base is not None:
+                etrangers = self._etrangers(generation, base)
+                if etrangers is None:
+                    return Synchronisation(recharger=True), False
+                if etrangers:
+                    return self._images(etrangers, (generation, self.journal.taille())), False
+            renommages = archive.ecrire(archivage)
+            try:
+                for data in fiches:
+                    renommages.append(self.depot.temporaire(data))
+            except ErreurFichier:
+                for tmp, _ in renommages:
+                    try:
+                        os.remove(tmp)
+                    except OSError:
+                        pass
+                raise
+            BibliothequeAvecFichier.ecrire_snapshots(bib_data, users_data, self.bib_filepath, self.users_filepath,
+                                                     autres=renommages)
+            # bib.bin is now older than bib.json and ignored until the next checkpoint
+            self.journal.archiver()
+            # two generations: other desks reload rather than merge records
+            # that have just been moved
+            tenu.incrementer()
+            return Synchronisation(position=(tenu.incrementer(), 0)), True
+
+    def synchroniser(self) -> Synchronisation:
+        base = self.position
+        if base is None:
+            return Synchronisation()
+        with self.verrou.partage() as tenu:
+            position = (tenu.generation(), self.journal.taille())
+            if position == base:
+                return Synchronisation(position=position)
+            etrangers = self._etrangers(position[0], base)
+            if etrangers is None:
+                return Synchronisation(recharger=True)
+            return self._images(etrangers, position)
+
+    def appliquer(self, biblio, users: list, synchro: Optional[Synchronisation]) -> list:
+        """Install on the Tk thread what `synchro` brought back; returns the
+        refused changes."""
+        if synchro is None:
+            return []
+        position = self.position
+
+        def recent(pos):
+            return position is None or pos > position
+
+        Journal.appliquer_images(
+            biblio,
+            livres={isbn: image for isbn, (pos, image) in synchro.livres.items() if recent(pos)},
+            reservations={isbn: q for isbn, (pos, q) in synchro.reservations.items() if recent(pos)},
+        )
+        for username, (pos, data) in synchro.users.items():
+            if recent(pos):
+                self._remplacer_user(biblio, users, username, data)
+        if synchro.position is not None and position is not None and synchro.position > position:
+            self.position = synchro.position
+        return synchro.conflits
+
+    def _remplacer_user(self, biblio, users: list, username: str, data: Optional[dict]) -> None:
+        # in place, so the GUI's references (current_user) stay valid
+        from .users import User
+        # the GUI's AnnuaireUsers answers by index, a plain list is scanned
+        if hasattr(users, 'get'):
+            user = users.get(username)
+        else:
+            user = next((u for u in users if u.username == username), None)
+        if user is not None:
+            for loan in prets_en_cours(user):
+                biblio.prets.retirer(username, loan)
+        if data is None:
+            if user is not None:
+                users.remove(user)
+            return
+        nouveau = User.from_dict(data)
+        if user is None:
+            users.append(nouveau)
+            self.depot.retenir(nouveau)
+        else:
+            for f in fields(User):
+                if f.name != "index_prets":
+                    setattr(user, f.name, getattr(nouveau, f.name))
+            user.marquer_modifie()
+            user.index_prets = None
+        biblio.prets.suivre([user or nouveau])
+
+    def lire_livres(self, ISBN: str) -> list:
+        # no index in the JSON format: load and pick (journal included)
+        from .file_manager import BibliothequeAvecFichier
+        b = BibliothequeAvecFichier("lecture")
+        if Path(self.bib_filepath).exists():
+            b.charger(self.bib_filepath, streaming=True)
+        return b.trouver_exemplaires(ISBN)
+
+    def lire_user(self, username: str):
+        return self.depot.lire(username)
+
+    def ajouter_notification(self, username: str, message: str) -> None:
+        with self.verrou.exclusif():
+            self.depot.ajouter_notification(username, message)
+            self.journal.enregistrer_images(users_modifies=[username], poste=self.poste)
+
+
+def _cle(record: dict) -> Optional[tuple[str, str]]:
+    op = record.get("op")
+    if op in ("livre", "reservations"):
+        return op, record.get("ISBN")
+    if op == "user":
+        return "user", record.get("username") or (record.get("data") or {}).get("username")
+    return None
+
+
+def _decrire(cle: tuple[str, str]) -> str:
+    op, valeur = cle
+    return {"livre": "livre", "reservations": "réservations", "user": "utilisateur"}[op] + f" {valeur}"
+
+
+def ouvrir_stockage(bib_filepath: str | Path, users_filepath: Optional[str | Path] = None) -> Stockage:
+    """Pick the backend from the catalogue path: `*.db`/`*.sqlite` use SQLite,
+    `*.bin` the JSON storage with its binary snapshot."""
+    if Path(bib_filepath).suffix in (".db", ".sqlite", ".sqlite3"):
+        from .sqlite_storage import StockageSQLite
+        return StockageSQLite(bib_filepath)
+    if users_filepath is None:
+        raise ErreurFichier("Le stockage JSON a besoin du fichier users")
+    if Path(bib_filepath).suffix == ".bin":
+        # bib.json stays the reference snapshot; bib.bin is kept next to it
+        return StockageJSON(Path(bib_filepath).with_suffix(".json"), users_filepath, binaire=True)
+    return StockageJSON(bib_filepath, users_filepath)
@@ -0,0 +1,68 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+
+class TachesArrierePlan:
+    """Runs functions on a single worker thread and hands results back to
+    the caller's thread.
+
+    Tk widgets may only be touched from the main loop, so completion
+    callbacks are not run by the worker: finished tasks are collected by
+    `traiter_resultats`, which the GUI polls with `after()` (through
+    `planifier`) while tasks are pending. One worker keeps writes in
+    submission order.
+    """
+
+    def __init__(self, planifier: Callable[[int, Callable], object], intervalle_ms: int = 50):
+        self._planifier = planifier
+        self._intervalle = intervalle_ms
+        self._executeur = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bibliotheque")
+        self._en_attente: list[tuple[Future, Optional[Callable], Optional[Callable]]] = []
+        self._sondage = False
+
+    @property
+    def en_cours(self) -> int:
+        return len(self._en_attente)
+
+    def soumettre(self, fonction: Callable, *args, quand_fini: Optional[Callable] = None,
+                  en_erreur: Optional[Callable] = None) -> Future:
+        future = self._executeur.submit(fonction, *args)
+        self._en_attente.append((future, quand_fini, en_erreur))
+        if not self._sondage:
+            self._sondage = True
+            self._planifier(self._intervalle, self._sonder)
+        return future
+
+    def _sonder(self) -> None:
+        self.traiter_resultats()
+        if self._en_attente:
+            self._planifier(self._intervalle, self._sonder)
+        else:
+            self._sondage = False
+
+    def traiter_resultats(self) -> None:
+        restants = []
+        for future, quand_fini, en_erreur in self._en_attente:
+            if not future.done():
+                restants.append((future, quand_fini, en_erreur))
+                continue
+            erreur = future.exception()
+            if erreur is not None:
+                if en_erreur is not None:
+                    en_erreur(erreur)
+            elif quand_fini is not None:
+                quand_fini(future.result())
+        self._en_attente = restants
+
+    def attendre(self, timeout: Optional[float] = None) -> None:
+        """Block until every submitted task is done, then run the callbacks."""
+        for future, _, _ in list(self._en_attente):
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+        self.traiter_resultats()
+
+    def fermer(self) -> None:
+        self.attendre()
+        self._executeur.shutdown(wait=True)
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Iterator, Optional
+from urllib.parse import quote, unquote
+
+from .exceptions import ErreurFichier
+
+
+class DepotUsers:
+    """Keyed users store: one small JSON file per user, sharded by hash.
+
+    `lire`, `ecrire` and `ajouter_notification` touch a single file, so a
+    notification no longer parses and rewrites every user. Users already
+    materialized are kept in an identity map: `lire` returns the same object
+    the GUI holds, and a notification for a loaded user also lands on that
+    object. `users.json` remains the import/export format (`importer`,
+    `exporter`).
+    """
+
+    def __init__(self, dossier: str | Path):
+        self.dossier = Path(dossier)
+        self._cache: dict = {}
+
+    @staticmethod
+    def chemin_pour(users_filepath: str | Path) -> Path:
+        return Path(users_filepath).with_suffix(".d")
+
+    def existe(self) -> bool:
+        return self.dossier.is_dir()
+
+    def _chemin(self, username: str) -> Path:
+        shard = hashlib.sha1(username.encode("utf-8")).hexdigest()[:2]
+        return self.dossier / shard / (quote(username, safe="") + ".json")
+
+    def _lire_dict(self, username: str) -> Optional[dict]:
+        p = self._chemin(username)
+        try:
+            with p.open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError as e:
+            raise ErreurFichier(f"Format JSON invalide pour l'utilisateur '{username}': {e}")
+        except OSError as e:
+            raise ErreurFichier(f"Impossible de lire l'utilisateur '{username}': {e}")
+
+    def temporaire(self, data: dict) -> tuple[str, str]:
+        """Write a user's record to a durable temp file next to it; returns
+        `(temp, final)` for the caller to rename (or list in a commit)."""
+        p = self._chemin(data["username"])
+        try:
+            p.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=str(p.parent), delete=False) as tf:
+                json.dump(data, tf, ensure_ascii=False, indent=2)
+                tf.flush()
+                os.fsync(tf.fileno())
+        except Exception as e:
+            raise ErreurFichier(f"Impossible d'ecrire l'utilisateur '{data.get('username')}': {e}")
+        return tf.name, str(p)
+
+    def ecrire_dict(self, data: dict) -> None:
+        # file I/O only: safe to call from a writer thread
+        tmp, final = self.temporaire(data)
+        try:
+            os.replace(tmp, final)
+        except Exception as e:
+            raise ErreurFichier(f"Impossible d'ecrire l'utilisateur '{data.get('username')}': {e}")
+
+    def noms(self) -> list[str]:
+        if not self.existe():
+            return []
+        return sorted(unquote(p.stem) for p in self.dossier.glob("*/*.json"))
+
+    def __contains__(self, username: str) -> bool:
+        return username in self._cache or self._chemin(username).exists()
+
+    def lire(self, username: str):
+        from .users import User
+        user = self._cache.get(username)
+        if user is None:
+            data = self._lire_dict(username)
+            if data is None:
+                return None
+            user = self._cache[username] = User.from_dict(data)
+        return user
+
+    def retenir(self, user) -> None:
+        self._cache[user.username] = user
+
+    def ecrire(self, user) -> None:
+        self.ecrire_dict(user.to_dict())
+        self.retenir(user)
+
+    def ajouter_notification(self, username: str, message: str) -> None:
+        user = self._cache.get(username)
+        if user is not None:
+            user.notifications.append(message)
+            self.ecrire_dict(user.to_dict())
+            return
+        # patch the stored record without building a User
+        data = self._lire_dict(username)
+        if data is None:
+            from .users import User
+            data = User(username, "").to_dict()
+        data.setdefault("notifications", []).append(message)
+        self.ecrire_dict(data)
+
+    def __iter__(self) -> Iterator:
+        for username in self.noms():
+            try:
+                user = self.lire(username)
+            except Exception:
+                continue
+            if user is not None:
+                yield user
+
+    def tous(self) -> list:
+        return list(self)
+
+    def importer(self, users: list) -> None:
+        self.dossier.mkdir(parents=True, exist_ok=True)
+        for u in users:
+            self.ecrire(u)
+
+    def exporter(self, users_filepath: str | Path) -> None:
+        from .file_manager import BibliothequeAvecFichier
+        BibliothequeAvecFichier.sauvegarder_users(self.tous(), str(users_filepath))
@@ -4,6 +4,9 @@ from datetime import datetime, timedelta, date
 from typing import List, Optional
 import hashlib
 
+from .fragments import FragmentJSON
+from .prets import ArchivePrets, PretsUser
+
 
 SUBSCRIPTIONS = {
     # monthly_limit: maximum number of borrow operations allowed per calendar month (None = unlimited)
@@ -34,16 +37,27 @@ class Loan:
         d["date_retour_effective"] = self.date_retour_effective.isoformat() if self.date_retour_effective else None
         return d
 
+    @classmethod
+    def from_dict(cls, l: dict) -> "Loan":
+        loan = cls(l["isbn"], l.get("exemplaire_id"), date.fromisoformat(l["date_emprunt"]), date.fromisoformat(l["date_retour_prevue"]))
+        if l.get("date_retour_effective"):
+            loan.date_retour_effective = date.fromisoformat(l["date_retour_effective"])
+        loan.penalite_acquise = l.get("penalite_acquise", 0.0)
+        return loan
+
 
 @dataclass
 class Reservation:
     isbn: str
     exemplaire_id: Optional[str]
     date_reservation: date
+    # set while a copy (`exemplaire_id`) is held for this user
+    date_limite: Optional[date] = None
 
     def to_dict(self):
         d = asdict(self)
         d["date_reservation"] = self.date_reservation.isoformat()
+        d["date_limite"] = self.date_limite.isoformat() if self.date_limite else None
         return d
 
 
@@ -64,17 +78,24 @@ class Subscription:
 
 
 @dataclass
-class User:
+class User(FragmentJSON):
     username: str
     _pwd_hash: str
     is_admin: bool = False
     subscription: Subscription | None = None
-    loans: List[Loan] = field(default_factory=list)
+    # open loans by copy id, returned ones in a lazily decoded archive
+    loans: PretsUser = field(default_factory=PretsUser)
     reservations: List[Reservation] = field(default_factory=list)
     penalites: float = 0.0
     notifications: List[str] = field(default_factory=list)
     monthly_emprunts: int = 0
     last_reset: Optional[date] = None
+    # set by IndexPrets.suivre; kept out of to_dict/eq/repr
+    index_prets: Optional[object] = field(default=None, repr=False, compare=False)
+
+    def __post_init__(self):
+        if not isinstance(self.loans, PretsUser):
+            self.loans = PretsUser(self.loans)
 
     @classmethod
     def create(cls, username: str, password: str, subscription_type: str = "basique", is_admin: bool = False) -> "User":
@@ -114,6 +135,7 @@ class User:
         if not self.subscription:
             return None
         self.subscription.renew(extra_days)
+        self.marquer_modifie()
         return self.subscription.date_expiration
 
     def borrow(self, isbn: str, exemplaire_id: Optional[str] = None) -> Loan:
@@ -125,6 +147,8 @@ class User:
         loan = Loan(isbn, exemplaire_id, now, now + timedelta(days=duree))
         self.loans.append(loan)
         self.monthly_emprunts += 1
+        if self.index_prets is not None:
+            self.index_prets.ajouter(self.username, loan)
         return loan
 
     def return_loan(self, loan: Loan) -> float:
@@ -132,6 +156,10 @@ class User:
             return 0.0
         now = date.today()
         loan.date_retour_effective = now
+        self.marquer_modifie()
+        self.loans.clore(loan)
+        if self.index_prets is not None:
+            self.index_prets.retirer(self.username, loan)
         if now > loan.date_retour_prevue:
             jours_retard = (now - loan.date_retour_prevue).days
             sub_info = SUBSCRIPTIONS.get(self.subscription.type, SUBSCRIPTIONS["basique"])
@@ -146,13 +174,23 @@ class User:
         self.reservations.append(r)
         return r
 
+    def _empreinte(self):
+        # list counters catch appends/removals; in-place changes of a loan or
+        # the subscription go through `marquer_modifie` (the storage does it
+        # for every user it is asked to save)
+        sub = self.subscription
+        return (self.username, self._pwd_hash, self.is_admin, self.penalites, self.monthly_emprunts,
+                self.last_reset, id(sub), sub and (sub.type, sub.date_debut, sub.date_expiration),
+                id(self.loans), len(self.loans), id(self.reservations), len(self.reservations),
+                id(self.notifications), len(self.notifications))
+
     def to_dict(self):
         return {
             "username": self.username,
             "_pwd_hash": self._pwd_hash,
             "is_admin": self.is_admin,
             "subscription": self.subscription.to_dict() if self.subscription else None,
-            "loans": [l.to_dict() for l in self.loans],
+            "loans": self.loans.dicts(),
             "reservations": [r.to_dict() for r in self.reservations],
             "penalites": self.penalites,
             "notifications": list(self.notifications),
@@ -167,14 +205,14 @@ class User:
             sd = data["subscription"]
             sub = Subscription(sd["type"], date.fromisoformat(sd["date_debut"]), date.fromisoformat(sd["date_expiration"]))
         user = cls(data["username"], data.get("_pwd_hash", ""), is_admin=data.get("is_admin", False), subscription=sub)
-        for l in data.get("loans", []):
-            loan = Loan(l["isbn"], l.get("exemplaire_id"), date.fromisoformat(l["date_emprunt"]), date.fromisoformat(l["date_retour_prevue"]))
-            if l.get("date_retour_effective"):
-                loan.date_retour_effective = date.fromisoformat(l["date_retour_effective"])
-            loan.penalite_acquise = l.get("penalite_acquise", 0.0)
-            user.loans.append(loan)
+        # returned loans stay undecoded until the history is read
+        loans = data.get("loans", [])
+        user.loans = PretsUser((Loan.from_dict(l) for l in loans if not l.get("date_retour_effective")),
+                               ArchivePrets(l for l in loans if l.get("date_retour_effective")))
         for r in data.get("reservations", []):
             res = Reservation(r["isbn"], r.get("exemplaire_id"), date.fromisoformat(r["date_reservation"]))
+            if r.get("date_limite"):
+                res.date_limite = date.fromisoformat(r["date_limite"])
             user.reservations.append(res)
         user.penalites = data.get("penalites", 0.0)
         user.notifications = data.get("notifications", [])
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 
@@ -11,3 +12,21 @@ def get_data_dir() -> Path:
     p = get_project_root() / "data"
     p.mkdir(parents=True, exist_ok=True)
     return p
+
+
+def fsync_dossier(path: str | Path) -> None:
+    """Make the entries of directory `path` (renames, creations) durable.
+
+    Not possible on Windows, where `os.replace` is already durable once the
+    file itself has been flushed.
+    """
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,90 @@
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from .exceptions import ErreurFichier
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+
+class VerrouFichier:
+    """Advisory lock shared by every process working on one `bib.json`.
+
+    The lock is taken on `<bib>.lock` (`fcntl.flock`; on Windows an
+    exclusive `msvcrt` byte lock serves both modes). Each acquisition opens
+    its own descriptor, so two threads of one process exclude each other
+    too. The file holds the snapshot generation: the number of checkpoints
+    folded into `bib.json`, bumped under the exclusive lock by whoever
+    rewrites the snapshot.
+    """
+
+    def __init__(self, filepath: str | Path):
+        self.path = Path(filepath)
+
+    @staticmethod
+    def chemin_pour(bib_filepath: str | Path) -> Path:
+        return Path(str(bib_filepath) + ".lock")
+
+    @contextmanager
+    def _tenir(self, exclusif: bool) -> Iterator["_Tenu"]:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            raise ErreurFichier(f"Impossible d'ouvrir le verrou '{self.path}': {e}")
+        try:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX if exclusif else fcntl.LOCK_SH)
+                elif msvcrt is not None:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            except OSError as e:
+                raise ErreurFichier(f"Impossible de verrouiller '{self.path}': {e}")
+            yield _Tenu(fd)
+        finally:
+            # closing the descriptor releases the lock
+            if fcntl is None and msvcrt is not None:
+                try:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+                except OSError:
+                    pass
+            os.close(fd)
+
+    def exclusif(self):
+        return self._tenir(True)
+
+    def partage(self):
+        return self._tenir(False)
+
+    def generation(self) -> int:
+        with self.partage() as tenu:
+            return tenu.generation()
+
+
+class _Tenu:
+    # the held lock: reads and bumps the generation stored in the file
+    def __init__(self, fd: int):
+        self._fd = fd
+
+    def generation(self) -> int:
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        texte = os.read(self._fd, 32).decode("ascii", "replace").strip()
+        return int(texte) if texte.isdigit() else 0
+
+    def incrementer(self) -> int:
+        # only under the exclusive lock
+        n = self.generation() + 1
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.ftruncate(self._fd, 0)
+        os.write(self._fd, f"{n}\n".encode("ascii"))
+        os.fsync(self._fd)
+        return n
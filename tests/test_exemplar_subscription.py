@@ -1,7 +1,7 @@
 from datetime import date, timedelta
 
 from src.models import Bibliotheque
-from src.users import User
+from src.users import Loan, User
 
 
 def test_exemplar_status_and_counts():
@@ -32,3 +32,143 @@ def test_subscription_renew_and_can_borrow():
     assert new_exp == u.subscription.date_expiration
     assert u.subscription.date_expiration >= date.today()
     assert u.can_borrow() is True
+
+
+def test_exemplar_index_follows_mutations(tmp_path):
+    b = Bibliotheque("Index")
+    b.ajouter_exemplaire("Titre1", "Auteur1", "ISBN-1", "ex1")
+    b.ajouter_exemplaires_bulk("Titre1", "Auteur1", "ISBN-1", 2)
+    assert b.trouver_livre("ISBN-1").nb_exemplaire == 3
+
+    b.trim_exemplaires(1)
+    assert b.find_exemplar_by_id("ex1") is not None
+    assert len(b._par_exemplaire) == 1
+
+    p = tmp_path / "idx.json"
+    b.sauvegarder(str(p))
+    b2 = Bibliotheque("Reloaded")
+    b2.charger(str(p))
+    assert b2.find_exemplar_by_id("ex1").ISBN == "ISBN-1"
+
+    assert b2.supprimer_livre("ISBN-1") is True
+    assert b2.find_exemplar_by_id("ex1") is None
+    assert b2.trouver_exemplaires("ISBN-1") == []
+
+
+def test_compact_store_counters_and_dict_view():
+    b = Bibliotheque("Compact")
+    b.ajouter_exemplaires_bulk("T", "A", "ISBN-C", 3)
+    livre = b.trouver_livre("ISBN-C")
+    first = livre.exemplaires_details[0]["exemplaire_id"]
+
+    assert b.set_exemplaire_status(first, "perdu") is True
+    assert livre.disponibles == 2
+    assert b.get_exemplar_statuses("ISBN-C") == {"disponible": 2, "perdu": 1, "total": 3}
+    assert b.find_exemplar_by_id(first).etat == "perdu"
+    assert livre.to_dict()["exemplaires_details"][0] == {"exemplaire_id": first, "etat": "perdu"}
+
+
+def test_borrow_and_return_on_aggregate_only_title():
+    from src.models import Livre
+
+    b = Bibliotheque("Aggregat")
+    b.ajouter_livre(Livre("T", "A", "ISBN-A", total=2, disponibles=2))
+    u = User.create("reader", "pwd")
+    b.emprunter_exemplaire("ISBN-A", u)
+    livre = b.trouver_livre("ISBN-A")
+    assert (livre.nb_exemplaire, livre.disponibles) == (2, 1)
+
+    b.retourner_exemplaire(u.loans[0].exemplaire_id, u)
+    assert livre.disponibles == 2
+
+
+def test_loan_index_tracks_overdue_and_active_users():
+    b = Bibliotheque("Echeances")
+    for i in range(3):
+        b.ajouter_exemplaire(f"T{i}", "A", f"I{i}", f"ex{i}")
+    alice = User.create("alice", "pwd")
+    bob = User.create("bob", "pwd")
+    # a loan loaded from disk, already late
+    bob.loans.append(Loan("I9", "old", date.today() - timedelta(days=30), date.today() - timedelta(days=2)))
+    assert b.stats([alice, bob])["overdue_loans"] == 1
+
+    b.emprunter_exemplaire("I0", alice)
+    b.emprunter_exemplaire("I1", alice)
+    assert b.stats([alice, bob])["active_users"] == 2
+    assert b.prets.prets_actifs("alice") == 2
+    assert [l.exemplaire_id for _, l in b.prets.prochaines_echeances(5)] == ["ex0", "ex1"]
+
+    # both new loans fall due within the next 60 days
+    assert b.prets.nb_en_retard(date.today() + timedelta(days=60)) == 3
+    b.retourner_exemplaire("ex0", alice)
+    b.retourner_exemplaire("ex1", alice)
+    assert b.stats([alice, bob])["active_users"] == 1
+    assert [u for u, _ in b.prets.en_retard()] == ["bob"]
+    assert b.prets.en_retard(n=0) == [] and b.prets.en_retard(n=5) == b.prets.en_retard()
+
+
+def test_popularity_windows_and_top_k():
+    from src.popularite import Popularite
+
+    b = Bibliotheque("Popularite")
+    b.ajouter_exemplaire("Dune", "Herbert", "I1", "ex1")
+    b.ajouter_exemplaire("Emma", "Austen", "I2", "ex2")
+    today = date.today()
+    b.trouver_livre("I2").history = [
+        {"username": "old", "date_emprunt": (today - timedelta(days=d)).isoformat()} for d in (3, 40, 400)
+    ]
+    b.livres = list(b.livres)  # reload: rebuilt from history
+
+    alice = User.create("alice", "pwd")
+    b.emprunter_exemplaire("I1", alice)
+    b.retourner_exemplaire("ex1", alice)
+    b.emprunter_exemplaire("I1", alice)
+    stats = b.stats()
+    assert stats["popular_books"] == [("I2", "Emma", 3), ("I1", "Dune", 2)]
+    assert stats["popular_by_window"][7] == [("I1", "Dune", 2), ("I2", "Emma", 1)]
+    assert b.popularite.compte("I2", fenetre=365) == 2
+
+    # windows slide as days pass
+    pop = Popularite.depuis_historique(b.livres)
+    assert pop.top(5, fenetre=30, aujourdhui=today + timedelta(days=28)) == [("I1", 2)]
+    assert pop.top(5, fenetre=7, aujourdhui=today + timedelta(days=30)) == []
+    assert pop.top(5) == [("I2", 3), ("I1", 2)]
+
+
+def test_user_directory_lookups_follow_the_list():
+    from src.annuaire import AnnuaireUsers
+
+    users = AnnuaireUsers(User(n, "") for n in ("alice", "Albert", "bob", "ALBAN"))
+    assert users.get("alice").username == "alice" and users.get("Alice") is None
+    assert users.trouver("Alice").username == "alice" and users.trouver("alban").username == "ALBAN"
+    assert users.existe("BOB") and not users.existe("carol")
+    assert [u.username for u in users.rechercher("al")] == ["ALBAN", "Albert", "alice"]
+
+    users.append(User("alberte", ""))
+    users.remove(users.get("Albert"))
+    assert [u.username for u in users.rechercher("ALB")] == ["ALBAN", "alberte"]
+    assert users.trouver("albert") is None and len(users) == 4
+    # names folding together are only found by their exact spelling
+    users.append(User("Alice", ""))
+    assert users.trouver("ALICE") is None and users.trouver("Alice").username == "Alice"
+    del users[:]
+    assert users.rechercher("") == [] and users.get("bob") is None
+
+
+def test_returned_loans_move_to_a_lazy_archive():
+    b = Bibliotheque("Archive")
+    for exid in ("ex1", "ex2", "ex3"):
+        b.ajouter_exemplaire("T", "A", "I1", exid)
+    u = User.create("u", "pwd")
+    for _ in range(3):
+        b.emprunter_exemplaire("I1", u)
+    b.retourner_exemplaire("ex2", u)
+    assert [l.exemplaire_id for l in u.loans.en_cours()] == ["ex1", "ex3"]
+    assert [l.exemplaire_id for l in u.loans.archive] == ["ex2"] and len(u.loans) == 3
+
+    relu = User.from_dict(u.to_dict())
+    assert not relu.loans.archive.decodee and relu.to_dict() == u.to_dict()
+    assert sorted(relu.loans.isbns()) == ["I1"] * 3 and relu.loans.en_cours_pour("ex2") is None
+    b.retourner_exemplaire("ex1", relu)
+    assert not relu.loans.archive.decodee and [l.exemplaire_id for l in relu.loans.en_cours()] == ["ex3"]
+    assert [l.exemplaire_id for l in relu.loans.archive] == ["ex2", "ex1"] and relu.loans.archive.decodee
@@ -0,0 +1,281 @@
+import io
+import json
+
+import pytest
+
+from src.exceptions import ErreurFichier
+from src.file_manager import BibliothequeAvecFichier
+from src.json_stream import LecteurJSON
+from src.models import Livre, LivreNumerique
+
+
+def _demo(tmp_path):
+    b = BibliothequeAvecFichier("Flux")
+    b.ajouter_livre(Livre("T1", "A1", "I1"))
+    b.ajouter_livre(LivreNumerique("T2", "A2", "I2", "1MB"))
+    b.ajouter_exemplaire("T3", "A3", "I3", "ex1", genre="Roman")
+    b.ajouter_exemplaire("T3", "A3", "I3", "ex2")
+    b.reservations["I3"] = ["alice", "bob"]
+    p = tmp_path / "bib.json"
+    b.sauvegarder(str(p))
+    return p
+
+
+def test_streaming_load_matches_json_load(tmp_path):
+    p = _demo(tmp_path)
+    a = BibliothequeAvecFichier("A")
+    a.charger(str(p))
+    s = BibliothequeAvecFichier("S")
+    s.charger(str(p), streaming=True)
+    assert [l.to_dict() for l in s.livres] == [l.to_dict() for l in a.livres]
+    assert s.reservations == a.reservations
+    assert s.exemplaires == a.exemplaires
+    assert s.find_exemplar_by_id("ex2").ISBN == "I3"
+
+
+def test_lecteur_handles_values_split_across_blocks():
+    doc = {"livres": [{"n": 12345, "s": "x" * 50}] * 5, "autre": [1, 2.5, None, True]}
+    lecteur = LecteurJSON(io.StringIO(json.dumps(doc, indent=2)), taille_bloc=7)
+    seen = {}
+    for cle in lecteur.iter_objet():
+        seen[cle] = list(lecteur.iter_tableau())
+    assert seen == doc
+
+
+def test_streaming_load_rejects_truncated_file(tmp_path):
+    p = tmp_path / "broken.json"
+    p.write_text('{"livres": [{"titre": "T"', encoding="utf-8")
+    with pytest.raises(ErreurFichier):
+        BibliothequeAvecFichier("X").charger(str(p), streaming=True)
+
+
+def test_snapshot_reuses_clean_records(tmp_path):
+    from src.users import User
+
+    p = _demo(tmp_path)
+    b = BibliothequeAvecFichier("Cache")
+    b.charger(str(p))
+    alice = User.create("alice", "pwd")
+    bib_data, _ = b.donnees_snapshot([alice])
+    assert not any(l.modifie for l in b.livres) and not alice.modifie
+
+    livre = b.emprunter_exemplaire("I3", alice)
+    assert livre.modifie and alice.modifie
+    assert not b.trouver_livre("I1").modifie
+    b.add_review("I1", "alice", 5)
+    b.trouver_livre("I2").titre = "Autre"
+    assert all(l.modifie for l in b.livres)
+
+    # same bytes as encoding everything again
+    b.checkpoint([alice], str(p), str(tmp_path / "users.json"))
+    data = json.loads(p.read_text(encoding="utf-8"))
+    assert data["livres"] == [l.to_dict() for l in b.livres]
+    assert p.read_text(encoding="utf-8") == json.dumps(
+        dict(data, livres=[l.to_dict() for l in b.livres]), ensure_ascii=False, indent=2)
+
+
+def test_binary_snapshot_round_trip(tmp_path):
+    from src.snapshot_binaire import convertir
+    from src.users import User
+
+    p = _demo(tmp_path)
+    b = BibliothequeAvecFichier("Source")
+    b.charger(str(p))
+    alice = User.create("alice", "pwd")
+    b.reservations["I3"] = ["alice", "bob"]
+    b.emprunter_exemplaire("I3", alice)
+    b.set_exemplaire_status("ex2", "endommage")
+    b.add_review("I2", "alice", 4, "é, \x00 et 𝄞")
+    b.trouver_livre("I1").history.append({"username": "bob", "note": [1, 2.5, None, True, 2 ** 70]})
+    bin_p = tmp_path / "bib.bin"
+    b.sauvegarder_binary(str(bin_p))
+
+    for c in (BibliothequeAvecFichier("B"), BibliothequeAvecFichier("C")):
+        c.charger(str(bin_p))  # format detected from the header
+        assert [l.to_dict() for l in c.livres] == [l.to_dict() for l in b.livres]
+        assert c.reservations == b.reservations and c.exemplaires.keys() == {"I1", "I2", "I3"}
+        assert c.trouver_livre("I3").exemplaires_stock.statuts() == {"emprunte": 1, "endommage": 1}
+        assert c.find_exemplar_by_id("ex2").etat == "endommage"
+
+    convertir(bin_p, tmp_path / "retour.json")
+    d = BibliothequeAvecFichier("D")
+    d.charger(str(tmp_path / "retour.json"))
+    assert [l.to_dict() for l in d.livres] == [l.to_dict() for l in b.livres]
+
+
+def test_mapped_catalogue_lookups(tmp_path):
+    from src.catalogue_mappe import CatalogueMappe
+
+    b = BibliothequeAvecFichier("Kiosque")
+    b.charger(str(_demo(tmp_path)))
+    b.ajouter_livre(Livre("T4", "A4", "I0"))
+    b.ajouter_livre(Livre("T1 bis", "A1", "I1"))
+    b.set_exemplaire_status("ex1", "perdu")
+    bin_p = tmp_path / "bib.bin"
+    b.sauvegarder_binary(str(bin_p))
+
+    with CatalogueMappe(bin_p) as cat:
+        assert len(cat) == 5
+        assert [l.titre for l in cat.trouver_exemplaires("I1")] == ["T1", "T1 bis"]
+        assert cat.trouver_livre("I3").to_dict() == b.trouver_livre("I3").to_dict()
+        assert cat.trouver_livre("I9") is None and cat.trouver_exemplaires("I") == []
+        for isbn in ("I1", "I2", "I3", "I9"):
+            assert cat.get_exemplar_statuses(isbn) == b.get_exemplar_statuses(isbn)
+        assert cat.get_reservations("I3") == ["alice", "bob"]
+        assert [l.ISBN for l in cat.rechercher_isbn("I")] == ["I0", "I1", "I1", "I2", "I3"]
+        assert [l.to_dict() for l in cat] == [l.to_dict() for l in b.livres]
+    with pytest.raises(ErreurFichier):
+        CatalogueMappe(tmp_path / "bib.json")
+
+
+def test_csv_import_merges_by_isbn(tmp_path):
+    b = BibliothequeAvecFichier("Import")
+    b.charger(str(_demo(tmp_path)))
+    csv_p = tmp_path / "fonds.csv"
+    csv_p.write_text(
+        "ISBN,titre,auteur,exemplaire_id,etat,genre\n"
+        "I3,T3,A3,ex3,,\n"              # new copy of a known title
+        "I5 ,Nouveau,A5,n1,emprunte,SF\n"
+        "I5,Nouveau,A5,n2,,\n"
+        "I5,Nouveau,A5,n1,,\n"          # duplicate copy id
+        ",Sans ISBN,A,x9,,\n"
+        "I6,,A6,x6,,\n"                 # new ISBN without a title
+        "I7,Sept,A7,x7,vole,\n"
+        "I1,T1,A1,,,\n"                 # title already there
+        "\n",
+        encoding="utf-8",
+    )
+    rapport = b.import_csv(str(csv_p), taille_lot=3)
+    assert (rapport.lignes, rapport.livres_crees, rapport.exemplaires_ajoutes, rapport.ignorees) == (8, 1, 3, 1)
+    assert sorted(n for n, _ in rapport.erreurs) == [5, 6, 7, 8] and rapport.nb_erreurs == 4
+    assert b.get_exemplar_statuses("I5") == {"emprunte": 1, "disponible": 1, "total": 2}
+    assert b.find_exemplar_by_id("ex3").ISBN == "I3" and b.trouver_livre("I5").genre == "SF"
+    assert len(b.trouver_exemplaires("I3")) == 1 and b.rechercher(titre="nouveau")[0].ISBN == "I5"
+
+    # the export format re-imports without duplicating anything; reading
+    # (the GUI's worker half) leaves the catalogue alone
+    from src.import_csv import RapportImport, fusionner_csv, lire_csv
+    b.export_csv(str(tmp_path / "export.csv"))
+    avant = [l.to_dict() for l in b.livres]
+    rapport = RapportImport()
+    lots = lire_csv(str(tmp_path / "export.csv"), rapport, taille_lot=2)
+    premier = next(lots)
+    assert [l.to_dict() for l in b.livres] == avant and rapport.lignes == len(premier) == 2
+    fusionner_csv(b, premier, rapport)
+    for groupes in lots:
+        fusionner_csv(b, groupes, rapport)
+    assert rapport.livres_crees == 0 and rapport.ignorees == rapport.lignes == len(b.livres)
+
+
+def test_export_modes_and_formats(tmp_path):
+    import csv
+    import gzip
+    from src.users import User
+
+    b = BibliothequeAvecFichier("Export")
+    b.charger(str(_demo(tmp_path)))
+    alice = User.create("alice", "pwd")
+    b.emprunter_exemplaire("I3", alice)
+    b.add_review("I1", "bob", 5, 'très "bien"')
+
+    p = tmp_path / "titres.csv"
+    assert b.exporter(str(p)) == 3
+    assert p.read_text(encoding="utf-8").splitlines()[:2] == ["type,titre,auteur,ISBN,taille_fichier", "Livre,T1,A1,I1,"]
+
+    p = tmp_path / "ex.csv.gz"
+    assert b.exporter(str(p), mode="exemplaires", colonnes=["exemplaire_id", "etat"]) == 2
+    with gzip.open(p, "rt", encoding="utf-8", newline="") as f:
+        assert list(csv.reader(f)) == [["exemplaire_id", "etat"], ["ex1", "emprunte"], ["ex2", "disponible"]]
+
+    p = tmp_path / "prets.jsonl"
+    assert b.exporter(str(p), mode="prets", users=[alice]) == 1
+    pret = json.loads(p.read_text(encoding="utf-8"))
+    assert pret["username"] == "alice" and pret["exemplaire_id"] == "ex1" and pret["date_retour_effective"] is None
+    # without users, loans come from the books' history
+    assert b.exporter(str(tmp_path / "h.jsonl"), mode="prets") == 1
+
+    b.exporter(str(tmp_path / "avis.jsonl.gz"), mode="avis")
+    with gzip.open(tmp_path / "avis.jsonl.gz", "rt", encoding="utf-8") as f:
+        assert [json.loads(l) for l in f] == [{"ISBN": "I1", "username": "bob", "rating": 5, "comment": 'très "bien"'}]
+
+    with pytest.raises(ValueError):
+        b.exporter(str(tmp_path / "x.csv"), mode="titres", colonnes=["ISBN", "inconnue"])
+    assert not (tmp_path / "x.csv").exists()
+
+
+def test_snapshot_commit_recovers_after_crash(tmp_path, monkeypatch):
+    import src.file_manager as fm
+    from src.users import User
+
+    bib_p, users_p = tmp_path / "d" / "bib.json", tmp_path / "d" / "users.json"
+    b = BibliothequeAvecFichier("Commit")
+    b.charger(str(_demo(tmp_path)))
+    alice = User.create("alice", "pwd")
+    b.checkpoint([alice], str(bib_p), str(users_p))
+    avant = bib_p.read_text(encoding="utf-8"), users_p.read_text(encoding="utf-8")
+    b.emprunter_exemplaire("I3", alice)
+
+    # crash before the commit record: nothing changes, no temp file is left
+    monkeypatch.setattr(fm, "_ecrire_commit", lambda *a: 1 / 0)
+    with pytest.raises(ErreurFichier):
+        b.sauvegarder_transactionnel([alice], str(bib_p), str(users_p))
+    assert (bib_p.read_text(encoding="utf-8"), users_p.read_text(encoding="utf-8")) == avant
+    assert sorted(p.name for p in bib_p.parent.iterdir()) == ["bib.json", "bib.json.lock", "users.json"]
+    monkeypatch.undo()
+
+    # crash after it: the next load finishes both renames
+    monkeypatch.setattr(fm, "_appliquer_commit", lambda *a: 1 / 0)
+    with pytest.raises(ErreurFichier):
+        b.sauvegarder_transactionnel([alice], str(bib_p), str(users_p))
+    assert bib_p.read_text(encoding="utf-8") == avant[0]
+    monkeypatch.undo()
+    relu = BibliothequeAvecFichier("Relu")
+    relu.charger(str(bib_p))
+    assert not BibliothequeAvecFichier.chemin_commit(str(bib_p)).exists()
+    assert relu.get_exemplar_statuses("I3") == b.get_exemplar_statuses("I3")
+    assert BibliothequeAvecFichier.charger_users(str(users_p))[0].loans[0].isbn == "I3"
+
+
+def test_old_history_moves_to_monthly_archives(tmp_path):
+    from datetime import date, timedelta
+    from src.archives import ArchiveHistorique
+    from src.users import Loan, User
+
+    bib_p, users_p = tmp_path / "bib.json", tmp_path / "users.json"
+    b = BibliothequeAvecFichier("Archives")
+    b.charger(str(_demo(tmp_path)))
+    alice = User.create("alice", "pwd")
+    vieux = date.today() - timedelta(days=1000)
+    for jours in (0, 40):
+        d = vieux + timedelta(days=jours)
+        loan = Loan("I1", "x", d, d + timedelta(days=14), d + timedelta(days=7))
+        alice.loans.append(loan)
+        b.trouver_livre("I1").history.append(dict(loan.to_dict(), username="alice"))
+    b.emprunter_exemplaire("I3", alice)
+    b.checkpoint([alice], str(bib_p), str(users_p))
+
+    with pytest.raises(ValueError):
+        b.archiver_historique([alice], str(bib_p), str(users_p), avant=date.today())
+    assert b.archiver_historique([alice], str(bib_p), str(users_p)) == 4
+    mois = sorted(p.name for p in ArchiveHistorique.chemin_pour(bib_p).glob("*.gz"))
+    assert len(mois) == 2 and mois[0] == f"{vieux:%Y-%m}.jsonl.gz"
+    assert b.trouver_livre("I1").history == [] and [l.isbn for l in alice.loans] == ["I3"]
+
+    relu = BibliothequeAvecFichier("Relu")
+    relu.charger(str(bib_p))
+    [alice2] = BibliothequeAvecFichier.charger_users(str(users_p))
+    assert relu.trouver_livre("I1").history == [] and len(alice2.loans) == 1
+    assert relu.archive.compte_livre("I1") == 2 and relu.archive.compte_user("alice") == 2
+    assert relu.popularite.compte("I1") == 2 and relu.popularite.compte("I1", fenetre=365) == 0
+    # the archived count leaves and comes back with the ISBN
+    image = [l.to_dict() for l in relu.trouver_exemplaires("I1")]
+    while relu.supprimer_livre("I1"):
+        pass
+    assert relu.popularite.compte("I1") == 0
+    for d in image:
+        relu._ajouter_au_catalogue(relu._livre_depuis_dict(d))
+    assert relu.popularite.compte("I1") == 2
+    assert [h["date_emprunt"] for h in relu.archive.historique_livre("I1")] == [vieux.isoformat(), (vieux + timedelta(days=40)).isoformat()]
+    assert [d["date_retour_effective"] for d in relu.archive.prets_user("alice")][0] == (vieux + timedelta(days=7)).isoformat()
+    # nothing left to move the second time
+    assert relu.archiver_historique([alice2], str(bib_p), str(users_p)) == 0
@@ -0,0 +1,71 @@
+from src.file_manager import BibliothequeAvecFichier
+from src.journal import Journal
+from src.users import User
+
+
+def _setup(tmp_path):
+    bib_p = tmp_path / "bib.json"
+    users_p = tmp_path / "users.json"
+    b = BibliothequeAvecFichier("Journal")
+    b.ajouter_exemplaire("T1", "A1", "I1", "ex1")
+    b.ajouter_exemplaire("T2", "A2", "I2", "ex2")
+    alice = User.create("alice", "pwd")
+    b.ouvrir_journal(str(bib_p))
+    b.checkpoint([alice], str(bib_p), str(users_p))
+    return b, alice, bib_p, users_p
+
+
+def test_mutations_are_replayed_on_top_of_snapshot(tmp_path):
+    b, alice, bib_p, users_p = _setup(tmp_path)
+    b.emprunter_exemplaire("I1", alice)
+    b.journaliser(isbns=["I1"], reservations=["I1"], users=[alice])
+    b.supprimer_livre("I2")
+    b.journaliser(isbns=["I2"])
+
+    # snapshots are untouched; only the journal grew
+    assert len(Journal(Journal.chemin_pour(bib_p))) == 4
+
+    b2 = BibliothequeAvecFichier("Reloaded")
+    b2.charger(str(bib_p))
+    users = BibliothequeAvecFichier.charger_users(str(users_p), journal=Journal(Journal.chemin_pour(bib_p)))
+    assert b2.get_exemplar_statuses("I1").get("emprunte") == 1
+    assert b2.trouver_livre("I2") is None
+    assert [l.exemplaire_id for l in users[0].loans] == ["ex1"]
+
+
+def test_checkpoint_folds_journal_and_ignores_torn_tail(tmp_path):
+    b, alice, bib_p, users_p = _setup(tmp_path)
+    b.add_review("I1", "alice", 5)
+    b.journaliser(isbns=["I1"])
+    jp = Journal.chemin_pour(bib_p)
+    with jp.open("a", encoding="utf-8") as f:
+        f.write('{"op":"livre","ISBN":"I1","data":[')
+
+    b2 = BibliothequeAvecFichier("Reloaded")
+    b2.charger(str(bib_p))
+    assert len(b2.trouver_livre("I1").reviews) == 1
+
+    b.checkpoint([alice], str(bib_p), str(users_p))
+    assert not Journal(jp).existe()
+    b3 = BibliothequeAvecFichier("Snapshot")
+    b3.charger(str(bib_p))
+    assert len(b3.trouver_livre("I1").reviews) == 1
+
+
+def test_appends_after_a_torn_tail_are_kept(tmp_path):
+    journal = Journal(tmp_path / "bib.json.journal")
+    journal.ajouter({"op": "livre", "ISBN": "A", "data": []})
+    with journal.path.open("a", encoding="utf-8") as f:
+        f.write('{"op":"reserv')
+    assert journal.taille() == len(journal.path.read_bytes()) - len('{"op":"reserv')
+    journal.ajouter({"op": "livre", "ISBN": "B", "data": []})
+    journal.ajouter({"op": "livre", "ISBN": "C", "data": []})
+    assert [r["ISBN"] for r in journal.lire()] == ["A", "B", "C"]
+    assert [r["ISBN"] for _, r in journal.lire_depuis(0)] == ["A", "B", "C"]
+
+    # a complete line that does not decode is skipped, not the end of the journal
+    with journal.path.open("a", encoding="utf-8") as f:
+        f.write('{"op":\n')
+    journal.ajouter({"op": "livre", "ISBN": "D", "data": []})
+    assert [r["ISBN"] for r in journal.lire()] == ["A", "B", "C", "D"]
+    assert [fin for fin, _ in journal.lire_depuis(0)][-1] == journal.taille()
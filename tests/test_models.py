@@ -1,4 +1,7 @@
 import json
+
+import pytest
+
 from src.models import Livre, LivreNumerique, Bibliotheque
 
 def test_livre_to_dict():
@@ -27,3 +30,145 @@ def test_bibliotheque_crud(tmp_path):
     b2 = Bibliotheque("Reloaded")
     b2.charger(str(p))
     assert any(l.ISBN == "I2" for l in b2.livres)
+
+def test_recommendations_use_co_borrows_then_genres():
+    b = Bibliotheque("Reco")
+    for isbn, genre in (("A", "SF"), ("B", "SF"), ("C", "Roman"), ("D", "Roman"), ("E", "SF")):
+        b.ajouter_exemplaire(f"T{isbn}", "X", isbn, f"ex{isbn}", genre=genre)
+    # other readers borrowed A together with C
+    b.trouver_livre("A").history = [{"username": u} for u in ("u1", "u2")]
+    b.trouver_livre("C").history = [{"username": u} for u in ("u1", "u2")]
+    b.trouver_livre("B").history = [{"username": "me"}, {"username": "u1"}]
+    b.livres = list(b.livres)
+
+    class Lecteur:
+        username = "me"
+        loans = []
+
+    recs = [l.ISBN for l in b.recommend_for_user(Lecteur(), limit=3)]
+    assert recs == ["A", "C", "E"]
+    assert b.recommandation.voisins["A"] == [("C", 1.0), ("B", 0.5)]
+
+    # unknown reader: previous catalogue-order fallback
+    class Inconnu:
+        username = "new"
+        loans = []
+
+    assert [l.ISBN for l in b.recommend_for_user(Inconnu(), limit=2)] == ["A", "B"]
+
+    # removing or adding one book (journal replay, sync) updates the engine in place
+    from src.recommandation import MoteurRecommandation
+    moteur = b.recommandation
+    b.supprimer_livre("C")
+    assert b.recommandation is moteur and moteur.voisins["A"] == [("B", 0.5)]
+    b.ajouter_exemplaire("TF", "X", "F", "exF", genre="Roman")
+    assert b.recommandation is moteur
+    assert moteur.voisins == MoteurRecommandation(b.livres).voisins
+    assert [l.ISBN for l in moteur.par_genre["Roman"]] == ["D", "F"]
+
+
+def test_reservation_queues_and_positions():
+    from src.file_manager import BibliothequeAvecFichier
+    from src.users import User
+
+    b = BibliothequeAvecFichier("Files")
+    b.ajouter_exemplaire("Dune", "Herbert", "I1", "ex1")
+    users = [User.create(n, "pwd") for n in ("a", "b", "c", "d")]
+    for u in users:
+        assert b.reserver_livre("I1", user_obj=u)
+    assert not b.reserver_livre("I1", username="b")
+    b.reserver_livre("I2", user_obj=users[2])
+    assert b.reservations == {"I1": ["a", "b", "c", "d"], "I2": ["c"]}
+    assert b.reservations.de_user("c") == {"I1": 2, "I2": 0}
+
+    b.annuler_reservation("I1", user_obj=users[1])
+    assert [b.position_reservation("I1", n) for n in "abcd"] == [0, None, 1, 2]
+    b.emprunter_exemplaire("I1", users[0])
+    assert b.get_reservations("I1") == ["c", "d"] and b.position_reservation("I1", "d") == 1
+    b.reservations["I1"].append("b")
+    assert b.reservations.de_user("b") == {"I1": 2}
+
+    # unknown users leave every queue; users' own reservations are queued
+    b.reservations["I3"] = ["zed", "d"]
+    b.reconcile_reservations(users[2:])
+    assert b.reservations == {"I1": ["c", "d"], "I2": ["c"], "I3": ["d"]}
+    assert b.reservations.utilisateurs() == {"c", "d"}
+    del b.reservations["I3"]
+    assert b.reservations.de_user("d") == {"I1": 1}
+
+
+def test_returned_copy_is_held_then_passed_on():
+    from datetime import date, timedelta
+    from src.file_manager import BibliothequeAvecFichier
+    from src.users import User
+
+    b = BibliothequeAvecFichier("Retenues")
+    b.ajouter_exemplaire("Dune", "Herbert", "I1", "ex1")
+    b.ajouter_exemplaire("Dune", "Herbert", "I1", "ex2")
+    a, bob, c = (User.create(n, "pwd") for n in ("a", "bob", "c"))
+    b.emprunter_exemplaire("I1", a)
+    b.emprunter_exemplaire("I1", a)
+    for u in (bob, c):
+        b.reserver_livre("I1", user_obj=u)
+
+    b.retourner_exemplaire("ex1", a)
+    aujourdhui = date.today()
+    assert b.find_exemplar_by_id("ex1").etat == "reserve" and b.trouver_livre("I1").disponibles == 0
+    assert (bob.reservations[0].exemplaire_id, bob.reservations[0].date_limite) == ("ex1", aujourdhui + timedelta(days=3))
+    with pytest.raises(ValueError):
+        b.emprunter_exemplaire("I1", c)
+
+    # the hold lapses the day after its deadline and goes to the next user
+    assert b.expirer_retenues(aujourdhui + timedelta(days=3)) == []
+    [(perdue, suivante)] = b.expirer_retenues(aujourdhui + timedelta(days=4))
+    assert perdue.username == "bob" and suivante.username == "c" and suivante.exemplaire_id == "ex1"
+    assert b.get_reservations("I1") == ["c"] and bob.reservations == []
+
+    # holds are found again from the saved users
+    relus = [User.from_dict(u.to_dict()) for u in (a, bob, c)]
+    assert b.reprendre_retenues(relus) == []
+    assert b.retenues.pour("I1", "c").jusqu_au == aujourdhui + timedelta(days=7)
+    b.emprunter_exemplaire("I1", relus[2])
+    assert b.find_exemplar_by_id("ex1").etat == "emprunte" and b.get_reservations("I1") == []
+    assert relus[2].reservations == [] and len(b.retenues) == 0
+
+
+def test_holds_go_with_deleted_copies():
+    from datetime import date
+    from src.file_manager import BibliothequeAvecFichier
+    from src.journal import Journal
+    from src.retenues import Retenue
+    from src.users import User
+
+    b = BibliothequeAvecFichier("Retenues")
+    b.ajouter_exemplaire("Dune", "Herbert", "I1", "ex1")
+    b.ajouter_exemplaire("Dune", "Herbert", "I1", "ex2")
+    a, bob = User.create("a", "pwd"), User.create("bob", "pwd")
+    b.emprunter_exemplaire("I1", a)
+    b.emprunter_exemplaire("I1", a)
+    b.reserver_livre("I1", user_obj=bob)
+
+    # installing another desk's image of the same copies keeps the hold
+    b.retourner_exemplaire("ex2", a)
+    Journal.appliquer_images(b, livres={"I1": [l.to_dict() for l in b.trouver_exemplaires("I1")]})
+    assert b.retenues.pour("I1", "bob").exemplaire_id == "ex2"
+
+    b.trim_exemplaires(1)
+    assert len(b.retenues) == 0 and bob.reservations[0].exemplaire_id is None
+    with pytest.raises(ValueError):
+        b.emprunter_exemplaire("I1", bob)
+    assert b.get_reservations("I1") == ["bob"]
+
+    b.retourner_exemplaire("ex1", a)
+    assert b.retenues.pour("I1", "bob").exemplaire_id == "ex1"
+    assert b.supprimer_livre("I1")
+    assert len(b.retenues) == 0
+    with pytest.raises(ValueError):
+        b.emprunter_exemplaire("I1", bob)
+
+    # a hold left on a copy that is gone is dropped by the borrow
+    b.ajouter_exemplaire("Dune", "Herbert", "I1", "ex3")
+    b.retenues.ajouter(Retenue("I1", "ex2", "bob", date.today()))
+    assert b.emprunter_exemplaire("I1", bob).ISBN == "I1"
+    assert len(b.retenues) == 0 and b.find_exemplar_by_id("ex3").etat == "emprunte"
+
@@ -0,0 +1,31 @@
+from src.models import Bibliotheque, Livre
+
+
+def _biblio():
+    b = Bibliotheque("Recherche")
+    b.ajouter_exemplaire("Les Misérables", "Victor Hugo", "I1", "ex1", genre="Roman")
+    b.ajouter_exemplaire("Notre-Dame de Paris", "Victor Hugo", "I2", "ex2", genre="Roman historique")
+    b.ajouter_exemplaire("Le Seigneur des anneaux", "J.R.R. Tolkien", "I3", "ex3", genre="Fantasy")
+    return b
+
+
+def test_prefix_accent_folding_and_field_intersection():
+    b = _biblio()
+    assert [l.ISBN for l in b.rechercher(titre="miser")] == ["I1"]
+    assert [l.ISBN for l in b.rechercher(auteur="hugo")] == ["I1", "I2"]
+    assert [l.ISBN for l in b.rechercher(auteur="victor", genre="histor")] == ["I2"]
+    assert b.rechercher(titre="paris", genre="fantasy") == []
+
+
+def test_fuzzy_matching_and_incremental_updates():
+    b = _biblio()
+    assert [l.ISBN for l in b.rechercher(titre="seigneir", prefixe=False, fuzzy=1)] == ["I3"]
+
+    b.modifier_genre("I3", "Epopee")
+    assert b.rechercher(genre="fantasy") == []
+    assert b.recherche.genres() == ["Epopee", "Roman", "Roman historique"]
+
+    b.supprimer_livre("I1")
+    b.ajouter_livre(Livre("Misery", "Stephen King", "I4"))
+    assert [l.ISBN for l in b.rechercher(titre="miser")] == ["I4"]
+    assert [l.ISBN for l in b.recherche_par_auteur("stephen king")] == ["I4"]
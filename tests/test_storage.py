@@ -0,0 +1,283 @@
+import json
+
+from src.file_manager import BibliothequeAvecFichier
+from src.sqlite_storage import StockageSQLite, migrer_json_vers_sqlite
+from src.storage import StockageJSON, ouvrir_stockage
+from src.user_store import DepotUsers
+from src.users import User
+
+
+def _snapshot(tmp_path):
+    bib_p = tmp_path / "bib.json"
+    users_p = tmp_path / "users.json"
+    b = BibliothequeAvecFichier("Source")
+    b.ajouter_exemplaire("Les Misérables", "Hugo", "I1", "ex1", genre="Roman")
+    b.ajouter_exemplaire("Les Misérables", "Hugo", "I1", "ex2", genre="Roman")
+    b.ajouter_exemplaire("Dune", "Herbert", "I2", "ex3")
+    alice = User.create("alice", "pwd")
+    bob = User.create("bob", "pwd")
+    b.emprunter_exemplaire("I2", alice)
+    b.reserver_livre("I2", user_obj=bob)
+    b.add_review("I1", "alice", 4, "bien")
+    b.ouvrir_journal(str(bib_p))
+    b.checkpoint([alice, bob], str(bib_p), str(users_p))
+    return b, bib_p, users_p
+
+
+def test_migration_round_trip(tmp_path):
+    b, bib_p, users_p = _snapshot(tmp_path)
+    db = migrer_json_vers_sqlite(str(bib_p), str(users_p), tmp_path / "bib.db")
+    assert db._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    b2 = BibliothequeAvecFichier("Migre")
+    db.charger(b2)
+    assert [l.to_dict() for l in b2.livres] == [l.to_dict() for l in b.livres]
+    assert b2.reservations == {"I2": ["bob"]}
+    users = db.charger_users()
+    assert [u.to_dict() for u in users] == json.loads(users_p.read_text(encoding="utf-8"))
+    db.fermer()
+
+
+def test_row_level_writes_and_keyed_reads(tmp_path):
+    b, bib_p, users_p = _snapshot(tmp_path)
+    db = migrer_json_vers_sqlite(str(bib_p), str(users_p), tmp_path / "bib.db")
+    b2 = BibliothequeAvecFichier("Migre")
+    db.charger(b2)
+    alice = db.lire_user("alice")
+
+    b2.retourner_exemplaire("ex3", alice)
+    b2.modifier_genre("I1", "Classique")
+    db.enregistrer(b2, isbns=["I2", "I1"], reservations=["I2"], users=[alice])
+
+    # bob waits for I2: the returned copy is held for him
+    assert db.trouver_exemplaire("ex3")["etat"] == "reserve"
+    assert [l.genre for l in db.lire_livres("I1")] == ["Classique"]
+    assert db.lire_user("alice").loans[0].date_retour_effective is not None
+    assert db.lire_user("nobody") is None
+    # the rewritten ISBNs keep their catalogue position
+    b3 = BibliothequeAvecFichier("Relu")
+    db.charger(b3)
+    assert [l.ISBN for l in b3.livres] == ["I1", "I2"]
+
+    assert db.changer_etat_exemplaire("ex1", "endommage")
+    assert db.lire_livres("I1")[0].disponibles == 1
+    db.fermer()
+
+
+def test_ouvrir_stockage_picks_backend_from_suffix(tmp_path):
+    assert isinstance(ouvrir_stockage(tmp_path / "bib.json", tmp_path / "users.json"), StockageJSON)
+    db = ouvrir_stockage(tmp_path / "bib.sqlite")
+    assert isinstance(db, StockageSQLite)
+    db.fermer()
+
+
+def test_users_store_touches_one_user(tmp_path, monkeypatch):
+    monkeypatch.setattr("src.utils.get_data_dir", lambda: tmp_path)
+    users_p = tmp_path / "users.json"
+    BibliothequeAvecFichier.sauvegarder_users([User.create(n, "pwd") for n in ("alice", "bob", "é/x")], str(users_p))
+    depot = DepotUsers(DepotUsers.chemin_pour(users_p))
+    depot.importer(BibliothequeAvecFichier.charger_users(str(users_p)))
+
+    # a fresh store patches one file without building the other users
+    froid = DepotUsers(depot.dossier)
+    bob_file = froid._chemin("bob")
+    before = bob_file.stat().st_mtime_ns
+    BibliothequeAvecFichier.notifier_user("alice", "Livre disponible: Dune", depot=froid)
+    BibliothequeAvecFichier.notifier_user("carol", "bienvenue", depot=froid)
+    assert bob_file.stat().st_mtime_ns == before
+    assert froid._cache == {}
+    assert froid.lire("alice").notifications == ["Livre disponible: Dune"]
+    assert froid.noms() == ["alice", "bob", "carol", "é/x"]
+
+
+def test_json_backend_keeps_loaded_users_in_sync(tmp_path):
+    users_p = tmp_path / "users.json"
+    BibliothequeAvecFichier.sauvegarder_users([User.create("alice", "pwd"), User.create("bob", "pwd")], str(users_p))
+    stockage = StockageJSON(tmp_path / "bib.json", users_p)
+    users = stockage.charger_users()
+    assert stockage.depot.existe()
+
+    alice = stockage.lire_user("alice")
+    assert alice is next(u for u in users if u.username == "alice")
+    stockage.ajouter_notification("alice", "retard")
+    assert alice.notifications == ["retard"]
+
+    b = BibliothequeAvecFichier("Export")
+    stockage.charger(b)
+    stockage.checkpoint(b, users)
+    exported = {u.username: u for u in BibliothequeAvecFichier.charger_users(str(users_p))}
+    assert exported["alice"].notifications == ["retard"]
+
+
+def test_background_writes_coalesce_in_order(tmp_path):
+    from src.storage import Stockage
+    from src.taches import TachesArrierePlan
+
+    b, bib_p, users_p = _snapshot(tmp_path)
+    stockage = ouvrir_stockage(bib_p, users_p)
+    alice = User.create("alice", "pwd")
+    ecriture = stockage.preparer(b, isbns=["I1"], users=[alice])
+    alice.notifications.append("premier")
+    Stockage.fusionner(ecriture, stockage.preparer(b, users=[alice]))
+    alice.notifications.append("pas encore sauvé")
+
+    planifies, termines, erreurs = [], [], []
+    taches = TachesArrierePlan(lambda ms, fn: planifies.append(fn))
+    taches.soumettre(stockage.ecrire, ecriture, quand_fini=termines.append)
+    taches.soumettre(lambda: 1 / 0, en_erreur=erreurs.append)
+    taches.fermer()
+
+    assert len(planifies) == 1 and taches.en_cours == 0
+    assert len(termines) == 1 and termines[0].conflits == []
+    assert isinstance(erreurs[0], ZeroDivisionError)
+    # the payload was serialized before the last change
+    assert DepotUsers(DepotUsers.chemin_pour(users_p)).lire("alice").notifications == ["premier"]
+
+
+def test_json_storage_keeps_binary_snapshot(tmp_path):
+    b, bib_p, users_p = _snapshot(tmp_path)
+    stockage = ouvrir_stockage(bib_p.with_suffix(".bin"), users_p)
+    assert stockage.bib_filepath == str(bib_p) and stockage.binaire
+    stockage.checkpoint(b, [])
+    assert (tmp_path / "bib.bin").exists()
+
+    # later changes live in the journal, replayed on top of bib.bin
+    b.journal = stockage.journal
+    b.add_review("I2", "bob", 2)
+    stockage.enregistrer(b, isbns=["I2"])
+    c = BibliothequeAvecFichier("Relu")
+    ouvrir_stockage(bib_p, users_p).charger(c)
+    assert [l.to_dict() for l in c.livres] == [l.to_dict() for l in b.livres]
+    assert c.reservations == b.reservations
+
+
+def test_shared_files_merge_and_refuse_conflicting_writes(tmp_path):
+    _, bib_p, users_p = _snapshot(tmp_path)
+    postes = []
+    for _ in range(2):
+        stockage = StockageJSON(bib_p, users_p)
+        b = BibliothequeAvecFichier("Poste")
+        stockage.charger(b)
+        postes.append((stockage, b, stockage.charger_users()))
+    (sa, a, users_a), (sb, b, users_b) = postes
+
+    # different books: both writes go through, each desk merges the other's
+    a.add_review("I1", "alice", 5)
+    assert sa.appliquer(a, users_a, sa.ecrire(sa.preparer(a, isbns=["I1"]))) == []
+    carol = User.create("carol", "pwd")
+    users_b.append(carol)
+    b.add_review("I2", "carol", 3)
+    synchro = sb.ecrire(sb.preparer(b, isbns=["I2"], users=[carol]))
+    assert synchro.conflits == [] and list(synchro.livres) == ["I1"]
+    sb.appliquer(b, users_b, synchro)
+    assert [l.to_dict() for l in b.livres if l.ISBN == "I1"] == [l.to_dict() for l in a.livres if l.ISBN == "I1"]
+    sa.appliquer(a, users_a, sa.synchroniser())
+    assert "carol" in [u.username for u in users_a]
+    assert len(a.trouver_livre("I2").reviews) == 1
+
+    # same book: the second writer is refused and gets the stored state back
+    alice = next(u for u in users_a if u.username == "alice")
+    a.emprunter_exemplaire("I1", alice)
+    sa.appliquer(a, users_a, sa.ecrire(sa.preparer(a, isbns=["I1"], users=[alice])))
+    bob = next(u for u in users_b if u.username == "bob")
+    b.emprunter_exemplaire("I1", bob)
+    synchro = sb.ecrire(sb.preparer(b, isbns=["I1"], users=[bob]))
+    assert synchro.conflits == ["livre I1"]
+    sb.appliquer(b, users_b, synchro)
+    assert b.get_exemplar_statuses("I1") == a.get_exemplar_statuses("I1") == {"disponible": 1, "emprunte": 1, "total": 2}
+    assert bob.loans == [] and DepotUsers(DepotUsers.chemin_pour(users_p)).lire("bob").loans == []
+
+    # a checkpoint waits until the other desk's records are merged, and the
+    # other desk follows across it
+    donnees = sb.preparer_checkpoint(b, users_b)
+    sa.appliquer(a, users_a, sa.ecrire(sa.preparer(a, reservations=["I1"])))
+    assert sb.ecrire_checkpoint(donnees).position[0] == sb.position[0]
+    sb.appliquer(b, users_b, sb.synchroniser())
+    sb.appliquer(b, users_b, sb.ecrire_checkpoint(sb.preparer_checkpoint(b, users_b)))
+    assert sb.position == (sa.position[0] + 1, 0)
+    a.add_review("I2", "alice", 1)
+    sa.appliquer(a, users_a, sa.ecrire(sa.preparer(a, isbns=["I2"])))
+    sb.appliquer(b, users_b, sb.synchroniser())
+    assert [l.to_dict() for l in b.livres] == [l.to_dict() for l in a.livres]
+
+
+def test_write_scheduler_batches_by_policy(tmp_path):
+    import pytest
+    from src.ecritures import PlanificateurEcritures
+    from src.journal import Journal
+    from src.taches import TachesArrierePlan
+
+    b, bib_p, users_p = _snapshot(tmp_path)
+    stockage = ouvrir_stockage(bib_p, users_p)
+    stockage.charger(b)
+    minuteries, resultats = [], []
+    taches = TachesArrierePlan(lambda ms, fn: None)
+    groupees = PlanificateurEcritures(stockage, taches, lambda ms, fn: minuteries.append((ms, fn)),
+                                      delai_ms=50, max_operations=3, quand_fini=resultats.append)
+    for isbn in ("I1", "I2", "I1"):
+        b.add_review(isbn, "alice", 3)
+        groupees.ajouter(stockage.preparer(b, isbns=[isbn]))
+        if isbn == "I2":
+            # within the window: one timer, nothing written yet
+            assert [ms for ms, _ in minuteries] == [50] and groupees.en_attente == 2
+    taches.attendre()
+    assert groupees.en_attente == 0 and len(resultats) == 1
+    assert (groupees.mesures.lots, groupees.mesures.operations, groupees.mesures.plus_grand_lot) == (1, 3, 3)
+    assert groupees.mesures.latence_max >= groupees.mesures.duree_ecriture > 0
+    assert len(Journal.chemin_pour(bib_p).read_text(encoding="utf-8").splitlines()) == 2
+    minuteries[0][1]()  # the timer fires with nothing left to write
+    taches.attendre()
+    assert groupees.mesures.lots == 1
+
+    immediate = PlanificateurEcritures(stockage, taches, lambda ms, fn: minuteries.append((ms, fn)),
+                                       politique="immediate")
+    immediate.ajouter(stockage.preparer(b, isbns=["I1"]))
+    immediate.ajouter(stockage.preparer(b, isbns=["I2"]))
+    taches.fermer()
+    assert immediate.mesures.lots == 2 and len(minuteries) == 1
+    with pytest.raises(ValueError):
+        PlanificateurEcritures(stockage, taches, None, politique="jamais")
+
+
+def test_shared_journal_survives_a_torn_line(tmp_path):
+    _, bib_p, users_p = _snapshot(tmp_path)
+    postes = []
+    for _ in range(2):
+        stockage = StockageJSON(bib_p, users_p)
+        b = BibliothequeAvecFichier("Poste")
+        stockage.charger(b)
+        postes.append((stockage, b, stockage.charger_users()))
+    (sa, a, users_a), (sb, b, users_b) = postes
+
+    # a third desk crashed in the middle of an append
+    with sa.journal.path.open("a", encoding="utf-8") as f:
+        f.write('{"op":"reservations","ISBN":"I')
+    sa.appliquer(a, users_a, sa.synchroniser())
+
+    a.add_review("I1", "alice", 2)
+    assert sa.appliquer(a, users_a, sa.ecrire(sa.preparer(a, isbns=["I1"]))) == []
+    a.add_review("I2", "alice", 4)
+    assert sa.appliquer(a, users_a, sa.ecrire(sa.preparer(a, isbns=["I2"]))) == []
+
+    # the other desk sees both records and its own write is checked against them
+    b.add_review("I1", "bob", 5)
+    synchro = sb.ecrire(sb.preparer(b, isbns=["I1"]))
+    assert synchro.conflits == ["livre I1"] and set(synchro.livres) == {"I1", "I2"}
+    sb.appliquer(b, users_b, synchro)
+    assert [l.to_dict() for l in b.livres] == [l.to_dict() for l in a.livres]
+    sb.appliquer(b, users_b, sb.synchroniser())
+    sa.appliquer(a, users_a, sa.synchroniser())
+    assert sa.position == sb.position == (sa.position[0], sa.journal.path.stat().st_size)
+
+
+def test_incomplete_backend_fails_when_created():
+    import pytest
+    from src.storage import Stockage
+
+    class Partiel(Stockage):
+        def charger(self, biblio):
+            pass
+
+    with pytest.raises(TypeError):
+        Partiel()
+    assert StockageSQLite.__abstractmethods__ == frozenset()